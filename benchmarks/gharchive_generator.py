@@ -0,0 +1,158 @@
+import os
+import gzip
+import json
+import random
+from datetime import datetime, timedelta
+
+# approximate share of each event type in a GHArchive hour
+EVENT_TYPE_WEIGHTS = {
+  'PushEvent': 50,
+  'CreateEvent': 12,
+  'PullRequestEvent': 8,
+  'WatchEvent': 8,
+  'IssueCommentEvent': 7,
+  'DeleteEvent': 4,
+  'PullRequestReviewEvent': 3,
+  'IssuesEvent': 3,
+  'ForkEvent': 2,
+  'ReleaseEvent': 1,
+  'GollumEvent': 1,
+  'MemberEvent': 1,
+}
+
+def generate_hourly_file(path, process_date: datetime, event_count: int, seed: int = 0,
+                         repo_count: int = None, user_count: int = None) -> int:
+  """
+  Write a synthetic GHArchive hourly file, one gzipped JSON event per line, with the
+  attributes and nested payloads of the real events. The output only depends on the arguments.
+
+  :param path: Path of the .json.gz file to write.
+  :param process_date: The hour the events are created in.
+  :param event_count: Number of events to write.
+  :param seed: Seed of the random generator.
+  :param repo_count: Number of distinct repos, defaults to a tenth of the events.
+  :param user_count: Number of distinct users, defaults to a fifth of the events.
+  :return: Size of the written file in bytes.
+  """
+  rng = random.Random(f"{seed}-{process_date.isoformat()}-{event_count}")
+  repo_count = repo_count or max(1, event_count // 10)
+  user_count = user_count or max(1, event_count // 5)
+  event_types = list(EVENT_TYPE_WEIGHTS)
+  weights = list(EVENT_TYPE_WEIGHTS.values())
+  first_event_id = int(process_date.strftime("%Y%m%d%H")) * 10 ** 6
+  os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+  with gzip.open(path, 'wt', compresslevel=6) as f:
+    for i in range(event_count):
+      event_type = rng.choices(event_types, weights)[0]
+      # a few repos and users account for most of the activity, like on GitHub
+      repo_id = _skewed_id(rng, repo_count)
+      user_id = _skewed_id(rng, user_count)
+      created_at = process_date + timedelta(seconds=rng.randrange(3600))
+      event = {
+        'id': str(first_event_id + i),
+        'type': event_type,
+        'actor': {
+          'id': user_id,
+          'login': f"user{user_id}",
+          'display_login': f"user{user_id}",
+          'gravatar_id': "",
+          'url': f"https://api.github.com/users/user{user_id}",
+          'avatar_url': f"https://avatars.githubusercontent.com/u/{user_id}?",
+        },
+        'repo': {
+          'id': repo_id,
+          'name': f"org{repo_id % 997}/repo{repo_id}",
+          'url': f"https://api.github.com/repos/org{repo_id % 997}/repo{repo_id}",
+        },
+        'payload': _payload(rng, event_type, repo_id, user_id),
+        'public': True,
+        'created_at': created_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+      }
+      if rng.random() < 0.2:
+        event['org'] = {'id': repo_id % 997, 'login': f"org{repo_id % 997}"}
+      f.write(json.dumps(event, separators=(',', ':')) + "\n")
+  return os.path.getsize(path)
+
+def _skewed_id(rng: random.Random, count: int) -> int:
+  """Draw an id in [1, count] following a heavy tailed distribution."""
+  return min(count, int(rng.paretovariate(1.2)))
+
+def _sha(rng: random.Random) -> str:
+  return "%040x" % rng.getrandbits(160)
+
+def _text(rng: random.Random, min_words: int, max_words: int) -> str:
+  words = ["fix", "add", "update", "refactor", "test", "docs", "bump", "remove", "parser", "cache",
+           "build", "config", "release", "typo", "api", "error", "handling", "support", "the", "for"]
+  return " ".join(rng.choice(words) for _ in range(rng.randint(min_words, max_words)))
+
+def _payload(rng: random.Random, event_type, repo_id, user_id) -> dict:
+  """Build a payload with the nested structure of the given event type."""
+  if event_type == 'PushEvent':
+    size = rng.choice([1, 1, 1, 2, 3, 5, 20])
+    return {
+      'repository_id': repo_id,
+      'push_id': rng.getrandbits(40),
+      'size': size,
+      'distinct_size': size,
+      'ref': "refs/heads/main",
+      'head': _sha(rng),
+      'before': _sha(rng),
+      'commits': [{
+        'sha': _sha(rng),
+        'author': {'email': f"user{user_id}@users.noreply.github.com", 'name': f"user{user_id}"},
+        'message': _text(rng, 2, 40),
+        'distinct': True,
+        'url': f"https://api.github.com/repos/org/repo{repo_id}/commits/{_sha(rng)}",
+      } for _ in range(min(size, 20))],
+    }
+  if event_type in ('CreateEvent', 'DeleteEvent'):
+    return {'ref': f"feature-{rng.getrandbits(16)}", 'ref_type': rng.choice(['branch', 'tag']),
+            'master_branch': "main", 'description': _text(rng, 0, 12), 'pusher_type': "user"}
+  if event_type in ('PullRequestEvent', 'PullRequestReviewEvent'):
+    number = rng.randint(1, 5000)
+    return {
+      'action': rng.choice(['opened', 'closed', 'reopened', 'created']),
+      'number': number,
+      'pull_request': {
+        'id': rng.getrandbits(32),
+        'number': number,
+        'state': rng.choice(['open', 'closed']),
+        'title': _text(rng, 3, 12),
+        'body': _text(rng, 0, 120),
+        'user': {'id': user_id, 'login': f"user{user_id}"},
+        'labels': [{'name': rng.choice(['bug', 'enhancement', 'dependencies'])} for _ in range(rng.randint(0, 3))],
+        'head': {'ref': f"feature-{rng.getrandbits(16)}", 'sha': _sha(rng)},
+        'base': {'ref': "main", 'sha': _sha(rng)},
+        'additions': rng.randint(0, 2000),
+        'deletions': rng.randint(0, 2000),
+        'changed_files': rng.randint(1, 50),
+      },
+    }
+  if event_type in ('IssuesEvent', 'IssueCommentEvent'):
+    payload = {
+      'action': rng.choice(['opened', 'closed', 'created']),
+      'issue': {
+        'id': rng.getrandbits(32),
+        'number': rng.randint(1, 5000),
+        'title': _text(rng, 3, 12),
+        'body': _text(rng, 0, 150),
+        'user': {'id': user_id, 'login': f"user{user_id}"},
+        'labels': [{'name': rng.choice(['bug', 'question', 'wontfix'])} for _ in range(rng.randint(0, 2))],
+        'comments': rng.randint(0, 40),
+      },
+    }
+    if event_type == 'IssueCommentEvent':
+      payload['comment'] = {'id': rng.getrandbits(32), 'body': _text(rng, 1, 80),
+                            'user': {'id': user_id, 'login': f"user{user_id}"}}
+    return payload
+  if event_type == 'ForkEvent':
+    return {'forkee': {'id': rng.getrandbits(32), 'name': f"repo{repo_id}", 'full_name': f"user{user_id}/repo{repo_id}",
+                       'owner': {'id': user_id, 'login': f"user{user_id}"}, 'fork': True}}
+  if event_type == 'ReleaseEvent':
+    return {'action': "published", 'release': {'id': rng.getrandbits(32), 'tag_name': f"v{rng.randint(0, 9)}.{rng.randint(0, 20)}",
+                                               'name': _text(rng, 1, 4), 'body': _text(rng, 10, 200), 'assets': []}}
+  if event_type == 'GollumEvent':
+    return {'pages': [{'page_name': _text(rng, 1, 3), 'action': "edited", 'sha': _sha(rng)}]}
+  if event_type == 'MemberEvent':
+    return {'action': "added", 'member': {'id': rng.getrandbits(24), 'login': f"user{rng.getrandbits(16)}"}}
+  return {'action': "started"}
@@ -0,0 +1,98 @@
+import threading
+import functools
+import logging
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+class LocalS3Server:
+  """
+  An in-process S3 compatible endpoint backed by moto, standing in for the data lake buckets.
+  Requires the moto[server] package, see benchmarks/requirements.txt.
+  """
+  def __init__(self, port: int = 0):
+    """
+    Initialise the LocalS3Server.
+
+    :param port: Port to listen on, 0 picks a free port.
+    """
+    try:
+      from moto.server import ThreadedMotoServer
+    except ImportError as e:
+      raise RuntimeError("The local S3 server needs moto[server], install benchmarks/requirements.txt") from e
+    self._server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+
+  def start(self) -> None:
+    # the embedded server logs every request otherwise
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    self._server.start()
+    logging.info(f"Local S3 server listening on {self.endpoint_url}")
+
+  def stop(self) -> None:
+    self._server.stop()
+
+  @property
+  def endpoint(self) -> str:
+    """host:port of the server, as the DuckDB s3_endpoint setting expects."""
+    host, port = self._server.get_host_and_port()
+    return f"{host}:{port}"
+
+  @property
+  def endpoint_url(self) -> str:
+    """URL of the server, as boto3 expects."""
+    return f"http://{self.endpoint}"
+
+  def create_buckets(self, bucket_names: list) -> None:
+    """Create the given buckets on the server."""
+    import boto3
+    s3_client = boto3.client('s3', endpoint_url=self.endpoint_url, region_name='us-east-1',
+                             aws_access_key_id='benchmark', aws_secret_access_key='benchmark')
+    for bucket_name in bucket_names:
+      s3_client.create_bucket(Bucket=bucket_name)
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, *args):
+    self.stop()
+    return False
+
+class LocalHTTPFileServer:
+  """
+  A local HTTP server serving a directory of hourly files, standing in for data.gharchive.org.
+  """
+  def __init__(self, directory, port: int = 0):
+    """
+    Initialise the LocalHTTPFileServer.
+
+    :param directory: Directory holding the files to serve.
+    :param port: Port to listen on, 0 picks a free port.
+    """
+    handler = functools.partial(_QuietRequestHandler, directory=directory)
+    self._server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+  def start(self) -> None:
+    self._thread.start()
+    logging.info(f"Local HTTP file server listening on {self.url}")
+
+  def stop(self) -> None:
+    self._server.shutdown()
+    self._server.server_close()
+
+  @property
+  def url(self) -> str:
+    host, port = self._server.server_address[:2]
+    return f"http://{host}:{port}"
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, *args):
+    self.stop()
+    return False
+
+class _QuietRequestHandler(SimpleHTTPRequestHandler):
+  """Serves the files without logging every request to stderr."""
+  def log_message(self, format, *args):
+    pass
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+import sys
+import os
+import json
+import time
+import logging
+import argparse
+import platform
+import statistics
+import tempfile
+import configparser
+import multiprocessing
+from datetime import datetime, timedelta
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.gharchive_generator import generate_hourly_file
+from benchmarks.local_services import LocalS3Server, LocalHTTPFileServer
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+STAGES = ['ingest', 'serialise', 'aggregate']
+DATASET_BASE_PATH = 'gharchive/events'
+BUCKETS = {'bronze_bucket': 'bronze', 'silver_bucket': 'silver', 'gold_bucket': 'gold'}
+# sections of a tuning config copied into the benchmark config, the others point at the local services
+TUNING_SECTIONS = ['ingest', 'transformer', 'duckdb', 'parquet']
+
+class RecordingMetricsSink:
+  """Keeps the stage metrics records emitted in the benchmark process."""
+  def __init__(self):
+    self.records = []
+
+  def emit(self, record):
+    self.records.append(record)
+
+def write_benchmark_config(config_path, s3_server: LocalS3Server, http_server: LocalHTTPFileServer, tuning_config=None) -> None:
+  """
+  Write the config file pointing the pipeline at the local services.
+
+  :param config_path: Path of the config file to write.
+  :param tuning_config: Optional config file whose tuning sections are benchmarked.
+  """
+  config = configparser.ConfigParser()
+  if tuning_config:
+    tuning = configparser.ConfigParser()
+    tuning.read(tuning_config)
+    for section in TUNING_SECTIONS:
+      if tuning.has_section(section):
+        config[section] = dict(tuning[section])
+  config.read_dict({
+    'aws': {
+      's3_access_key_id': 'benchmark',
+      's3_secret_access_key': 'benchmark',
+      's3_region_name': 'us-east-1',
+      's3_endpoint_url': s3_server.endpoint_url,
+      's3_endpoint': s3_server.endpoint,
+      's3_region': 'us-east-1',
+      's3_url_style': 'path',
+      's3_use_ssl': 'false',
+    },
+    'datalake': BUCKETS,
+    'ingest': {'source_url': http_server.url},
+    'manifest': {'enabled': 'false'},
+    'metrics': {'enabled': 'false'},
+  })
+  with open(config_path, 'w') as f:
+    config.write(f)
+
+def run_stage(stage, process_date: datetime, config_path) -> dict:
+  """
+  Run a single pipeline stage and measure it. Called in a fresh process,
+  so the peak RSS only covers this stage.
+  """
+  os.environ['PIPELINE_CONFIG'] = config_path
+  from data_lake_ingester import DataLakeIngester
+  from data_lake_transformer import DataLakeTransformer
+  from pipeline_metrics import peak_rss_bytes
+  sink = RecordingMetricsSink()
+  start_time = time.perf_counter()
+  if stage == 'ingest':
+    # every run transfers the file, the unchanged bronze object would be skipped otherwise
+    DataLakeIngester(DATASET_BASE_PATH, metrics_sink=sink).ingest_hourly_gharchive(process_date, force=True)
+  elif stage == 'serialise':
+    DataLakeTransformer(DATASET_BASE_PATH, metrics_sink=sink).serialise_raw_data(process_date)
+  else:
+    DataLakeTransformer(DATASET_BASE_PATH, metrics_sink=sink).aggregate_silver_data(process_date)
+  seconds = time.perf_counter() - start_time
+  record = sink.records[-1] if sink.records else {}
+  peak_buffer_memory = max([step.get('peak_buffer_memory') or 0 for step in record.get('steps', [])] + [0])
+  return {
+    'seconds': seconds,
+    'peak_rss_mb': round(peak_rss_bytes() / (1024 * 1024), 1),
+    'duckdb_peak_buffer_mb': round(peak_buffer_memory / (1024 * 1024), 1),
+    'rows_in': record.get('rows_in'),
+    'rows_out': record.get('rows_out'),
+  }
+
+def run_benchmarks(sizes: list, repeat: int, data_dir, tuning_config=None) -> dict:
+  """
+  Benchmark the ingest, serialise and aggregate stages for every data size against local services.
+
+  :param sizes: List of the event counts of the generated hourly files.
+  :param repeat: Number of runs of every stage, the median time is reported.
+  :param data_dir: Directory holding the generated files, they are reused when present.
+  :param tuning_config: Optional config file whose tuning sections are benchmarked.
+  :return: Dictionary with the environment and the results keyed by stage/size.
+  """
+  import duckdb
+  # every size gets its own day so that the daily aggregation only reads its own data
+  process_dates = {size: datetime(2024, 1, 1) + timedelta(days=i) for i, size in enumerate(sizes)}
+  source_dir = os.path.join(data_dir, 'source')
+  input_bytes = {}
+  for size, process_date in process_dates.items():
+    source_file = os.path.join(source_dir, f"{process_date.strftime('%Y-%m-%d')}-{process_date.hour}.json.gz")
+    if not os.path.exists(source_file):
+      logging.info(f"Generating {size} events into {source_file}")
+      generate_hourly_file(source_file, process_date, size)
+    input_bytes[size] = os.path.getsize(source_file)
+  results = {}
+  # the stages run in fresh processes, which the parent serves through the local services
+  spawn = multiprocessing.get_context('spawn')
+  with LocalS3Server() as s3_server, LocalHTTPFileServer(source_dir) as http_server:
+    s3_server.create_buckets(list(BUCKETS.values()))
+    config_path = os.path.join(data_dir, 'benchmark_config.ini')
+    write_benchmark_config(config_path, s3_server, http_server, tuning_config)
+    for size, process_date in process_dates.items():
+      for stage in STAGES:
+        runs = []
+        for _ in range(repeat):
+          with spawn.Pool(1) as pool:
+            runs.append(pool.apply(run_stage, (stage, process_date, config_path)))
+        seconds = statistics.median(run['seconds'] for run in runs)
+        result = dict(runs[-1])
+        result.update({
+          'events': size,
+          'input_bytes': input_bytes[size],
+          'seconds': round(seconds, 4),
+          'events_per_second': round(size / seconds),
+          'input_mb_per_second': round(input_bytes[size] / seconds / (1024 * 1024), 2),
+          'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+        })
+        results[f"{stage}/{size}"] = result
+        logging.info(f"{stage} of {size} events: {result['seconds']}s, {result['events_per_second']} events/s, "
+                     f"peak RSS {result['peak_rss_mb']} MB")
+  return {
+    'created_at': datetime.utcnow().isoformat(),
+    'python': platform.python_version(),
+    'duckdb': duckdb.__version__,
+    'platform': platform.platform(),
+    'cpu_count': os.cpu_count(),
+    'results': results,
+  }
+
+def compare_to_baseline(report: dict, baseline: dict, tolerance: float) -> list:
+  """
+  Compare benchmark results with a stored baseline.
+
+  :param report: The report produced by run_benchmarks.
+  :param baseline: A report stored earlier.
+  :param tolerance: Relative slowdown or memory growth accepted, e.g. 0.25 for 25%.
+  :return: List of the regressions found, as readable messages.
+  """
+  regressions = []
+  for key, result in sorted(report['results'].items()):
+    baseline_result = baseline.get('results', {}).get(key)
+    if baseline_result is None:
+      continue
+    for metric in ('seconds', 'peak_rss_mb'):
+      current, reference = result.get(metric), baseline_result.get(metric)
+      if current is not None and reference and current > reference * (1 + tolerance):
+        regressions.append(f"{key} {metric} regressed: {current} vs baseline {reference} (+{(current / reference - 1):.0%})")
+  return regressions
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic GHArchive data against local S3 and HTTP services")
+  parser.add_argument("--sizes", default="10000,100000,500000", help="comma separated event counts of the hourly files")
+  parser.add_argument("--repeat", type=int, default=3, help="runs of every stage, the median time is reported")
+  parser.add_argument("--data-dir", help="directory to keep the generated files in, a temporary one by default")
+  parser.add_argument("--tuning-config", help="config.ini whose [ingest], [transformer], [duckdb] and [parquet] sections are benchmarked")
+  parser.add_argument("--output", help="write the report to this JSON file")
+  parser.add_argument("--baseline", help="compare the report with this stored JSON report")
+  parser.add_argument("--tolerance", type=float, default=0.25, help="relative regression accepted against the baseline")
+  args = parser.parse_args()
+  sizes = [int(size) for size in args.sizes.split(',')]
+  with tempfile.TemporaryDirectory(prefix='pipeline_benchmark_') as tmp_dir:
+    report = run_benchmarks(sizes, args.repeat, args.data_dir or tmp_dir, args.tuning_config)
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
+    logging.info(f"Benchmark report written to {args.output}")
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    regressions = compare_to_baseline(report, baseline, args.tolerance)
+    for regression in regressions:
+      logging.error(regression)
+    if regressions:
+      sys.exit(1)
+    logging.info(f"No regression against {args.baseline}")
+
+if __name__ == "__main__":
+  main()
@@ -1,58 +1,251 @@
 import os
 import io
+import time
+import shutil
+import tempfile
+import threading
 import requests
 import boto3
-from datetime import datetime
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 import configparser
 import logging
+from lake_manifest import LakeManifest
+from object_cache import LocalObjectCache, parse_byte_size
+from pipeline_metrics import PipelineMetrics, StageMetrics
+
+# HTTP headers of the source files, mapped to the S3 user metadata the bronze objects keep them in
+SOURCE_METADATA_HEADERS = {
+  'ETag': 'source-etag',
+  'Content-Length': 'source-content-length',
+  'Last-Modified': 'source-last-modified',
+}
 
 class DataLakeIngester:
   
-  def __init__(self,dataset_base_path):
+  def __init__(self,dataset_base_path, metrics_sink=None):
     """ 
     Initialise the DataLakeIngester. 
     :param dataset_base_path: The key prefix to use for this dataset
+    :param metrics_sink: Optional sink for the stage metrics records, overriding the [metrics] config section.
     """
     # set the logging level and format
     logging.basicConfig(level=logging.INFO, 
                         format='%(asctime)s - %(levelname)s - %(message)s')
     self.dataset_base_path = dataset_base_path
     self.config = self._load_config()
+    self.manifest = self._lake_manifest()
+    self.metrics = PipelineMetrics(self.config, metrics_sink)
+    # the HTTP session and S3 client are created lazily and shared by all workers
+    self._client_lock = threading.Lock()
+    self._session = None
+    self._s3 = None
+    self.object_cache = self._object_cache()
   
-  def ingest_hourly_gharchive(self, process_date: datetime):
+  def ingest_hourly_gharchive(self, process_date: datetime, stream: bool = None, force: bool = False,
+                              spool_path=None) -> bool:
     """
     Ingest hourly data from GHArchive and upload to S3.
+    The transfer is skipped when the bronze object was uploaded from the same version of the
+    source file, as told by the ETag, Content-Length and Last-Modified of a HEAD request.
+
+    :param process_date: the process date corresponding to the hourly partition to ingest
+    :param stream: Pipe the download straight into a multipart upload instead of
+                   buffering the whole file. Defaults to the `stream_upload` config option.
+    :param force: Download and upload the file even when the bronze object is unchanged.
+    :param spool_path: Optional local path the downloaded bytes are also written to, as they are uploaded.
+                       Nothing is written when the transfer is skipped. When the object cache is enabled,
+                       the bytes are always spooled and added to the cache, so serialising the hour reads them locally.
+    :return: True if the file was transferred, False if it was skipped as unchanged.
     """
-    # The format of the Hourly json dump files is YYYY-MM-DD-H.json.gz
-    # with Hour part without leading zero when single digit
-    date_hour = datetime.strftime(process_date, "%Y-%m-%d-%-H")
-    data_filename = f"{date_hour}.json.gz"
-    data_url = f"http://data.gharchive.org/{data_filename}"
+    data_filename = self._source_filename(process_date)
+    data_url = f"{self._source_base_url()}/{data_filename}"
     s3_bucket = self._bronze_bucket_name()
     s3_key = self._generate_sink_key(process_date,data_filename,self.dataset_base_path)
-    data = self.collect_data(data_url)
-    self.upload_to_s3(data,s3_bucket,s3_key)
+    if stream is None:
+      stream = self._stream_upload_enabled()
+    with self.metrics.stage('ingest', process_date) as stage_metrics:
+      source_metadata = self.source_metadata(data_url)
+      unchanged_object = None if force else self._unchanged_bronze_object(s3_bucket, s3_key, source_metadata)
+      if unchanged_object is not None:
+        logging.info(f"Skipping {data_url}, {s3_key} in {s3_bucket} is unchanged")
+        stage_metrics.add('skipped_unchanged', 1)
+        self._record_bronze_object(process_date,s3_bucket,s3_key,unchanged_object['ContentLength'])
+        return False
+      cache_spool_dir = None
+      if spool_path is None and self.object_cache is not None:
+        cache_spool_dir = tempfile.mkdtemp(prefix='ingest_', dir=self._spool_directory())
+        spool_path = os.path.join(cache_spool_dir, data_filename)
+      try:
+        spool_file = open(spool_path, 'wb') if spool_path else None
+        try:
+          if stream:
+            self.stream_to_s3(data_url,s3_bucket,s3_key,stage_metrics,source_metadata,spool_file)
+          else:
+            data = self.collect_data(data_url,stage_metrics)
+            if spool_file is not None:
+              spool_file.write(data.getbuffer())
+            self.upload_to_s3(data,s3_bucket,s3_key,stage_metrics=stage_metrics,metadata=source_metadata)
+        finally:
+          if spool_file is not None:
+            spool_file.close()
+        uploaded_size = self._verify_upload(s3_bucket, s3_key, source_metadata)
+        if self.object_cache is not None:
+          self.object_cache.add(f"s3://{s3_bucket}/{s3_key}", spool_path)
+      finally:
+        if cache_spool_dir is not None:
+          shutil.rmtree(cache_spool_dir, ignore_errors=True)
+      self._record_bronze_object(process_date,s3_bucket,s3_key,uploaded_size)
+      return True
+
+  def ingest_and_serialise_hourly(self, process_date: datetime, transformer, stream: bool = None, force: bool = False) -> bool:
+    """
+    Ingest an hour and serialise it to the silver zone from the same download. The downloaded bytes
+    are written to a local spool file while they are uploaded to bronze, then the silver file is
+    built from the spool instead of reading the bronze object back from S3.
+    Bronze stays the source of truth: the spool is only read once the upload succeeded.
+
+    :param process_date: the process date corresponding to the hourly partition
+    :param transformer: DataLakeTransformer serialising the hour.
+    :param stream: Pipe the download straight into a multipart upload. Defaults to the `stream_upload` config option.
+    :param force: Download and upload the file even when the bronze object is unchanged.
+    :return: True if the file was transferred, False if it was skipped as unchanged.
+    """
+    spool_dir = tempfile.mkdtemp(prefix='ingest_', dir=self._spool_directory())
+    try:
+      spool_path = os.path.join(spool_dir, self._source_filename(process_date))
+      transferred = self.ingest_hourly_gharchive(process_date, stream, force, spool_path)
+      # an unchanged bronze object is not downloaded, so it is serialised from S3 as usual
+      transformer.serialise_raw_data(process_date, source_path=spool_path if transferred else None)
+      return transferred
+    finally:
+      shutil.rmtree(spool_dir, ignore_errors=True)
+
+  def ingest_gharchive_range(self, start_date: datetime, end_date: datetime, max_workers: int = None, force: bool = False) -> list:
+    """
+    Backfill hourly GHArchive data for a date-hour range using a pool of workers.
+    Every hour is retried with exponential backoff before it is reported as failed.
+    Hours whose bronze object is unchanged are skipped, unless forced.
+
+    :param start_date: the first hourly partition to ingest
+    :param end_date: the last hourly partition to ingest (inclusive)
+    :param max_workers: number of hours ingested concurrently. Defaults to the `backfill_max_workers` config option.
+    :param force: Transfer every hour even when its bronze object is unchanged.
+    :return: List of the process dates that could not be ingested.
+    """
+    if max_workers is None:
+      max_workers = self.config.getint('ingest', 'backfill_max_workers', fallback=8)
+    process_dates = self._hourly_range(start_date, end_date)
+    logging.info(f"Backfilling {len(process_dates)} hours from {start_date} to {end_date} with {max_workers} workers")
+    failed_dates = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+      futures = {executor.submit(self._ingest_hour_with_retry, process_date, force): process_date
+                 for process_date in process_dates}
+      for future in as_completed(futures):
+        process_date = futures[future]
+        try:
+          future.result()
+        except Exception as e:
+          logging.error(f"Giving up on ingesting {process_date}: {e}")
+          failed_dates.append(process_date)
+    logging.info(f"Backfill finished: {len(process_dates) - len(failed_dates)} succeeded, {len(failed_dates)} failed")
+    return sorted(failed_dates)
   
-  def collect_data(self, data_url):
+  def bronze_object_exists(self, process_date: datetime) -> bool:
+    """
+    Check if the bronze object of an hourly partition has landed on S3.
+
+    :param process_date: the process date corresponding to the hourly partition
+    """
+    s3_key = self._generate_sink_key(process_date,self._source_filename(process_date),self.dataset_base_path)
+    try:
+      self._s3_client().head_object(Bucket=self._bronze_bucket_name(), Key=s3_key)
+      return True
+    except ClientError as e:
+      if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+        return False
+      raise
+
+  def source_metadata(self, data_url) -> dict:
+    """
+    Get the version of a source file from the headers of a HEAD request.
+
+    :param data_url: URL of the source file.
+    :return: Dictionary of the S3 user metadata describing the file, empty when the source does not tell.
+    """
+    try:
+      response = self._http_session().head(data_url, allow_redirects=True)
+    except requests.RequestException as e:
+      logging.warning(f"Failed to get the headers of {data_url}: {e}")
+      return {}
+    if response.status_code != 200:
+      logging.warning(f"Failed to get the headers of {data_url}. Status code: {response.status_code}")
+      return {}
+    return {metadata_key: response.headers[header] for header, metadata_key in SOURCE_METADATA_HEADERS.items()
+            if header in response.headers}
+
+  def collect_data(self, data_url, stage_metrics: StageMetrics = None):
     """
     Download data from the GHArchive URL.
+
+    :param stage_metrics: Optional StageMetrics counting the downloaded bytes.
     """
     logging.info(f"The URL to download is: {data_url}")
-    response = requests.get(data_url)
+    response = self._http_session().get(data_url)
     if response.status_code == 200:
+      if stage_metrics is not None:
+        stage_metrics.add('bytes_downloaded', len(response.content))
       return io.BytesIO(response.content)
     else:
       logging.error(f"Failed to download file from {data_url}. Status code: {response.status_code}") 
       # This will raise an HTTPError for non-200 status codes
       response.raise_for_status() 
 
-  def upload_to_s3(self, data, bucket, key):
+  def stream_to_s3(self, data_url, bucket, key, stage_metrics: StageMetrics = None, metadata: dict = None, spool_file=None):
+    """
+    Stream data from the GHArchive URL into a multipart S3 upload.
+    The response body is read in fixed size chunks while earlier chunks are
+    uploaded, so download and upload overlap and peak memory is bounded by
+    the stream transfer config rather than the file size.
+
+    :param stage_metrics: Optional StageMetrics counting the downloaded and uploaded bytes.
+    :param metadata: Optional S3 user metadata stored with the object.
+    :param spool_file: Optional local file the streamed bytes are also written to.
+    """
+    logging.info(f"The URL to stream is: {data_url}")
+    with self._http_session().get(data_url, stream=True) as response:
+      if response.status_code != 200:
+        logging.error(f"Failed to download file from {data_url}. Status code: {response.status_code}")
+        response.raise_for_status()
+      # keep the body as served (gzip) rather than letting urllib3 decode it
+      response.raw.decode_content = False
+      body = _TeeReader(response.raw, spool_file) if spool_file is not None else response.raw
+      self.upload_to_s3(body,bucket,key,self._stream_transfer_config(),stage_metrics,metadata)
+      if stage_metrics is not None:
+        # bytes read off the socket, the body is not decoded
+        stage_metrics.add('bytes_downloaded', response.raw.tell())
+
+  def upload_to_s3(self, data, bucket, key, transfer_config: TransferConfig = None, stage_metrics: StageMetrics = None,
+                   metadata: dict = None):
     """
-    Upload data to S3.
+    Upload data to S3. Every part is sent with a checksum S3 verifies before storing it.
+
+    :param data: File-like object to upload, it does not need to be seekable.
+    :param transfer_config: Optional boto3 TransferConfig for the upload.
+    :param stage_metrics: Optional StageMetrics counting the uploaded bytes.
+    :param metadata: Optional S3 user metadata stored with the object.
     """
     s3_client = self._s3_client()
+    extra_args = {'ChecksumAlgorithm': self.config.get('ingest', 'upload_checksum_algorithm', fallback='CRC32')}
+    if metadata:
+      extra_args['Metadata'] = metadata
     try:
-      s3_client.upload_fileobj(data, bucket, key,Callback=self._s3_progress_callback)
+      progress_callback = self._s3_progress_callback(bucket, key, stage_metrics)
+      s3_client.upload_fileobj(data, bucket, key,ExtraArgs=extra_args,Callback=progress_callback,Config=transfer_config)
+      progress_callback.finish()
       logging.info(f"Successfully uploaded {key} to {bucket}")
     except boto3.exceptions.S3UploadFailedError as e:
       logging.error(f"Failed to upload {key} to {bucket}: {e}")
@@ -66,15 +259,130 @@ class DataLakeIngester:
     Load configuration from the given path.
     """
     config = configparser.ConfigParser()
-    config_path = os.path.join(os.path.dirname(__file__), 'config.ini')
+    # the PIPELINE_CONFIG environment variable points every component at another config file
+    config_path = os.environ.get('PIPELINE_CONFIG', os.path.join(os.path.dirname(__file__), 'config.ini'))
     config.read(config_path)
     return config
 
+  def _lake_manifest(self):
+    """ Open the lake manifest if it is enabled in the config file """
+    if not self.config.getboolean('manifest', 'enabled', fallback=False):
+      return None
+    # relative paths are resolved against the directory of this module, like config.ini
+    manifest_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 self.config.get('manifest', 'path', fallback='lake_manifest.duckdb'))
+    return LakeManifest(manifest_path)
+
+  def _object_cache(self):
+    """ Open the local object cache if it is enabled in the config file """
+    if not self.config.getboolean('cache', 'enabled', fallback=False):
+      return None
+    # relative paths are resolved against the directory of this module, like config.ini
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             self.config.get('cache', 'path', fallback='object_cache'))
+    return LocalObjectCache(cache_dir, parse_byte_size(self.config.get('cache', 'max_size', fallback='10GB')), self._s3_client)
+
+  def _record_bronze_object(self, process_date: datetime, bucket, key, byte_size: int = None) -> None:
+    """
+    Record an uploaded bronze object in the manifest, if it is enabled.
+    
+    :param byte_size: Size of the object, when a HEAD request already returned it. Looked up otherwise.
+    """
+    if self.manifest is None:
+      return
+    if byte_size is None:
+      byte_size = self._s3_client().head_object(Bucket=bucket, Key=key)['ContentLength']
+    self.manifest.record_file(f"s3://{bucket}/{key}", 'bronze', self.dataset_base_path,
+                              process_date, process_date.hour, byte_size=byte_size)
+
+  def _unchanged_bronze_object(self, bucket, key, source_metadata: dict) -> dict:
+    """
+    Check if the bronze object exists and was uploaded from the source file version described by the metadata.
+    
+    :return: The HEAD response of the unchanged object, so its size is not looked up again, or None.
+    """
+    if not source_metadata:
+      return None
+    try:
+      response = self._s3_client().head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+      if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+        return None
+      raise
+    stored_metadata = response.get('Metadata', {})
+    if all(stored_metadata.get(metadata_key) == value for metadata_key, value in source_metadata.items()):
+      return response
+    return None
+
+  def _verify_upload(self, bucket, key, source_metadata: dict) -> int:
+    """
+    Check the size of an uploaded object against the Content-Length of its source. A truncated
+    object is deleted, so that it is not taken for an unchanged copy of the source later on.
+    
+    :return: Size of the uploaded object, or None when the source has no Content-Length to check against.
+    """
+    expected_size = source_metadata.get('source-content-length')
+    if expected_size is None:
+      return None
+    s3_client = self._s3_client()
+    object_size = s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+    if object_size != int(expected_size):
+      s3_client.delete_object(Bucket=bucket, Key=key)
+      raise IOError(f"Uploaded {key} to {bucket} has {object_size} bytes, expected {expected_size}")
+    return object_size
+
+  def _ingest_hour_with_retry(self, process_date: datetime, force: bool = False) -> None:
+    """ Ingest a single hour, retrying with exponential backoff """
+    max_retries = self.config.getint('ingest', 'max_retries', fallback=3)
+    backoff_seconds = self.config.getfloat('ingest', 'retry_backoff_seconds', fallback=2)
+    for attempt in range(max_retries + 1):
+      try:
+        return self.ingest_hourly_gharchive(process_date, force=force)
+      except Exception as e:
+        if attempt == max_retries:
+          raise
+        delay = backoff_seconds * (2 ** attempt)
+        logging.warning(f"Attempt {attempt + 1} to ingest {process_date} failed: {e}. Retrying in {delay}s")
+        time.sleep(delay)
+
+  def _hourly_range(self, start_date: datetime, end_date: datetime) -> list:
+    """ List the hourly partitions between two dates, both inclusive """
+    current = start_date.replace(minute=0, second=0, microsecond=0)
+    process_dates = []
+    while current <= end_date:
+      process_dates.append(current)
+      current += timedelta(hours=1)
+    return process_dates
+
+  def _pool_size(self) -> int:
+    """ Connection pool size needed by the concurrent backfill and upload threads """
+    max_workers = self.config.getint('ingest', 'backfill_max_workers', fallback=8)
+    upload_concurrency = self.config.getint('ingest', 'stream_upload_concurrency', fallback=4)
+    return max(10, max_workers * upload_concurrency)
+
+  def _http_session(self) -> requests.Session:
+    """
+    Get the HTTP session shared by all downloads, creating it on first use.
+    """
+    with self._client_lock:
+      if self._session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size())
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self._session = session
+      return self._session
+
   def _s3_client(self):
     """
-    Create an S3 client using the loaded credentials.
+    Get the S3 client shared by all uploads, creating it on first use
+    with the loaded credentials and a connection pool sized for the workers.
     """
-    return boto3.client('s3',**self._get_s3_credentials())
+    with self._client_lock:
+      if self._s3 is None:
+        self._s3 = boto3.client('s3',config=Config(max_pool_connections=self._pool_size()),
+                                **self._get_s3_credentials())
+      return self._s3
 
   def _get_s3_credentials(self):
     """
@@ -92,6 +400,32 @@ class DataLakeIngester:
       credentials["endpoint_url"] = self.config.get('aws', 's3_endpoint_url')
     return credentials
   
+  def _spool_directory(self):
+    """ Local directory of the spool files of ingest_and_serialise_hourly, the system temporary directory by default """
+    spool_directory = self.config.get('ingest', 'spool_directory', fallback=None) or None
+    if spool_directory:
+      os.makedirs(spool_directory, exist_ok=True)
+    return spool_directory
+
+  def _stream_upload_enabled(self) -> bool:
+    """ Check if streaming ingest is enabled in the config file """
+    return self.config.getboolean('ingest', 'stream_upload', fallback=True)
+
+  def _stream_transfer_config(self) -> TransferConfig:
+    """
+    Build the TransferConfig used for streaming uploads.
+    Peak buffered memory is roughly stream_chunk_size_mb x stream_max_buffered_chunks.
+    """
+    chunk_size = self.config.getint('ingest', 'stream_chunk_size_mb', fallback=8) * 1024 * 1024
+    max_buffered_chunks = self.config.getint('ingest', 'stream_max_buffered_chunks', fallback=4)
+    concurrency = self.config.getint('ingest', 'stream_upload_concurrency', fallback=4)
+    transfer_config = TransferConfig(multipart_threshold=chunk_size,
+                                     multipart_chunksize=chunk_size,
+                                     max_concurrency=min(concurrency, max_buffered_chunks))
+    # bounds the chunks read from a non-seekable stream that are not uploaded yet
+    transfer_config.max_in_memory_upload_chunks = max_buffered_chunks
+    return transfer_config
+
   def _bronze_bucket_name(self) -> str:
     """ Get S3 bronze bucket name from the config file"""
     try:
@@ -99,6 +433,17 @@ class DataLakeIngester:
     except Exception as e:
       logging.error(f"An unexpected error occurred reading bucket name from config.ini file: {e}")
   
+  def _source_base_url(self) -> str:
+    """ Get the base URL the hourly files are downloaded from """
+    return self.config.get('ingest', 'source_url', fallback='http://data.gharchive.org').rstrip('/')
+
+  def _source_filename(self, process_date: datetime) -> str:
+    """ Get the GHArchive filename of an hourly partition """
+    # The format of the Hourly json dump files is YYYY-MM-DD-H.json.gz
+    # with Hour part without leading zero when single digit
+    date_hour = datetime.strftime(process_date, "%Y-%m-%d-%-H")
+    return f"{date_hour}.json.gz"
+
   def _generate_sink_key(self, process_date: datetime, filename, sink_base_path) -> str:
     """
     Generate the S3 sink key for the sink file.
@@ -113,8 +458,20 @@ class DataLakeIngester:
     return s3_key 
     
   # Define a callback function to print progress
-  def _s3_progress_callback(self, bytes_transferred):
+  def _s3_progress_callback(self, bucket, key, stage_metrics: StageMetrics = None):
     """
-    Callback function to print progress of S3 upload.
+    Create the callback printing the progress of an S3 upload. It logs the running total
+    and throughput at most once per `progress_log_interval_seconds`, not on every chunk.
     """
-    logging.info(f"Transferred: {bytes_transferred} bytes to S3 bucket")
+    return self.metrics.progress_logger(f"Upload of {key} to {bucket}", stage_metrics, 'bytes_uploaded')
+
+class _TeeReader:
+  """A file-like object copying everything read from a stream to a second file."""
+  def __init__(self, stream, copy_file):
+    self._stream = stream
+    self._copy_file = copy_file
+
+  def read(self, size=-1):
+    data = self._stream.read(size)
+    self._copy_file.write(data)
+    return data
@@ -1,117 +1,859 @@
 import duckdb
+import boto3
 import configparser
-from datetime import datetime
 import logging
 import os
 import uuid
-from datetime import datetime
+import shutil
+import tempfile
+import json
+import copy
+import math
+import pyarrow
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from schema_registry import SchemaRegistry
+from duckdb_connection import create_duckdb_connection, shared_duckdb_connection
+from lake_manifest import LakeManifest
+from event_id_index import EventIdIndex
+from object_cache import LocalObjectCache, parse_byte_size
+from pipeline_metrics import PipelineMetrics
+
+# the DuckDB settings of a job budget, mapped to their option in the [resources] section of config.ini
+JOB_RESOURCE_SETTINGS = {
+  'memory_limit': 'memory_limit',
+  'threads': 'threads',
+  'temp_directory': 'spill_directory',
+  'max_temp_directory_size': 'max_spill_size',
+  'preserve_insertion_order': 'preserve_insertion_order',
+  's3_uploader_max_filesize': 'max_upload_file_size',
+}
+
+# raw GHArchive attributes the silver columns are projected from, the silver types come from schemas/gharchive_silver.json
+SILVER_COLUMN_SOURCES = {
+  'event_id': 'id',
+  'user_id': 'actor.id',
+  'user_name': 'actor.login',
+  'user_display_name': 'actor.display_login',
+  'event_type': 'type',
+  'repo_id': 'repo.id',
+  'repo_name': 'repo.name',
+  'repo_url': 'repo.url',
+  'event_date': 'created_at',
+}
+# dimensions of the daily gold aggregate, every gold table is also grouped by event_date
+AGG_DIMENSIONS = ['event_type', 'repo_id', 'repo_name', 'repo_url']
+# dimensions the rollups of the [rollups] section can group by: the silver columns and a few derived ones
+ROLLUP_DIMENSIONS = ['event_id', 'user_id', 'user_name', 'user_display_name', 'event_type',
+                     'repo_id', 'repo_name', 'repo_url', 'event_hour', 'repo_owner']
+# mergeable distinct count sketches of the gold zone, mapped to the column they are keyed by and the column they count
+DISTINCT_SKETCHES = {
+  'repo_actors': ('repo_id', 'user_id'),
+  'user_repos': ('user_id', 'repo_id'),
+}
+# rows per record batch of the Arrow readers
+READER_BATCH_SIZE = 122880
+# HyperLogLog precision of the sketches, 2^12 registers for a standard error of about 1.6%
+HLL_PRECISION = 12
+# keys counting up to this many values in a day keep them exactly, a dense sketch of one byte per register
+# is about as large as this many BIGINT values
+HLL_EXACT_THRESHOLD = (1 << HLL_PRECISION) // 8
 
 class DataLakeTransformer:
   """
   A class for transforming and moving data between different stages of a data lake.
   """  
-  def __init__(self,dataset_base_path):
+  def __init__(self,dataset_base_path, con: duckdb.DuckDBPyConnection = None, metrics_sink=None):
     """ 
     Initialise the DataLakeTransformer. 
     
     :param dataset_base_path: The key prefix to use for this dataset
+    :param con: Optional warm DuckDB connection to reuse. When omitted, the process wide
+                shared connection is used if `reuse_connection` is enabled, otherwise a new one is created.
+    :param metrics_sink: Optional sink for the stage metrics records, overriding the [metrics] config section.
     """
     # set the logging level and format
     logging.basicConfig(level=logging.INFO, 
                         format='%(asctime)s - %(levelname)s - %(message)s')
     self.dataset_base_path = dataset_base_path
     self.config = self._load_config()
-    self.con = self.duckdb_connection()
+    self.schema_registry = SchemaRegistry()
+    self.manifest = self._lake_manifest()
+    self.event_index = self._event_id_index()
+    self.object_cache = self._object_cache()
+    self.metrics = PipelineMetrics(self.config, metrics_sink)
+    self._current_stage = None
+    self._cache_hold = None
+    # connections passed in or shared with other transformers are not closed by this instance
+    self._owns_connection = con is None and not self.config.getboolean('duckdb', 'reuse_connection', fallback=False)
+    self.con = con if con is not None else self.duckdb_connection()
     self._set_duckdb_s3_credentials()
     logging.info("DuckDB connection initiated")
   
   def duckdb_connection(self) -> duckdb.DuckDBPyConnection:
-    """Create and configure a DuckDB connection."""
-    con = duckdb.connect()
-    con.install_extension("httpfs")
-    con.load_extension("httpfs")
-    return con
+    """Create and configure a DuckDB connection, or get the shared one if reuse is enabled."""
+    if self.config.getboolean('duckdb', 'reuse_connection', fallback=False):
+      return shared_duckdb_connection(self.config)
+    return create_duckdb_connection(self.config)
 
-  def serialise_raw_data(self, process_date: datetime) -> None:
+  def serialise_raw_data(self, process_date: datetime, source_path=None) -> None:
     """
     Serialize and clean raw data, then export to parquet format on next zone.
     
     :param process_date: the process date corresponding to the hourly partition to serialise
+    :param source_path: Optional path of the raw data of the hour, e.g. a local copy of the bronze object.
+                        Defaults to the bronze hourly partition.
     """
     try:
-      source_bucket = self._datalake_bucket_name()['bronze']
-      sink_bucket = self._datalake_bucket_name()['silver']
-      source_path = self._raw_hourly_file_path(source_bucket, self.dataset_base_path, process_date)
-      gharchive_raw_result = self.register_raw_gharchive(source_path)
-      gharchive_clean_result = self.clean_raw_gharchive(gharchive_raw_result.alias)
-      sink_path = self._create_sink_path('clean', sink_bucket, self.dataset_base_path, process_date, True)
-      logging.info(f"DuckDB - serialise and export cleaned data to {sink_path}")
-      gharchive_clean_result.write_parquet(sink_path)
+      with self._stage_metrics('serialise', process_date):
+        self._apply_job_resources('serialise')
+        source_bucket = self._datalake_bucket_name()['bronze']
+        sink_bucket = self._datalake_bucket_name()['silver']
+        if source_path is None:
+          source_path = self._raw_hourly_source_files(source_bucket, process_date)
+        gharchive_raw_result = self.register_raw_gharchive(self._cached_source(source_path))
+        try:
+          sink_path = self._create_sink_path('clean', sink_bucket, self.dataset_base_path, process_date, True)
+          logging.info(f"DuckDB - serialise and export cleaned data to {sink_path}")
+          if self.event_index is not None:
+            # the cleaned hour is staged locally, then anti-joined with the ids of the hours around it
+            staging_dir = tempfile.mkdtemp(prefix='serialise_', dir=self._staging_directory('serialise'))
+            try:
+              staged_path = os.path.join(staging_dir, 'clean.parquet')
+              with self._profiled('serialise', count_rows_out=False):
+                self.copy_to_parquet(self._clean_gharchive_query(gharchive_raw_result.alias), staged_path)
+              self.export_deduplicated(staged_path, sink_path, process_date)
+            finally:
+              shutil.rmtree(staging_dir, ignore_errors=True)
+          else:
+            # a single streaming pass: only the projected columns are parsed from the
+            # raw files and rows are written to parquet without being materialised
+            with self._profiled('serialise'):
+              self.copy_to_parquet(self._clean_gharchive_query(gharchive_raw_result.alias), sink_path)
+        finally:
+          self._drop_view(gharchive_raw_result.alias)
+        self._log_rejected_rows(sink_path, process_date)
+        # the hour of a compacted day is only read once it is folded into the compacted files
+        day_compacted = self._compacted_silver_files(process_date) is not None
+        if not day_compacted:
+          self._record_parquet_file('silver', self.dataset_base_path, sink_path, process_date, True)
+        if self._incremental_aggregation_enabled():
+          self.aggregate_hourly_partial(process_date, sink_path)
+      if day_compacted:
+        logging.info(f"Compacting {self._partition_path(process_date)} again to fold in {sink_path}")
+        self.compact_silver_data(process_date)
     except Exception as e:
       logging.error(f"Error in serialise_raw_data: {str(e)}")
       raise
   
-  def aggregate_silver_data(self, process_date: datetime) -> None:
+  def serialise_raw_data_range(self, start_date: datetime, end_date: datetime) -> list:
+    """
+    Serialize and clean a range of hourly raw partitions in a single scan of the raw files.
+    The cleaned data is written partitioned by date and hour to a local staging directory,
+    then every hour is exported to the same silver path serialise_raw_data writes to.
+    
+    :param start_date: the first hourly partition to serialise
+    :param end_date: the last hourly partition to serialise (inclusive)
+    :return: List of the process dates that were serialised.
+    """
+    self._apply_job_resources('serialise')
+    staging_dir = tempfile.mkdtemp(prefix='serialise_', dir=self._staging_directory('serialise'))
+    try:
+      with self._stage_metrics('serialise_range', f"{start_date.isoformat()}/{end_date.isoformat()}"):
+        source_bucket = self._datalake_bucket_name()['bronze']
+        sink_bucket = self._datalake_bucket_name()['silver']
+        source_files = self._raw_file_list(source_bucket, self.dataset_base_path, start_date, end_date)
+        if not source_files:
+          logging.warning(f"No raw files found between {start_date} and {end_date}")
+          return []
+        logging.info(f"DuckDB - serialise {len(source_files)} raw files between {start_date} and {end_date}")
+        # cached copies keep the key of their object as suffix, so the partitions are still read from the filenames
+        gharchive_raw_result = self.register_raw_gharchive(self._cached_source(source_files), with_filename=True)
+        # the raw files are laid out as <base>/<YYYY-MM-DD>/<HH>/<file>
+        partition_pattern = r'/(\d{4}-\d{2}-\d{2})/(\d{2})/[^/]*$'
+        query = f'''
+          SELECT 
+            * EXCLUDE (filename),
+            regexp_extract(filename, '{partition_pattern}', 1) AS partition_date,
+            regexp_extract(filename, '{partition_pattern}', 2) AS partition_hour
+          FROM ({self._clean_gharchive_query(gharchive_raw_result.alias, with_filename=True)})
+        '''
+        try:
+          with self._profiled('serialise'):
+            self.con.execute(f"COPY ({query}) TO '{staging_dir}' \
+                               (FORMAT PARQUET, PARTITION_BY (partition_date, partition_hour))")
+        finally:
+          self._drop_view(gharchive_raw_result.alias)
+        serialised_dates = []
+        compacted_days = []
+        for partition_dir in sorted(os.listdir(staging_dir)):
+          for hour_dir in sorted(os.listdir(os.path.join(staging_dir, partition_dir))):
+            process_date = datetime.strptime(f"{partition_dir.split('=')[1]} {hour_dir.split('=')[1]}", "%Y-%m-%d %H")
+            sink_path = self._create_sink_path('clean', sink_bucket, self.dataset_base_path, process_date, True)
+            logging.info(f"DuckDB - export cleaned data to {sink_path}")
+            staged_files = os.path.join(staging_dir, partition_dir, hour_dir, '*.parquet')
+            # the partition columns only live in the directory names and are not exported
+            if self.event_index is not None:
+              # the hours are exported in order, so every hour is deduplicated against the ones before it
+              self.export_deduplicated(staged_files, sink_path, process_date, count_rows_out=False)
+            else:
+              with self._profiled('export_hour', count_rows_in=False, count_rows_out=False):
+                self.copy_to_parquet(f"FROM read_parquet('{staged_files}', hive_partitioning=false)", sink_path)
+            self._log_rejected_rows(sink_path, process_date)
+            # the hours of a compacted day are only read once they are folded into the compacted files
+            process_day = process_date.replace(hour=0)
+            if process_day not in compacted_days and self._compacted_silver_files(process_date) is not None:
+              compacted_days.append(process_day)
+            if process_day not in compacted_days:
+              self._record_parquet_file('silver', self.dataset_base_path, sink_path, process_date, True)
+            if self._incremental_aggregation_enabled():
+              self.aggregate_hourly_partial(process_date, sink_path)
+            serialised_dates.append(process_date)
+      for process_day in compacted_days:
+        logging.info(f"Compacting {self._partition_path(process_day)} again to fold in its serialised hours")
+        self.compact_silver_data(process_day)
+      return serialised_dates
+    except Exception as e:
+      logging.error(f"Error in serialise_raw_data_range: {str(e)}")
+      raise
+    finally:
+      shutil.rmtree(staging_dir, ignore_errors=True)
+
+  def export_deduplicated(self, staged_path, sink_path, process_date: datetime, count_rows_out: bool = True) -> int:
+    """
+    Export a staged hour of cleaned data without the events already written to the hours
+    around it, then record the ids it kept in the event id index.
+
+    :param staged_path: Local path, or glob, of the staged parquet files of the hour.
+    :param sink_path: Full path of the silver file to write.
+    :param process_date: the process date corresponding to the hourly partition
+    :param count_rows_out: Add the exported rows to the rows_out counter of the current stage.
+    :return: Number of duplicate events removed.
+    """
+    staged_source = f"read_parquet('{staged_path}', hive_partitioning=false)"
+    window_files = self.event_index.window_files(process_date)
+    if window_files:
+      # event ids that are not numeric never match the index, so they are always kept
+      query = f'''
+        SELECT staged.*
+        FROM {staged_source} AS staged
+        ANTI JOIN read_parquet({self._sql_path_list(window_files)}) AS seen
+        ON TRY_CAST(staged.event_id AS BIGINT) = seen.event_id
+      '''
+    else:
+      query = f"SELECT * FROM {staged_source}"
+    with self._profiled('deduplicate', count_rows_in=False, count_rows_out=count_rows_out):
+      written_rows = self.con.execute(f"COPY ({query}) TO '{sink_path}' ({self._parquet_options()})").fetchone()[0]
+    staged_rows = self.con.execute(f"SELECT count(*) FROM {staged_source}").fetchone()[0]
+    duplicates = staged_rows - written_rows
+    self.event_index.record_hour(self.con, f'''
+      SELECT DISTINCT TRY_CAST(event_id AS BIGINT) AS event_id FROM ({query})
+      WHERE TRY_CAST(event_id AS BIGINT) IS NOT NULL
+      ORDER BY event_id
+    ''', process_date)
+    if self._current_stage is not None:
+      self._current_stage.add('duplicates_removed', duplicates)
+    logging.info(f"Removed {duplicates} duplicate events of {staged_rows} from {self._partition_path(process_date, True)}")
+    return duplicates
+
+  def aggregate_silver_data(self, process_date: datetime, incremental: bool = None) -> None:
     """
     Aggregate raw data and export to parquet format.
     
     :param process_date: the process date corresponding to the daily partition to aggregate
+    :param incremental: Merge the hourly partial aggregates of the day instead of rescanning
+                        the silver data. Defaults to the `incremental_aggregation` config option.
     """
     try:
-      source_bucket = self._datalake_bucket_name()['silver']
-      sink_bucket = self._datalake_bucket_name()['gold']
-      source_path = self._silver_daily_file_path(source_bucket, self.dataset_base_path, process_date)
-      logging.info(f"DuckDB - aggregate silver data in {source_path}")
-      gharchive_agg_result = self.aggregate_raw_gharchive(source_path)
-      sink_path = self._create_sink_path('agg', sink_bucket, self.dataset_base_path, process_date)
-      logging.info(f"DuckDB - export aggregated data to {sink_path}")
-      gharchive_agg_result.write_parquet(sink_path)   
+      if incremental is None:
+        incremental = self._incremental_aggregation_enabled()
+      with self._stage_metrics('aggregate', process_date):
+        self._apply_job_resources('aggregate')
+        # the versions of the silver files are taken before they are read, so a later write marks the day stale
+        silver_inputs = self._silver_input_versions(process_date)
+        sink_bucket = self._datalake_bucket_name()['gold']
+        rollups = self.gold_rollups()
+        if incremental or not rollups:
+          if incremental:
+            source_path = self._daily_source_files('gold', self._partials_base_path(), process_date)
+            logging.info(f"DuckDB - merge partial aggregates in {source_path}")
+            gharchive_agg_result = self.merge_hourly_gharchive(self._cached_source(source_path))
+          else:
+            source_path = self._daily_source_files('silver', self.dataset_base_path, process_date)
+            logging.info(f"DuckDB - aggregate silver data in {source_path}")
+            gharchive_agg_result = self.aggregate_raw_gharchive(self._cached_source(source_path))
+          sink_path = self._create_sink_path('agg', sink_bucket, self.dataset_base_path, process_date)
+          logging.info(f"DuckDB - export aggregated data to {sink_path}")
+          # the relation is lazy, the aggregation runs as it is streamed to parquet
+          with self._profiled('aggregate'):
+            gharchive_agg_result.write_parquet(sink_path)   
+          self._record_parquet_file('gold', self.dataset_base_path, sink_path, process_date)
+        if rollups:
+          # the daily aggregate shares the scan of the rollups, unless it was merged from the partials
+          if not incremental:
+            rollups = {'agg': AGG_DIMENSIONS, **rollups}
+          source_path = self._daily_source_files('silver', self.dataset_base_path, process_date)
+          logging.info(f"DuckDB - aggregate rollups {', '.join(rollups)} of silver data in {source_path}")
+          self.write_gharchive_rollups(self._cached_source(source_path), rollups, process_date)
+        if self._distinct_sketches_enabled():
+          source_path = self._daily_source_files('silver', self.dataset_base_path, process_date)
+          self.write_distinct_sketches(self._cached_source(source_path), process_date)
+        self._record_gold_lineage(process_date, silver_inputs)
     except Exception as e:
       logging.error(f"Error in aggregate_silver_data: {str(e)}")
       raise
 
-  def register_raw_gharchive(self, source_path) -> duckdb.DuckDBPyRelation:
+  def aggregate_silver_data_range(self, start_date: datetime, end_date: datetime, incremental: bool = None) -> list:
+    """
+    Aggregate a range of daily partitions, e.g. a month, in a single scan.
+    The aggregation runs within the memory budget of the `aggregate` job and spills to
+    the spill directory rather than failing when its hash tables outgrow the budget.
+    The result is written partitioned by date to a local staging directory, then every
+    day is exported to the same gold path aggregate_silver_data writes to.
+    
+    :param start_date: the first daily partition to aggregate
+    :param end_date: the last daily partition to aggregate (inclusive)
+    :param incremental: Merge the hourly partial aggregates instead of rescanning the silver data.
+                        Defaults to the `incremental_aggregation` config option.
+    :return: List of the process dates that were aggregated.
+    """
+    if incremental is None:
+      incremental = self._incremental_aggregation_enabled()
+    self._apply_job_resources('aggregate')
+    staging_dir = tempfile.mkdtemp(prefix='aggregate_', dir=self._staging_directory('aggregate'))
+    try:
+      with self._stage_metrics('aggregate_range', f"{start_date.isoformat()}/{end_date.isoformat()}"):
+        sink_bucket = self._datalake_bucket_name()['gold']
+        zone, dataset = ('gold', self._partials_base_path()) if incremental else ('silver', self.dataset_base_path)
+        source_files = []
+        silver_inputs = {}
+        process_day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        while process_day <= end_date:
+          silver_inputs[process_day] = self._silver_input_versions(process_day)
+          source_files += self._resolve_files(self._daily_source_files(zone, dataset, process_day))
+          process_day += timedelta(days=1)
+        if not source_files:
+          logging.warning(f"No {zone} files found to aggregate between {start_date} and {end_date}")
+          return []
+        logging.info(f"DuckDB - aggregate {len(source_files)} {zone} files between {start_date} and {end_date}")
+        source_files = self._cached_source(source_files)
+        if incremental:
+          gharchive_agg_result = self.merge_hourly_gharchive(source_files)
+        else:
+          gharchive_agg_result = self.aggregate_raw_gharchive(source_files)
+        # the relation is inlined rather than registered as a view, which cursors of the connection would share
+        with self._profiled('aggregate'):
+          self.con.execute(f"COPY (SELECT *, strftime(event_date, '%Y-%m-%d') AS partition_date FROM ({gharchive_agg_result.sql_query()})) \
+                             TO '{staging_dir}' (FORMAT PARQUET, PARTITION_BY (partition_date))")
+        aggregated_dates = []
+        for partition_dir in sorted(os.listdir(staging_dir)):
+          process_date = datetime.strptime(partition_dir.split('=')[1], "%Y-%m-%d")
+          sink_path = self._create_sink_path('agg', sink_bucket, self.dataset_base_path, process_date)
+          logging.info(f"DuckDB - export aggregated data to {sink_path}")
+          # the partition column only lives in the directory name and is not exported
+          staged_files = os.path.join(staging_dir, partition_dir, '*.parquet')
+          self.con.read_parquet(staged_files, hive_partitioning=False).write_parquet(sink_path)
+          self._record_parquet_file('gold', self.dataset_base_path, sink_path, process_date)
+          self._record_gold_lineage(process_date, silver_inputs.get(process_date))
+          aggregated_dates.append(process_date)
+        return aggregated_dates
+    except Exception as e:
+      logging.error(f"Error in aggregate_silver_data_range: {str(e)}")
+      raise
+    finally:
+      shutil.rmtree(staging_dir, ignore_errors=True)
+
+  def reconcile_gold_data(self, start_date: datetime, end_date: datetime, max_workers: int = None) -> list:
+    """
+    Rebuild the gold partitions of the days whose silver files changed since they were aggregated,
+    e.g. after an hour landed late or was re-serialised, as recorded by the lineage of the lake manifest.
+    Days never aggregated are built too. The other days are left as they are, and the stale ones
+    are aggregated concurrently, every worker on its own cursor of the connection of this transformer.
+    
+    :param start_date: the first daily partition to check
+    :param end_date: the last daily partition to check (inclusive)
+    :param max_workers: number of days aggregated concurrently. Defaults to the `reconcile_max_workers` config option.
+    :return: List of the process dates that could not be rebuilt.
+    """
+    if self.manifest is None:
+      raise ValueError("Reconciling the gold zone needs the lineage of the lake manifest, enable it in the [manifest] section")
+    if max_workers is None:
+      max_workers = self.config.getint('transformer', 'reconcile_max_workers', fallback=4)
+    stale_dates = self.manifest.stale_partitions('gold', self.dataset_base_path, 'silver', self.dataset_base_path,
+                                                 start_date, end_date)
+    logging.info(f"Rebuilding {len(stale_dates)} stale gold partitions between {start_date} and {end_date} with {max_workers} workers")
+    failed_dates = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+      futures = {executor.submit(self._rebuild_gold_partition, process_date): process_date for process_date in stale_dates}
+      for future in as_completed(futures):
+        process_date = futures[future]
+        try:
+          future.result()
+        except Exception as e:
+          logging.error(f"Giving up on rebuilding {process_date}: {e}")
+          failed_dates.append(process_date)
+    logging.info(f"Reconcile finished: {len(stale_dates) - len(failed_dates)} rebuilt, {len(failed_dates)} failed")
+    return sorted(failed_dates)
+
+  def _rebuild_gold_partition(self, process_date: datetime) -> None:
+    """ Aggregate a day on a worker thread, on a cursor of this connection """
+    cursor = self.con.cursor()
+    try:
+      self._worker_transformer(cursor).aggregate_silver_data(process_date)
+    finally:
+      cursor.close()
+
+  def _worker_transformer(self, con: duckdb.DuckDBPyConnection):
+    """
+    Create a transformer for a worker thread on another connection or cursor. It shares the config,
+    manifest, object cache, event id index and metrics sink of this transformer instead of opening its own.
+    """
+    worker = copy.copy(self)
+    worker.con = con
+    worker._owns_connection = False
+    worker._current_stage = None
+    worker._cache_hold = None
+    worker._set_duckdb_s3_credentials()
+    return worker
+
+  def write_gharchive_rollups(self, raw_dataset, rollups: dict, process_date: datetime) -> list:
+    """
+    Compute several gold rollups of a day in a single scan and write each one to its own gold path.
+    The rollups are written partitioned by name to a local staging directory first, so
+    the silver data is read once however many rollups are configured.
+    
+    :param raw_dataset: Full Path to the silver data of the day, or a list of paths.
+    :param rollups: Dictionary mapping rollup names to their dimensions. The `agg` rollup is written
+                    to the path of the daily aggregate, the others under rollups/<name>.
+    :param process_date: the process date corresponding to the daily partition
+    :return: List of the written gold paths.
+    """
+    staging_dir = tempfile.mkdtemp(prefix='rollups_', dir=self._staging_directory('aggregate'))
+    try:
+      sink_bucket = self._datalake_bucket_name()['gold']
+      # the relation is inlined rather than registered as a view, which cursors of the connection would share
+      rollups_query = self.aggregate_gharchive_rollups(raw_dataset, rollups).sql_query()
+      with self._profiled('aggregate'):
+        self.con.execute(f"COPY ({rollups_query}) TO '{staging_dir}' (FORMAT PARQUET, PARTITION_BY (rollup))")
+      sink_paths = []
+      for rollup, dimensions in rollups.items():
+        staged_dir = os.path.join(staging_dir, f"rollup={rollup}")
+        if not os.path.isdir(staged_dir):
+          logging.warning(f"Rollup {rollup} has no rows for {self._partition_path(process_date)}")
+          continue
+        dataset = self.dataset_base_path if rollup == 'agg' else f"{self.dataset_base_path}/rollups/{rollup}"
+        sink_path = self._create_sink_path(rollup, sink_bucket, dataset, process_date)
+        logging.info(f"DuckDB - export rollup {rollup} to {sink_path}")
+        # keep the dimensions of the rollup only, the others are NULL in its rows
+        staged_files = os.path.join(staged_dir, '*.parquet')
+        self.con.read_parquet(staged_files, hive_partitioning=False) \
+          .select(*dimensions, 'event_date', 'event_count').write_parquet(sink_path)
+        self._record_parquet_file('gold', dataset, sink_path, process_date)
+        sink_paths.append(sink_path)
+      return sink_paths
+    finally:
+      shutil.rmtree(staging_dir, ignore_errors=True)
+
+  def write_distinct_sketches(self, raw_dataset, process_date: datetime) -> str:
+    """
+    Write the distinct count sketches of a day to the gold zone, see build_distinct_sketches.
+    
+    :param raw_dataset: Full Path to the silver data of the day, or a list of paths.
+    :param process_date: the process date corresponding to the daily partition
+    :return: The written gold path.
+    """
+    sink_bucket = self._datalake_bucket_name()['gold']
+    sink_path = self._create_sink_path('sketches', sink_bucket, self._sketches_base_path(), process_date)
+    logging.info(f"DuckDB - export distinct count sketches of {raw_dataset} to {sink_path}")
+    # the silver rows are already counted by the aggregation of the stage
+    with self._profiled('sketches', count_rows_in=False, count_rows_out=False):
+      self.build_distinct_sketches(raw_dataset).write_parquet(sink_path)
+    self._record_parquet_file('gold', self._sketches_base_path(), sink_path, process_date)
+    return sink_path
+
+  def estimate_distinct_counts(self, sketch, start_date: datetime, end_date: datetime, keys: list = None) -> duckdb.DuckDBPyRelation:
+    """
+    Estimate distinct counts over a range of days, e.g. the unique actors of every repo in a month,
+    by merging the daily sketches of the gold zone. The silver data is not read.
+    
+    :param sketch: Name of the sketch, one of DISTINCT_SKETCHES, e.g. repo_actors.
+    :param start_date: the first daily partition of the range
+    :param end_date: the last daily partition of the range (inclusive)
+    :param keys: Optional list of the keys to estimate, e.g. repo ids. Defaults to all keys.
+    :return: Lazy DuckDB relation with the key column of the sketch and the estimated distinct_count.
+    """
+    if sketch not in DISTINCT_SKETCHES:
+      raise ValueError(f"Unknown sketch {sketch}, expected one of {list(DISTINCT_SKETCHES)}")
+    sketch_files = []
+    process_day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    while process_day <= end_date:
+      sketch_files += self._resolve_files(self._daily_source_files('gold', self._sketches_base_path(), process_day,
+                                                                   has_hourly_partition=False))
+      process_day += timedelta(days=1)
+    if not sketch_files:
+      raise FileNotFoundError(f"No distinct count sketches found between {start_date} and {end_date}")
+    return self.estimate_merged_sketches(self.merge_distinct_sketches(self._cached_source(sketch_files), sketch, keys), sketch)
+
+  def read_silver_data(self, start_date: datetime, end_date: datetime, columns: list = None, filters: dict = None,
+                       batch_size: int = READER_BATCH_SIZE) -> pyarrow.RecordBatchReader:
+    """
+    Stream the silver events of a range of days as Arrow record batches, see read_dataset.
+    
+    :param start_date: the first daily partition to read
+    :param end_date: the last daily partition to read (inclusive)
+    :param columns: Optional list of the columns to read, defaults to all columns.
+    :param filters: Optional dictionary mapping column names to a value, or to a (low, high) range, the rows must match.
+    :param batch_size: Maximum number of rows of a record batch.
+    """
+    return self.read_dataset('silver', self.dataset_base_path, start_date, end_date, columns, filters, batch_size)
+
+  def read_gold_data(self, start_date: datetime, end_date: datetime, columns: list = None, filters: dict = None,
+                     batch_size: int = READER_BATCH_SIZE, rollup=None) -> pyarrow.RecordBatchReader:
+    """
+    Stream the daily gold aggregates, or a rollup, of a range of days as Arrow record batches, see read_dataset.
+    
+    :param start_date: the first daily partition to read
+    :param end_date: the last daily partition to read (inclusive)
+    :param columns: Optional list of the columns to read, defaults to all columns.
+    :param filters: Optional dictionary mapping column names to a value, or to a (low, high) range, the rows must match.
+    :param batch_size: Maximum number of rows of a record batch.
+    :param rollup: Optional name of a rollup of the [rollups] section to read instead of the daily aggregate.
+    """
+    dataset = f"{self.dataset_base_path}/rollups/{rollup}" if rollup else self.dataset_base_path
+    return self.read_dataset('gold', dataset, start_date, end_date, columns, filters, batch_size,
+                             has_hourly_partition=False)
+
+  def read_dataset(self, zone, dataset, start_date: datetime, end_date: datetime, columns: list = None, filters: dict = None,
+                   batch_size: int = READER_BATCH_SIZE, has_hourly_partition: bool = True) -> pyarrow.RecordBatchReader:
+    """
+    Stream a dataset of the lake for a range of days as Arrow record batches, without converting it to pandas.
+    The columns and filters are pushed down into the parquet scan, so only the projected columns are read
+    and row groups whose statistics cannot match are skipped, as are whole files when the manifest is enabled.
+    Batches are produced as the consumer reads them, memory stays bounded by the batch size whatever the range.
+    
+    :param zone: Data lake zone of the dataset, e.g. silver.
+    :param dataset: Key prefix of the dataset.
+    :param start_date: the first daily partition to read
+    :param end_date: the last daily partition to read (inclusive)
+    :param columns: Optional list of the columns to read, defaults to all columns.
+    :param filters: Optional dictionary mapping column names to a value, or to a (low, high) range, the rows must match.
+    :param batch_size: Maximum number of rows of a record batch.
+    :param has_hourly_partition: The dataset is written per hour rather than per day.
+    :return: pyarrow RecordBatchReader over the rows.
+    """
+    source_files = []
+    process_day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    while process_day <= end_date:
+      source_files += self._resolve_files(self._daily_source_files(zone, dataset, process_day, has_hourly_partition, filters))
+      process_day += timedelta(days=1)
+    if not source_files:
+      raise FileNotFoundError(f"No {zone} files of {dataset} found between {start_date} and {end_date}")
+    projection = ", ".join(f'"{column}"' for column in columns) if columns else "*"
+    conditions, parameters = [], []
+    for column, value in (filters or {}).items():
+      low, high = value if isinstance(value, tuple) else (value, value)
+      if low is not None:
+        conditions.append(f'"{column}" >= ?')
+        parameters.append(low)
+      if high is not None:
+        conditions.append(f'"{column}" <= ?')
+        parameters.append(high)
+    # the cached files are held until the reader is consumed, it outlives the call
+    cache_hold = self.object_cache.open_hold() if self.object_cache is not None else None
+    # the reader runs on its own cursor, so the transformer connection stays usable while it is consumed
+    cursor = self.con.cursor()
+    try:
+      source_files = self._cached_source(source_files, cache_hold)
+      query = f"SELECT {projection} FROM {self._sql_source(source_files)}"
+      if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+      logging.info(f"DuckDB - stream {len(source_files)} {zone} files of {dataset} between {start_date} and {end_date}")
+      self._set_duckdb_s3_credentials(cursor)
+      result = cursor.execute(query, parameters)
+      # to_arrow_reader replaces fetch_record_batch in the recent DuckDB releases
+      batches = result.to_arrow_reader(batch_size) if hasattr(result, 'to_arrow_reader') else result.fetch_record_batch(batch_size)
+    except Exception:
+      cursor.close()
+      if cache_hold is not None:
+        self.object_cache.release_hold(cache_hold)
+      raise
+    return pyarrow.RecordBatchReader.from_batches(batches.schema, self._cursor_batches(cursor, batches, cache_hold))
+
+  def _cursor_batches(self, cursor, batches, cache_hold=None):
+    """ Yield the batches of a reader, then close the cursor it runs on and release the cached files it read """
+    try:
+      yield from batches
+    finally:
+      cursor.close()
+      if cache_hold is not None:
+        self.object_cache.release_hold(cache_hold)
+
+  def aggregate_hourly_partial(self, process_date: datetime, silver_path=None) -> None:
+    """
+    Aggregate an hourly silver partition into a partial aggregate on the gold zone,
+    then refresh the intraday aggregate of the day from the partials written so far.
+    
+    :param process_date: the process date corresponding to the hourly partition to aggregate
+    :param silver_path: Full path of the hourly silver file. Defaults to the path serialise_raw_data writes to.
+    """
+    # the rows of a partial aggregate run by a serialisation are not counted as the rows of that stage
+    nested = self._current_stage is not None
+    try:
+      with self._stage_metrics('partial_aggregate', process_date):
+        buckets = self._datalake_bucket_name()
+        if silver_path is None:
+          silver_path = self._create_sink_path('clean', buckets['silver'], self.dataset_base_path, process_date, True)
+        sink_path = self._create_sink_path('partial_agg', buckets['gold'], self._partials_base_path(), process_date, True)
+        logging.info(f"DuckDB - export partial aggregate of {silver_path} to {sink_path}")
+        with self._profiled('partial_aggregate', count_rows_in=not nested, count_rows_out=not nested):
+          self.aggregate_hourly_gharchive(silver_path).write_parquet(sink_path)
+        self._record_parquet_file('gold', self._partials_base_path(), sink_path, process_date, True)
+        partials_path = self._daily_source_files('gold', self._partials_base_path(), process_date)
+        intraday_path = self._create_sink_path('agg', buckets['gold'], f"{self.dataset_base_path}/intraday", process_date)
+        logging.info(f"DuckDB - refresh intraday aggregate {intraday_path}")
+        with self._profiled('intraday_aggregate', count_rows_in=False, count_rows_out=False):
+          self.merge_hourly_gharchive(partials_path).write_parquet(intraday_path)
+        self._record_parquet_file('gold', f"{self.dataset_base_path}/intraday", intraday_path, process_date)
+    except Exception as e:
+      logging.error(f"Error in aggregate_hourly_partial: {str(e)}")
+      raise
+
+  def compact_silver_data(self, process_date: datetime) -> list:
+    """
+    Rewrite the silver files of a day into a few large files sorted by repo and event type,
+    so that repo filtered reads can skip row groups through their min/max statistics.
+    The compacted files are written to a new version directory, then swapped in for the files they
+    replace by rewriting the compaction marker of the day, which glob readers resolve the day from.
+    Hours written after a compaction, e.g. late or re-serialised ones, are folded into the compacted
+    files by compacting the day again, their events replacing the compacted events of the same id.
+    
+    :param process_date: the process date corresponding to the daily partition to compact
+    :return: List of the compacted file paths.
+    """
+    try:
+      with self._stage_metrics('compact', process_date):
+        self._apply_job_resources('compact')
+        day_prefix = self._silver_day_prefix(process_date)
+        # the hourly glob does not match the versioned compacted files, only the hours not yet compacted
+        previous_files = self._compacted_silver_files(process_date) or []
+        hourly_files = self._resolve_files(f"{day_prefix}/*/*.parquet")
+        if not hourly_files:
+          logging.warning(f"No silver files found to compact for {process_date}")
+          return previous_files
+        staging_path = f"{self._silver_dataset_prefix()}/_staging/{uuid.uuid4()}"
+        logging.info(f"DuckDB - compact {len(hourly_files)} hourly and {len(previous_files)} compacted silver files into {staging_path}")
+        staged_files = self.compact_parquet_files(hourly_files, staging_path, previous_files)
+        compacted_dir = f"{day_prefix}/compacted/{uuid.uuid4().hex}"
+        compacted_files = [f"{compacted_dir}/clean_{process_date.strftime('%Y%m%d')}_{i:03d}.parquet"
+                           for i in range(len(staged_files))]
+        self._copy_s3_objects(dict(zip(staged_files, compacted_files)))
+        # the gold partition stays current when the compacted files hold the same events as the recorded hours
+        gold_current = not previous_files and self._gold_partition_current(process_date)
+        # glob readers switch to the new version in one object write, the replaced files are deleted after it
+        self.copy_to_parquet(f"SELECT unnest({self._sql_path_list(compacted_files)}) AS path",
+                             self._compaction_marker_path(process_date))
+        # readers resolving files from the manifest switch to the compacted files in one transaction
+        if self.manifest is not None:
+          self.manifest.replace_files(previous_files + hourly_files, [
+            self._parquet_manifest_entry('silver', self.dataset_base_path, compacted_file, process_date)
+            for compacted_file in compacted_files])
+          if gold_current:
+            self._record_gold_lineage(process_date, self._silver_input_versions(process_date))
+        # a crash before the delete leaves hours that are only folded in again by the next compaction
+        self._delete_s3_objects(previous_files + hourly_files + staged_files)
+        logging.info(f"Compacted {len(hourly_files) + len(previous_files)} silver files into {len(compacted_files)} "
+                     f"for {self._partition_path(process_date)}")
+        return compacted_files
+    except Exception as e:
+      logging.error(f"Error in compact_silver_data: {str(e)}")
+      raise
+
+  def compact_parquet_files(self, source_files, sink_dir, base_files: list = None) -> list:
+    """
+    Rewrite parquet files into a directory of large files sorted by repo and event type.
+    A parallel COPY splitting its output by file size loses the sort order, so the sorted rows are
+    staged in a single local file first, then split into files holding disjoint repo_id ranges.
+    
+    :param source_files: List of the parquet files to compact.
+    :param sink_dir: Directory to write the compacted files to.
+    :param base_files: Optional list of previously compacted files, whose events are kept unless the source
+                       files hold events of the same hour, which replace them all, or an event of the same id.
+    :return: Sorted list of the written file paths.
+    """
+    target_file_size = parse_byte_size(self.config.get('parquet', 'compaction_target_file_size', fallback='256MB'))
+    if not sink_dir.startswith('s3://'):
+      os.makedirs(sink_dir, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(prefix='compact_', dir=self._staging_directory('compact'))
+    try:
+      sorted_path = os.path.join(staging_dir, 'sorted.parquet')
+      source = f"SELECT * FROM read_parquet({self._sql_path_list(source_files)}, union_by_name=true)"
+      if base_files:
+        base_source = f"read_parquet({self._sql_path_list(base_files)}, union_by_name=true)"
+        # a re-serialised hour replaces all the events of the hour, including those it no longer holds;
+        # event ids are compared as text, the files may have been written with different silver schema versions
+        source += f"""
+          UNION ALL BY NAME
+          SELECT base.* FROM {base_source} AS base
+          ANTI JOIN (SELECT DISTINCT DATE_TRUNC('hour', event_date) AS event_hour FROM ({source})) AS replacing_hours
+          ON DATE_TRUNC('hour', base.event_date) = replacing_hours.event_hour
+          ANTI JOIN (SELECT event_id FROM ({source}) WHERE event_id IS NOT NULL) AS replacing
+          ON CAST(base.event_id AS VARCHAR) = CAST(replacing.event_id AS VARCHAR)
+        """
+      query = f"FROM ({source}) ORDER BY repo_id, event_type"
+      with self._profiled('compact', count_rows_out=False):
+        self.copy_to_parquet(query, sorted_path)
+      file_count = max(1, math.ceil(os.path.getsize(sorted_path) / target_file_size))
+      sink_files = []
+      for i, repo_filter in enumerate(self._repo_id_ranges(sorted_path, file_count)):
+        sink_file = f"{sink_dir}/data_{i:03d}.parquet"
+        # a single file written from one ORDER BY keeps its rows, and so its row groups, in order
+        with self._profiled('compact_split', count_rows_in=False):
+          self.copy_to_parquet(f"FROM read_parquet('{sorted_path}') {repo_filter} ORDER BY repo_id, event_type", sink_file)
+        sink_files.append(sink_file)
+      return sink_files
+    finally:
+      shutil.rmtree(staging_dir, ignore_errors=True)
+
+  def _repo_id_ranges(self, sorted_path, file_count: int) -> list:
+    """
+    Split a parquet file sorted by repo_id into WHERE clauses of about the same number of rows,
+    without splitting the rows of a repo across clauses.
+    
+    :return: List of the WHERE clauses, an empty clause when the file is not split.
+    """
+    row_count = self.con.execute(f"SELECT num_rows FROM parquet_file_metadata('{sorted_path}')").fetchone()[0]
+    positions = sorted({row_count * i // file_count for i in range(1, file_count)})
+    if not positions:
+      return ['']
+    # the rows of the sorted file are numbered in repo_id order, NULL repo ids last
+    boundaries = [repo_id for (repo_id,) in self.con.execute(f"""
+      SELECT DISTINCT repo_id FROM read_parquet('{sorted_path}', file_row_number=true)
+      WHERE file_row_number IN ({', '.join(map(str, positions))}) AND repo_id IS NOT NULL
+        AND repo_id < (SELECT max(repo_id) FROM read_parquet('{sorted_path}'))
+      ORDER BY repo_id
+    """).fetchall()]
+    if not boundaries:
+      return ['']
+    repo_filters = [f"WHERE repo_id <= {boundaries[0]}"]
+    repo_filters += [f"WHERE repo_id > {low} AND repo_id <= {high}" for low, high in zip(boundaries, boundaries[1:])]
+    repo_filters.append(f"WHERE repo_id > {boundaries[-1]} OR repo_id IS NULL")
+    return repo_filters
+
+  def migrate_silver_data(self, process_date: datetime) -> list:
+    """
+    Rewrite the silver files of a day written with an older gharchive_silver schema version,
+    e.g. with string event ids, in the layout of the configured version.
+    Every file is staged locally then written back to its own path, hourly or compacted,
+    so the daily globs and the manifest entries keep resolving it. Files already in the layout are skipped.
+    
+    :param process_date: the process date corresponding to the daily partition to migrate
+    :return: List of the migrated file paths.
+    """
+    try:
+      with self._stage_metrics('migrate', process_date):
+        # a migration rewrites files like a compaction, and runs with its budget
+        self._apply_job_resources('compact')
+        source_files = self._resolve_files(self._daily_source_files('silver', self.dataset_base_path, process_date))
+        columns = self.schema_registry.get_schema('gharchive_silver', self.silver_schema_version())
+        projection = ", ".join(f'TRY_CAST("{column}" AS {column_type}) AS "{column}"' for column, column_type in columns.items())
+        migrated_files = []
+        gold_current = self._gold_partition_current(process_date)
+        staging_dir = tempfile.mkdtemp(prefix='migrate_', dir=self._staging_directory('compact'))
+        try:
+          for source_file in source_files:
+            if self._silver_file_layout_matches(source_file, columns):
+              continue
+            logging.info(f"DuckDB - migrate {source_file} to version {self.silver_schema_version()} of the silver schema")
+            staged_path = os.path.join(staging_dir, 'migrated.parquet')
+            with self._profiled('migrate'):
+              self.copy_to_parquet(f"SELECT {projection} FROM read_parquet('{source_file}')", staged_path)
+            self.copy_to_parquet(f"FROM read_parquet('{staged_path}')", source_file)
+            # hourly files sit in an <HH> directory, compacted files hold the whole day
+            if '/compacted/' in source_file:
+              self._record_parquet_file('silver', self.dataset_base_path, source_file, process_date)
+            else:
+              self._record_parquet_file('silver', self.dataset_base_path, source_file,
+                                        process_date.replace(hour=int(source_file.split('/')[-2])), True)
+            migrated_files.append(source_file)
+        finally:
+          shutil.rmtree(staging_dir, ignore_errors=True)
+        # the migrated files hold the same events, a gold partition built from them stays current
+        if migrated_files and gold_current:
+          self._record_gold_lineage(process_date, self._silver_input_versions(process_date))
+        logging.info(f"Migrated {len(migrated_files)} of {len(source_files)} silver files for {self._partition_path(process_date)}")
+        return migrated_files
+    except Exception as e:
+      logging.error(f"Error in migrate_silver_data: {str(e)}")
+      raise
+
+  def register_raw_gharchive(self, source_path, with_filename: bool = False) -> duckdb.DuckDBPyRelation:
     """
-    Create a an in-memory table from raw GHArchive source data
+    Register a view over the raw GHArchive source data.
+    Nothing is read until the view is queried, so the JSON reader only
+    parses the columns the consuming query projects.
+    The view is temporary and uniquely named: cursors of one connection share its catalog,
+    so transformers serialising on them concurrently never read each other's source.
+    Drop it with _drop_view once it is consumed.
+    The files are read with the explicit gharchive_events schema from the
+    schema registry, unless `schema_detection` is enabled in the config file.
     
-    :param source_path: Full Path to the source data on lake.
-    :return: DuckDB result object representing the raw table.
+    :param source_path: Full Path to the source data on lake, or a list of paths.
+    :param with_filename: Add a filename column holding the path of the file each row was read from.
+    :return: DuckDB relation representing the raw view, the view name is its alias.
     """
     logging.info(f"DuckDB - collect source data files: {source_path}")
-    self.con.execute(f"CREATE OR REPLACE TABLE gharchive_raw \
-                      AS FROM read_json_auto('{source_path}', ignore_errors=true)")
-    return self.con.table("gharchive_raw")
+    view_name = f"gharchive_raw_{uuid.uuid4().hex}"
+    self.con.execute(f"CREATE TEMP VIEW {view_name} \
+                      AS FROM {self._raw_gharchive_reader(source_path, with_filename)}")
+    return self.con.view(view_name)
+
+  def _drop_view(self, view_name) -> None:
+    """ Drop a temporary view registered by this transformer """
+    self.con.execute(f"DROP VIEW IF EXISTS {view_name}")
   
   def clean_raw_gharchive(self,raw_dataset) -> duckdb.DuckDBPyRelation:
     """
     Clean the raw GHArchive data and only selected attributed we are interest in.
     
-    :param raw_dataset: Name of the DuckDB raw dataset table.
-    :return: DuckDB result object representing the cleaned table.
+    :param raw_dataset: Name of the DuckDB raw dataset table or view.
+    :return: Lazy DuckDB relation representing the cleaned data.
+    """
+    logging.info("DuckDB - clean data")
+    return self.con.sql(self._clean_gharchive_query(raw_dataset))
+
+  def copy_to_parquet(self, query, sink_path) -> None:
+    """
+    Stream the result of a query straight into a parquet file.
+    
+    :param query: SQL query producing the rows to export.
+    :param sink_path: Full path of the parquet file to write.
     """
+    self.con.execute(f"COPY ({query}) TO '{sink_path}' ({self._parquet_options()})")
+
+  def _clean_gharchive_query(self, raw_dataset, with_filename: bool = False) -> str:
+    """
+    Build the query projecting the raw GHArchive attributes we are interested in,
+    cast to the types of the gharchive_silver schema so aggregations never parse strings.
+    A value that cannot be cast, e.g. an event id that is not an integer, is written as NULL
+    rather than failing the hour, see _log_rejected_rows.
+    """
+    columns = self.schema_registry.get_schema('gharchive_silver', self.silver_schema_version())
+    projection = ",\n        ".join(f'TRY_CAST({SILVER_COLUMN_SOURCES[column]} AS {column_type}) AS "{column}"'
+                                    for column, column_type in columns.items())
     query = f'''
       SELECT 
-        id AS "event_id",
-        actor.id AS "user_id",
-        actor.login AS "user_name",
-        actor.display_login AS "user_display_name",
-        type AS "event_type",
-        repo.id AS "repo_id",
-        repo.name AS "repo_name",
-        repo.url AS "repo_url",
-        created_at AS "event_date"
+        {projection}{', filename' if with_filename else ''}
       FROM '{raw_dataset}'
     '''
-    logging.info("DuckDB - clean data")
-    self.con.execute(f"CREATE OR REPLACE TABLE gharchive_clean AS FROM ({query})")
-    return self.con.table("gharchive_clean")
+    return query
 
   def aggregate_raw_gharchive(self, raw_dataset) -> duckdb.DuckDBPyRelation:
     """
     Aggregate the raw GHArchive data.
     
     :param raw_dataset: Full Path to the raw dataset on data lake.
-    :return: DuckDB result object representing the aggregated table.
+    :return: Lazy DuckDB relation representing the aggregated data, computed as it is consumed.
     """
     query = f'''
       SELECT 
@@ -119,13 +861,643 @@ class DataLakeTransformer:
         repo_id,
         repo_name,
         repo_url,
-        DATE_TRUNC('day',CAST(event_date AS TIMESTAMP)) AS event_date,
+        DATE_TRUNC('day',event_date) AS event_date,
         count(*) AS event_count
-      FROM '{raw_dataset}'
+      FROM {self._sql_source(raw_dataset)}
+      GROUP BY ALL
+    '''
+    return self.con.sql(query)
+
+  def aggregate_gharchive_rollups(self, raw_dataset, rollups: dict) -> duckdb.DuckDBPyRelation:
+    """
+    Aggregate the silver GHArchive data into several rollups in a single scan, using GROUPING SETS.
+    Every rollup counts the events per its dimensions and per event_date.
+    
+    :param raw_dataset: Full Path to the silver dataset on data lake, or a list of paths.
+    :param rollups: Dictionary mapping rollup names to their dimensions, see ROLLUP_DIMENSIONS.
+    :return: Lazy DuckDB relation with a `rollup` column naming the rollup of each row.
+             The dimensions a rollup does not group by are NULL in its rows.
+    """
+    dimensions = []
+    for rollup_dimensions in rollups.values():
+      dimensions += [dimension for dimension in rollup_dimensions + ['event_date'] if dimension not in dimensions]
+    # GROUPING() sets the bit of every dimension a row is not grouped by, the first dimension being the highest bit
+    rollup_names = []
+    for rollup, rollup_dimensions in rollups.items():
+      grouping_id = sum(1 << (len(dimensions) - 1 - i) for i, dimension in enumerate(dimensions)
+                        if dimension not in rollup_dimensions + ['event_date'])
+      rollup_names.append(f"WHEN {grouping_id} THEN '{rollup}'")
+    grouping_sets = ", ".join(f"({', '.join(rollup_dimensions + ['event_date'])})" for rollup_dimensions in rollups.values())
+    derived_columns = {
+      'event_date': "DATE_TRUNC('day',event_date)",
+      'event_hour': "DATE_TRUNC('hour',event_date)",
+      'repo_owner': "split_part(repo_name, '/', 1)",
+    }
+    projection = ", ".join(f"{derived_columns[dimension]} AS {dimension}" if dimension in derived_columns else dimension
+                           for dimension in dimensions)
+    query = f'''
+      SELECT 
+        CASE GROUPING({', '.join(dimensions)}) {' '.join(rollup_names)} END AS rollup,
+        {', '.join(dimensions)},
+        count(*) AS event_count
+      FROM (
+        SELECT {projection}
+        FROM {self._sql_source(raw_dataset)}
+      )
+      GROUP BY GROUPING SETS ({grouping_sets})
+    '''
+    return self.con.sql(query)
+
+  def build_distinct_sketches(self, raw_dataset) -> duckdb.DuckDBPyRelation:
+    """
+    Build the distinct count sketches of DISTINCT_SKETCHES from the silver GHArchive data, in a single scan.
+    Like HyperLogLog++, a key counting at most HLL_EXACT_THRESHOLD values in the day stores them exactly,
+    as (sketch, key, value) rows, and a larger key stores a dense HyperLogLog sketch, as a single
+    (sketch, key, registers) row whose blob holds the highest rank hashed into each register.
+    Sketches merge by taking the union of the values, or the highest rank of every register,
+    so daily sketches can be combined into weekly or monthly distinct counts.
+    
+    :param raw_dataset: Full Path to the silver dataset on data lake, or a list of paths.
+    :return: Lazy DuckDB relation of the sketch rows, sorted by sketch and key for key lookups.
+    """
+    columns = sorted({column for sketch_columns in DISTINCT_SKETCHES.values() for column in sketch_columns})
+    sketch_values = [f"""
+      {sketch}_values AS (
+        SELECT *, count(*) OVER (PARTITION BY key, event_date) AS value_count
+        FROM (
+          SELECT DISTINCT {key_column} AS key, {counted_column} AS value, event_date
+          FROM sketch_values
+          WHERE {key_column} IS NOT NULL AND {counted_column} IS NOT NULL
+        )
+      )""" for sketch, (key_column, counted_column) in DISTINCT_SKETCHES.items()]
+    sketch_queries = []
+    for sketch in DISTINCT_SKETCHES:
+      register_ranks = f"""
+        SELECT key, event_date, {self._hll_register_sql('value')} AS register, {self._hll_rank_sql('value')} AS rank
+        FROM {sketch}_values
+        WHERE value_count > {HLL_EXACT_THRESHOLD}
+      """
+      sketch_queries.append(f"""
+        SELECT '{sketch}' AS sketch, key, value, event_date
+        FROM {sketch}_values
+        WHERE value_count <= {HLL_EXACT_THRESHOLD}
+        UNION ALL BY NAME
+        SELECT '{sketch}' AS sketch, * FROM ({self._hll_dense_registers_sql(register_ranks, ['key', 'event_date'])})
+      """)
+    query = f'''
+      WITH sketch_values AS MATERIALIZED (
+        SELECT DISTINCT {', '.join(columns)}, DATE_TRUNC('day',event_date) AS event_date
+        FROM {self._sql_source(raw_dataset)}
+      ),
+      {','.join(sketch_values)}
+      {' UNION ALL BY NAME '.join(sketch_queries)}
+      ORDER BY sketch, key, value
+    '''
+    return self.con.sql(query)
+
+  def merge_distinct_sketches(self, sketch_dataset, sketch, keys: list = None) -> duckdb.DuckDBPyRelation:
+    """
+    Merge distinct count sketches, e.g. the daily sketches of a month, into one sketch per key.
+    A key stays exact while all of its sketches are, otherwise its values are hashed into the merged registers.
+    
+    :param sketch_dataset: Full Path to the sketches on data lake, or a list of paths.
+    :param sketch: Name of the sketch, one of DISTINCT_SKETCHES.
+    :param keys: Optional list of the keys to merge. Defaults to all keys.
+    :return: Lazy DuckDB relation of the merged (key, value, registers) rows, in the layout of build_distinct_sketches.
+    """
+    key_filter = f"AND key IN ({', '.join(str(int(key)) for key in keys)})" if keys else ""
+    register_ranks = f'''
+      SELECT key, CAST(unnest(range({1 << HLL_PRECISION})) AS USMALLINT) AS register, unnest({self._hll_ranks_sql('registers')}) AS rank
+      FROM sketch_rows
+      WHERE registers IS NOT NULL
+      UNION ALL
+      SELECT key, {self._hll_register_sql('value')} AS register, {self._hll_rank_sql('value')} AS rank
+      FROM sketch_rows SEMI JOIN dense_keys USING (key)
+      WHERE value IS NOT NULL
+    '''
+    query = f'''
+      WITH sketch_rows AS (
+        SELECT key, value, registers
+        FROM {self._sql_source(sketch_dataset)}
+        WHERE sketch = '{sketch}' {key_filter}
+      ),
+      dense_keys AS (
+        SELECT DISTINCT key FROM sketch_rows WHERE registers IS NOT NULL
+      )
+      SELECT DISTINCT key, value
+      FROM sketch_rows ANTI JOIN dense_keys USING (key)
+      WHERE value IS NOT NULL
+      UNION ALL BY NAME
+      {self._hll_dense_registers_sql(register_ranks, ['key'])}
+    '''
+    return self.con.sql(query)
+
+  def estimate_merged_sketches(self, merged_sketches: duckdb.DuckDBPyRelation, sketch) -> duckdb.DuckDBPyRelation:
+    """
+    Estimate the distinct count of every key of merged sketches: the number of values of an exact key,
+    or the HyperLogLog estimate, with its linear counting correction for small counts, of a dense one.
+    
+    :param merged_sketches: Relation of (key, value, registers) rows, as merge_distinct_sketches returns.
+    :param sketch: Name of the sketch, one of DISTINCT_SKETCHES.
+    :return: Lazy DuckDB relation with the key column of the sketch and the estimated distinct_count.
+    """
+    registers = 1 << HLL_PRECISION
+    alpha = 0.7213 / (1 + 1.079 / registers)
+    key_column = DISTINCT_SKETCHES[sketch][0]
+    query = f'''
+      SELECT
+        key AS {key_column},
+        CAST(round(CASE
+          WHEN ranks IS NULL THEN exact_count
+          WHEN raw_estimate <= {2.5 * registers} AND empty_registers > 0 THEN {registers} * ln({registers} / empty_registers)
+          ELSE raw_estimate
+        END) AS BIGINT) AS distinct_count
+      FROM (
+        SELECT
+          key,
+          exact_count,
+          ranks,
+          {alpha * registers * registers} / list_sum(list_transform(ranks, r -> pow(2, -r))) AS raw_estimate,
+          len(list_filter(ranks, r -> r = 0)) AS empty_registers
+        FROM (
+          SELECT key, count(value) AS exact_count, {self._hll_ranks_sql('max(registers)')} AS ranks
+          FROM ({merged_sketches.sql_query()})
+          GROUP BY key
+        )
+      )
+    '''
+    return self.con.sql(query)
+
+  def aggregate_hourly_gharchive(self, raw_dataset) -> duckdb.DuckDBPyRelation:
+    """
+    Aggregate the raw GHArchive data into hourly partial counts, which can be merged into daily counts.
+    
+    :param raw_dataset: Full Path to the raw dataset on data lake.
+    :return: Lazy DuckDB relation representing the hourly partial aggregate.
+    """
+    query = f'''
+      SELECT 
+        event_type,
+        repo_id,
+        repo_name,
+        repo_url,
+        DATE_TRUNC('hour',event_date) AS event_hour,
+        count(*) AS event_count
+      FROM {self._sql_source(raw_dataset)}
+      GROUP BY ALL
+    '''
+    return self.con.sql(query)
+
+  def merge_hourly_gharchive(self, partial_dataset) -> duckdb.DuckDBPyRelation:
+    """
+    Merge hourly partial aggregates into daily counts, in the same shape aggregate_raw_gharchive produces.
+    
+    :param partial_dataset: Full Path to the partial aggregates on data lake.
+    :return: Lazy DuckDB relation representing the daily aggregate.
+    """
+    query = f'''
+      SELECT 
+        event_type,
+        repo_id,
+        repo_name,
+        repo_url,
+        DATE_TRUNC('day',event_hour) AS event_date,
+        CAST(sum(event_count) AS BIGINT) AS event_count
+      FROM {self._sql_source(partial_dataset)}
       GROUP BY ALL
     '''
-    self.con.execute(f"CREATE OR REPLACE TABLE gharchive_agg AS FROM ({query})")
-    return self.con.table("gharchive_agg")
+    return self.con.sql(query)
+
+  def gharchive_schema_version(self) -> int:
+    """Get the gharchive_events schema version used to read raw data."""
+    return self.config.getint('transformer', 'gharchive_schema_version',
+                              fallback=self.schema_registry.current_version('gharchive_events'))
+
+  def silver_schema_version(self) -> int:
+    """Get the gharchive_silver schema version the silver zone is written with."""
+    return self.config.getint('transformer', 'silver_schema_version',
+                              fallback=self.schema_registry.current_version('gharchive_silver'))
+
+  @contextmanager
+  def _stage_metrics(self, stage, partition):
+    """
+    Measure a stage run by this transformer. A stage started while another one is
+    running, e.g. the partial aggregate of a serialisation, is measured as part of it.
+    The objects the stage reads through the object cache are held until it ends.
+    """
+    if self._current_stage is not None:
+      yield self._current_stage
+      return
+    with self.metrics.stage(stage, partition) as stage_metrics:
+      self._current_stage = stage_metrics
+      self._cache_hold = self.object_cache.open_hold() if self.object_cache is not None else None
+      try:
+        yield stage_metrics
+      finally:
+        if self._cache_hold is not None:
+          self.object_cache.release_hold(self._cache_hold)
+        self._current_stage = None
+        self._cache_hold = None
+
+  @contextmanager
+  def _profiled(self, step, count_rows_in: bool = True, count_rows_out: bool = True):
+    """
+    Record the DuckDB JSON profile of the query run inside the block as a step of the current stage.
+    Only the last query of the block is profiled, so it must hold the query doing the work.
+    """
+    stage_metrics = self._current_stage
+    if stage_metrics is None or not stage_metrics.enabled:
+      yield
+      return
+    profile_fd, profile_path = tempfile.mkstemp(prefix='duckdb_profile_', suffix='.json')
+    os.close(profile_fd)
+    try:
+      self.con.execute("SET enable_profiling = 'json'")
+      self.con.execute(f"SET profiling_output = '{profile_path}'")
+      try:
+        yield
+      finally:
+        self.con.execute("PRAGMA disable_profiling")
+      with open(profile_path) as f:
+        profile = json.load(f)
+      stage_metrics.add_profile(step, profile, count_rows_in, count_rows_out)
+    finally:
+      os.remove(profile_path)
+
+  def _apply_job_resources(self, job) -> None:
+    """
+    Apply the memory budget, thread cap and spill directory of a job from the [resources] section.
+    Options prefixed with the job name, e.g. aggregate_memory_limit, override the section defaults,
+    which in turn default to the [duckdb] settings. DuckDB settings are global to a database
+    instance, so a connection shared with other transformers keeps the settings it was created with.
+    
+    :param job: Name of the job, one of serialise, aggregate or compact.
+    """
+    if not self._owns_connection:
+      return
+    for setting, option in JOB_RESOURCE_SETTINGS.items():
+      value = self._job_resource(job, option) or self.config.get('duckdb', setting, fallback=None)
+      try:
+        if setting == 'temp_directory':
+          # the spill directory cannot be switched, or even set again, once data has been spilled to it
+          current_value = self.con.execute("SELECT current_setting('temp_directory')").fetchone()[0]
+          if value and value != current_value:
+            self.con.execute(f"SET temp_directory = '{value}'")
+        elif value:
+          self.con.execute(f"SET {setting} = '{value}'")
+        else:
+          # do not inherit the budget of the previous job run on this connection
+          self.con.execute(f"RESET {setting}")
+      except duckdb.NotImplementedException as e:
+        logging.warning(f"Keeping the current {setting} for the {job} job: {e}")
+
+  def _job_resource(self, job, option):
+    """Get a [resources] option of a job, falling back to the section default."""
+    return (self.config.get('resources', f"{job}_{option}", fallback=None)
+            or self.config.get('resources', option, fallback=None))
+
+  def _staging_directory(self, job):
+    """Local directory for the staged files of a job, next to its spilled data."""
+    staging_directory = self._job_resource(job, 'spill_directory') or self.config.get('duckdb', 'temp_directory', fallback=None)
+    if staging_directory:
+      os.makedirs(staging_directory, exist_ok=True)
+    return staging_directory or None
+
+  def _resolve_files(self, source_path) -> list:
+    """Expand a glob path into the list of matching files, a list of files is returned as is."""
+    if isinstance(source_path, (list, tuple)):
+      return list(source_path)
+    return [source_file for (source_file,) in self.con.execute(f"SELECT file FROM glob('{source_path}')").fetchall()]
+
+  def gold_rollups(self) -> dict:
+    """
+    Get the gold rollups configured in the [rollups] section of the config file.
+    
+    :return: Dictionary mapping rollup names to their list of dimensions.
+    """
+    rollups = {}
+    if not self.config.has_section('rollups'):
+      return rollups
+    for rollup, value in self.config.items('rollups'):
+      dimensions = [dimension.strip() for dimension in value.split(',') if dimension.strip()]
+      if not rollup.isidentifier() or rollup == 'agg':
+        raise ValueError(f"Invalid rollup name {rollup}")
+      unknown_dimensions = [dimension for dimension in dimensions if dimension not in ROLLUP_DIMENSIONS]
+      if unknown_dimensions:
+        raise ValueError(f"Rollup {rollup} has unknown dimensions {unknown_dimensions}, expected some of {ROLLUP_DIMENSIONS}")
+      # the rows of two rollups with the same dimensions could not be told apart
+      if sorted(dimensions) in [sorted(other) for other in list(rollups.values()) + [AGG_DIMENSIONS]]:
+        raise ValueError(f"Rollup {rollup} has the same dimensions as another gold table")
+      rollups[rollup] = dimensions
+    return rollups
+
+  def _hll_register_sql(self, column) -> str:
+    """ SQL expression of the HyperLogLog register a value is hashed into, from the low bits of its hash """
+    # md5 based hashes are stable across DuckDB versions, unlike hash(), so sketches of any day can be merged
+    return f"CAST(md5_number_lower(CAST({column} AS VARCHAR)) & {(1 << HLL_PRECISION) - 1} AS USMALLINT)"
+
+  def _hll_rank_sql(self, column) -> str:
+    """ SQL expression of the HyperLogLog rank of a value: the position of the first set bit in the high bits of its hash """
+    high_bits = f"(md5_number_lower(CAST({column} AS VARCHAR)) >> {HLL_PRECISION})"
+    return f"CAST(CASE WHEN {high_bits} = 0 THEN {65 - HLL_PRECISION} \
+                ELSE {64 - HLL_PRECISION} - CAST(floor(log2({high_bits})) AS INTEGER) END AS UTINYINT)"
+
+  def _hll_dense_registers_sql(self, register_ranks, group_columns: list) -> str:
+    """
+    SQL query packing (register, rank) rows into a dense HyperLogLog sketch per group, as a `registers` blob
+    of one byte per register. A rank is stored as the character of code 48 + rank, so it is always one byte.
+    
+    :param register_ranks: SQL query of the group columns and the register and rank columns.
+    :param group_columns: List of the columns a sketch is built per, e.g. key and event_date.
+    """
+    groups = ', '.join(group_columns)
+    return f'''
+      SELECT {groups}, encode(string_agg(chr(CAST(48 + coalesce(rank, 0) AS INTEGER)), '' ORDER BY register)) AS registers
+      FROM (SELECT DISTINCT {groups} FROM ({register_ranks}))
+      CROSS JOIN (SELECT CAST(range AS USMALLINT) AS register FROM range({1 << HLL_PRECISION}))
+      LEFT JOIN (SELECT {groups}, register, max(rank) AS rank FROM ({register_ranks}) GROUP BY ALL) USING ({groups}, register)
+      GROUP BY {groups}
+    '''
+
+  def _hll_ranks_sql(self, registers) -> str:
+    """ SQL expression unpacking the registers blob of a dense sketch into the list of its ranks """
+    return f"list_transform(string_split(decode({registers}), ''), c -> ascii(c) - 48)"
+
+  def _distinct_sketches_enabled(self) -> bool:
+    """ Check if distinct count sketches are written with the daily aggregate """
+    return self.config.getboolean('sketches', 'enabled', fallback=False)
+
+  def _sketches_base_path(self) -> str:
+    """ Key prefix of the distinct count sketches on the gold zone """
+    return f"{self.dataset_base_path}/sketches"
+
+  def _incremental_aggregation_enabled(self) -> bool:
+    """ Check if hourly partial aggregates are maintained for the gold zone """
+    return self.config.getboolean('transformer', 'incremental_aggregation', fallback=False)
+
+  def _silver_file_layout_matches(self, path, columns: dict) -> bool:
+    """ Check if a silver file has the columns and types of a gharchive_silver schema version """
+    file_columns = dict((name, column_type) for name, column_type, *_ in
+                        self.con.execute(f"DESCRIBE SELECT * FROM read_parquet('{path}')").fetchall())
+    # enums are written to parquet as dictionary encoded strings, and read back as VARCHAR
+    expected_columns = {column: 'VARCHAR' if column_type.startswith('ENUM') else column_type
+                        for column, column_type in columns.items()}
+    return file_columns == expected_columns
+
+  def _partials_base_path(self) -> str:
+    """ Key prefix of the hourly partial aggregates on the gold zone """
+    return f"{self.dataset_base_path}/partials"
+
+  def _raw_gharchive_reader(self, source_path, with_filename: bool = False) -> str:
+    """Build the table function reading raw GHArchive files."""
+    source = self._sql_path_list(source_path)
+    filename_option = ", filename=true" if with_filename else ""
+    if self.config.getboolean('transformer', 'schema_detection', fallback=False):
+      return f"read_json_auto({source}, ignore_errors=true{filename_option})"
+    columns = self.schema_registry.duckdb_columns('gharchive_events', self.gharchive_schema_version())
+    return f"read_json({source}, columns={columns}, format='newline_delimited', ignore_errors=true{filename_option})"
+
+  def _parquet_options(self) -> str:
+    """Build the COPY options of the parquet writer from the [parquet] section of the config file."""
+    options = ["FORMAT PARQUET"]
+    compression = self.config.get('parquet', 'compression', fallback=None)
+    if compression:
+      options.append(f"COMPRESSION {compression}")
+    compression_level = self.config.get('parquet', 'compression_level', fallback=None)
+    if compression_level:
+      options.append(f"COMPRESSION_LEVEL {int(compression_level)}")
+    row_group_size = self.config.get('parquet', 'row_group_size', fallback=None)
+    if row_group_size:
+      options.append(f"ROW_GROUP_SIZE {int(row_group_size)}")
+    return ", ".join(options)
+
+  def _sql_source(self, dataset) -> str:
+    """Render a table name or path, or a list of parquet paths, as a SQL source for a FROM clause."""
+    # parquet files are read by column name, so files of different silver schema versions can be read together
+    if isinstance(dataset, (list, tuple)) or str(dataset).endswith('.parquet'):
+      return f"read_parquet({self._sql_path_list(dataset)}, union_by_name=true)"
+    return f"'{dataset}'"
+
+  def _sql_path_list(self, source_path) -> str:
+    """Render a path, or a list of paths, as a SQL literal for the DuckDB readers."""
+    if isinstance(source_path, (list, tuple)):
+      return "[" + ", ".join(f"'{path}'" for path in source_path) + "]"
+    return f"'{source_path}'"
+
+  def _raw_file_list(self, source_bucket, source_base_path, start_date: datetime, end_date: datetime) -> list:
+    """
+    List the raw files of the hourly partitions between two dates, both inclusive.
+    The files of a day are resolved from the manifest when it records all of its hours in the range,
+    the day is listed on S3 otherwise.
+    """
+    source_files = []
+    process_day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    while process_day <= end_date:
+      day_start = max(start_date, process_day)
+      day_end = min(end_date, process_day + timedelta(hours=23))
+      if self.manifest is not None:
+        missing_hours = [hour for hour in self.manifest.missing_hours('bronze', source_base_path, process_day)
+                         if day_start.hour <= hour <= day_end.hour]
+        if not missing_hours:
+          source_files += self.manifest.hourly_files('bronze', source_base_path, day_start, day_end)
+          process_day += timedelta(days=1)
+          continue
+        logging.warning(f"Manifest has no bronze data for hours {missing_hours} of {self._partition_path(process_day)}, "
+                        f"listing S3 instead")
+      day_glob = f"s3://{source_bucket}/{source_base_path}/{self._partition_path(process_day)}/*/*"
+      for source_file in self._resolve_files(day_glob):
+        # the file path ends with <YYYY-MM-DD>/<HH>/<filename>
+        date_partition, hour_partition = source_file.split('/')[-3:-1]
+        process_date = datetime.strptime(f"{date_partition} {hour_partition}", "%Y-%m-%d %H")
+        if start_date <= process_date <= end_date:
+          source_files.append(source_file)
+      process_day += timedelta(days=1)
+    return source_files
+
+  def _lake_manifest(self):
+    """ Open the lake manifest if it is enabled in the config file """
+    if not self.config.getboolean('manifest', 'enabled', fallback=False):
+      return None
+    # relative paths are resolved against the directory of this module, like config.ini
+    manifest_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 self.config.get('manifest', 'path', fallback='lake_manifest.duckdb'))
+    return LakeManifest(manifest_path)
+
+  def _object_cache(self):
+    """ Open the local object cache if it is enabled in the config file """
+    if not self.config.getboolean('cache', 'enabled', fallback=False):
+      return None
+    # relative paths are resolved against the directory of this module, like config.ini
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             self.config.get('cache', 'path', fallback='object_cache'))
+    return LocalObjectCache(cache_dir, parse_byte_size(self.config.get('cache', 'max_size', fallback='10GB')), self._s3_client)
+
+  def _cached_source(self, source_path, cache_hold=None):
+    """
+    Map the S3 objects of a source, a path, a glob or a list of paths, to their copies in the local object cache.
+    The source is returned as is when the cache is disabled.
+    
+    :param cache_hold: Hold keeping the copies from being evicted, see LocalObjectCache.open_hold.
+                       Defaults to the hold of the current stage.
+    :return: List of local file paths, or the source path.
+    """
+    if self.object_cache is None:
+      return source_path
+    cache_hold = cache_hold or self._cache_hold
+    stats_before = self.object_cache.stats()
+    local_files = [self.object_cache.get(source_file, cache_hold) if source_file.startswith('s3://') else source_file
+                   for source_file in self._resolve_files(source_path)]
+    stats_after = self.object_cache.stats()
+    if self._current_stage is not None:
+      self._current_stage.add('cache_hits', stats_after['hits'] - stats_before['hits'])
+      self._current_stage.add('cache_misses', stats_after['misses'] - stats_before['misses'])
+    logging.info(f"Object cache: {stats_after['hits'] - stats_before['hits']} hits, "
+                 f"{stats_after['misses'] - stats_before['misses']} misses, hit rate {stats_after['hit_rate']}")
+    return local_files
+
+  def _event_id_index(self):
+    """ Open the event id index if deduplication is enabled in the config file """
+    if not self.config.getboolean('dedup', 'enabled', fallback=False):
+      return None
+    # relative paths are resolved against the directory of this module, like config.ini
+    index_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             self.config.get('dedup', 'index_path', fallback='event_id_index'))
+    return EventIdIndex(index_dir, self.config.getint('dedup', 'window_hours', fallback=24),
+                        self.config.getint('dedup', 'retention_hours', fallback=72))
+
+  def _daily_source_files(self, zone, dataset, process_date: datetime, has_hourly_partition: bool = True,
+                          column_filters: dict = None):
+    """
+    Resolve the files of a daily partition from the manifest, without listing S3.
+    Falls back to the compaction marker of a compacted silver day, or to the daily glob,
+    when the manifest is disabled or misses hours of the day, e.g. written before it was enabled.
+    
+    :param has_hourly_partition: The dataset is written per hour, e.g. silver, rather than per day, e.g. the gold aggregate.
+    :param column_filters: Optional filters skipping the files whose statistics cannot match, see LakeManifest.list_files.
+    :return: List of file paths, or a glob path.
+    """
+    if self.manifest is not None:
+      source_files = self.manifest.list_files(zone, dataset, process_date, column_filters=column_filters)
+      missing_hours = self.manifest.missing_hours(zone, dataset, process_date) if source_files and has_hourly_partition else []
+      if source_files and not missing_hours:
+        return source_files
+      if missing_hours:
+        logging.warning(f"Manifest has no {zone} data for hours {missing_hours} of {self._partition_path(process_date)}, "
+                        f"listing S3 instead")
+    if zone == 'silver' and dataset == self.dataset_base_path:
+      compacted_files = self._compacted_silver_files(process_date)
+      if compacted_files is not None:
+        return compacted_files
+    bucket = self._datalake_bucket_name()[zone]
+    if not has_hourly_partition:
+      return f"s3://{bucket}/{dataset}/{self._partition_path(process_date)}/*.parquet"
+    return self._silver_daily_file_path(bucket, dataset, process_date)
+
+  def _silver_dataset_prefix(self) -> str:
+    """ Get the S3 prefix of the silver dataset """
+    return f"s3://{self._datalake_bucket_name()['silver']}/{self.dataset_base_path}"
+
+  def _silver_day_prefix(self, process_date: datetime) -> str:
+    """ Get the S3 prefix of the daily partition of the silver dataset """
+    return f"{self._silver_dataset_prefix()}/{self._partition_path(process_date)}"
+
+  def _compaction_marker_path(self, process_date: datetime) -> str:
+    """ Get the path of the compaction marker of a silver day, listing its current compacted files """
+    return f"{self._silver_day_prefix(process_date)}/_compacted.parquet"
+
+  def _compacted_silver_files(self, process_date: datetime):
+    """
+    Get the compacted files of a silver day, None when the day was never compacted.
+    They are the daily entries of the manifest once it records the day, and are read from
+    the compaction marker otherwise, e.g. for a day compacted before the manifest was enabled.
+    """
+    if self.manifest is not None:
+      compacted_files = self.manifest.daily_files('silver', self.dataset_base_path, process_date)
+      if compacted_files:
+        return compacted_files
+      # the hours of a compacted day are only recorded once folded into its compacted files
+      if self.manifest.list_files('silver', self.dataset_base_path, process_date):
+        return None
+    marker_path = self._compaction_marker_path(process_date)
+    # a glob without wildcards is returned as is, the day is listed to check that the marker exists
+    if marker_path not in self._resolve_files(f"{self._silver_day_prefix(process_date)}/*.parquet"):
+      return None
+    return [path for (path,) in self.con.execute(f"SELECT path FROM read_parquet('{marker_path}')").fetchall()]
+
+  def _silver_input_versions(self, process_date: datetime):
+    """ Get the versions of the silver files of a day from the manifest, None when it is disabled """
+    if self.manifest is None:
+      return None
+    return self.manifest.file_versions('silver', self.dataset_base_path, process_date)
+
+  def _record_gold_lineage(self, process_date: datetime, silver_inputs) -> None:
+    """ Record the silver file versions the gold partition of a day was built from, if the manifest is enabled """
+    if self.manifest is not None and silver_inputs is not None:
+      self.manifest.record_lineage('gold', self.dataset_base_path, process_date, silver_inputs)
+
+  def _gold_partition_current(self, process_date: datetime) -> bool:
+    """ Check if the gold partition of a day was built from the current versions of its silver files """
+    if self.manifest is None:
+      return False
+    return not self.manifest.stale_partitions('gold', self.dataset_base_path, 'silver', self.dataset_base_path,
+                                              process_date, process_date)
+
+  def _log_rejected_rows(self, silver_path, process_date: datetime) -> int:
+    """
+    Count the events of an hourly silver file whose id could not be cast to the silver schema type,
+    which are kept with a NULL event_id. GHArchive events always have an id, so the count is read
+    from the null counts of the file footer. They are logged and reported as rejected_rows in the stage metrics.
+    
+    :return: Number of rejected rows.
+    """
+    rejected_rows = self.con.execute(f"""
+      SELECT coalesce(sum(stats_null_count), 0) FROM parquet_metadata('{silver_path}') WHERE path_in_schema = 'event_id'
+    """).fetchone()[0]
+    if rejected_rows:
+      logging.warning(f"{rejected_rows} events of {self._partition_path(process_date, True)} have an id that is not an integer, "
+                      f"written with a NULL event_id")
+    if self._current_stage is not None:
+      self._current_stage.add('rejected_rows', rejected_rows)
+    return rejected_rows
+
+  def _record_parquet_file(self, zone, dataset, path, process_date: datetime, has_hourly_partition: bool = False) -> None:
+    """ Record a written parquet file in the manifest, if it is enabled """
+    if self.manifest is not None:
+      self.manifest.record_file(**self._parquet_manifest_entry(zone, dataset, path, process_date, has_hourly_partition))
+
+  def _parquet_manifest_entry(self, zone, dataset, path, process_date: datetime, has_hourly_partition: bool = False) -> dict:
+    """
+    Build the manifest entry of a parquet file from its footer and object size.
+    
+    :return: Dictionary with the LakeManifest.record_file arguments.
+    """
+    row_count = self.con.execute(f"SELECT num_rows FROM parquet_file_metadata('{path}')").fetchone()[0]
+    byte_size = self.con.execute(f"SELECT size FROM read_blob('{path}')").fetchone()[0]
+    column_stats = {}
+    for column_name, physical_type, min_value, max_value in self.con.execute(f"""
+      SELECT path_in_schema, type, stats_min_value, stats_max_value FROM parquet_metadata('{path}')
+    """).fetchall():
+      if min_value is None or max_value is None:
+        continue
+      # row group statistics are rendered as text, numbers must be compared as numbers
+      sort_key = self._stats_sort_key if physical_type in ('INT32', 'INT64', 'FLOAT', 'DOUBLE') else None
+      if column_name in column_stats:
+        current_min, current_max = column_stats[column_name]
+        min_value = min(current_min, min_value, key=sort_key)
+        max_value = max(current_max, max_value, key=sort_key)
+      column_stats[column_name] = (min_value, max_value)
+    schema_version = self.silver_schema_version() if zone == 'silver' else None
+    return dict(path=path, zone=zone, dataset=dataset, partition_date=process_date,
+                partition_hour=process_date.hour if has_hourly_partition else None,
+                row_count=row_count, byte_size=byte_size, column_stats=column_stats,
+                schema_version=schema_version)
+
+  def _stats_sort_key(self, value):
+    """ Sort key comparing numeric statistics as numbers, timestamps stored as INT64 are rendered as text """
+    try:
+      return (0, float(value), value)
+    except ValueError:
+      return (1, 0, value)
 
   def _create_sink_path(self, data_type, sink_bucket, sink_base_path, process_date: datetime, has_hourly_partition: bool = False) -> str:
     """
@@ -163,6 +1535,19 @@ class DataLakeTransformer:
     else:
       return full_filename
   
+  def _raw_hourly_source_files(self, source_bucket, process_date: datetime):
+    """
+    Resolve the raw files of an hourly partition from the manifest, falling back to the hourly glob
+    when the manifest is disabled or has not recorded the hour.
+    
+    :return: List of file paths, or a glob path.
+    """
+    if self.manifest is not None:
+      source_files = self.manifest.hourly_files('bronze', self.dataset_base_path, process_date)
+      if source_files:
+        return source_files
+    return self._raw_hourly_file_path(source_bucket, self.dataset_base_path, process_date)
+
   def _raw_hourly_file_path(self, source_bucket, source_base_path, process_date: datetime) -> str:
     """Generate the S3 path for hourly silver exported files."""
     partitions_path = self._partition_path(process_date,True)
@@ -209,7 +1594,8 @@ class DataLakeTransformer:
   def _load_config(self):
     """ Load configuration from the given path """
     config = configparser.ConfigParser()
-    config_path = os.path.join(os.path.dirname(__file__), 'config.ini')
+    # the PIPELINE_CONFIG environment variable points every component at another config file
+    config_path = os.environ.get('PIPELINE_CONFIG', os.path.join(os.path.dirname(__file__), 'config.ini'))
     config.read(config_path)
     return config
 
@@ -224,19 +1610,66 @@ class DataLakeTransformer:
     except Exception as e:
       logging.error(f"An unexpected error occurred reading bucket names from config.ini file: {e}")
           
-  def _set_duckdb_s3_credentials(self) -> None:
-    """ Read S3 credentials and endpoint from config file """
+  def _s3_client(self):
+    """ Get an S3 client for object operations DuckDB does not support, such as copy and delete """
+    if not hasattr(self, '_s3'):
+      credentials = {
+        "aws_access_key_id": self.config.get('aws', 's3_access_key_id'),
+        "aws_secret_access_key": self.config.get('aws', 's3_secret_access_key')
+      }
+      if self.config.has_option('aws', 's3_region_name'):
+        credentials["region_name"] = self.config.get('aws', 's3_region_name')
+      if self.config.has_option('aws', 's3_endpoint_url'):
+        credentials["endpoint_url"] = self.config.get('aws', 's3_endpoint_url')
+      self._s3 = boto3.client('s3', **credentials)
+    return self._s3
+
+  def _copy_s3_objects(self, moves: dict) -> None:
+    """
+    Copy staged objects to their final paths, server side.
+    
+    :param moves: Dictionary mapping staged S3 paths to their final S3 paths.
+    """
+    s3_client = self._s3_client()
+    for staged_path, final_path in moves.items():
+      staged_bucket, staged_key = staged_path.replace('s3://', '').split('/', 1)
+      final_bucket, final_key = final_path.replace('s3://', '').split('/', 1)
+      s3_client.copy({'Bucket': staged_bucket, 'Key': staged_key}, final_bucket, final_key)
+
+  def _delete_s3_objects(self, paths: list) -> None:
+    """
+    Delete objects with batched delete requests.
+    
+    :param paths: List of the S3 paths to delete.
+    """
+    s3_client = self._s3_client()
+    for i in range(0, len(paths), 1000):
+      objects_per_bucket = {}
+      for path in paths[i:i + 1000]:
+        bucket, key = path.replace('s3://', '').split('/', 1)
+        objects_per_bucket.setdefault(bucket, []).append({'Key': key})
+      for bucket, objects in objects_per_bucket.items():
+        s3_client.delete_objects(Bucket=bucket, Delete={'Objects': objects, 'Quiet': True})
+
+  def _set_duckdb_s3_credentials(self, con: duckdb.DuckDBPyConnection = None) -> None:
+    """ Read S3 credentials and endpoint from config file, and set them on the connection or a cursor of it """
+    con = con or self.con
     aws_access_key_id = self.config.get('aws', 's3_access_key_id')
     aws_secret_access_key = self.config.get('aws', 's3_secret_access_key')
     s3_endpoint = self.config.get('aws', 's3_endpoint', fallback=None)
     # Set S3 credentials
-    self.con.execute(f"SET s3_access_key_id='{aws_access_key_id}'")
-    self.con.execute(f"SET s3_secret_access_key='{aws_secret_access_key}'")
+    con.execute(f"SET s3_access_key_id='{aws_access_key_id}'")
+    con.execute(f"SET s3_secret_access_key='{aws_secret_access_key}'")
     # Set S3 endpoint if provided
     if s3_endpoint:
-      self.con.execute(f"SET s3_endpoint='{s3_endpoint}'")
+      con.execute(f"SET s3_endpoint='{s3_endpoint}'")
+    # optional settings for S3 compatible stores, e.g. s3_url_style = path and s3_use_ssl = false
+    for setting in ('s3_region', 's3_url_style', 's3_use_ssl'):
+      value = self.config.get('aws', setting, fallback=None)
+      if value:
+        con.execute(f"SET {setting}='{value}'")
 
   def __del__(self):
     """Ensure the DuckDB connection is closed when the object is destroyed."""
-    if hasattr(self, 'con'):
+    if hasattr(self, 'con') and self._owns_connection:
       self.con.close()
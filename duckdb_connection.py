@@ -0,0 +1,63 @@
+import duckdb
+import logging
+import threading
+import time
+
+# the DuckDB settings that can be tuned from the [duckdb] section of config.ini
+DUCKDB_SETTINGS = ['threads', 'memory_limit', 'temp_directory', 'enable_object_cache']
+
+_shared_connection = None
+_shared_connection_lock = threading.Lock()
+
+def create_duckdb_connection(config) -> duckdb.DuckDBPyConnection:
+  """
+  Create a DuckDB connection configured from the [duckdb] section of the config file.
+  The httpfs extension is loaded from the configured extension directory and only
+  installed when it is missing there, so a pre-staged directory needs no network access.
+
+  :param config: The loaded ConfigParser object.
+  :return: A configured DuckDB connection.
+  """
+  start_time = time.perf_counter()
+  connection_config = {}
+  extension_directory = config.get('duckdb', 'extension_directory', fallback=None)
+  if extension_directory:
+    connection_config['extension_directory'] = extension_directory
+  for setting in DUCKDB_SETTINGS:
+    value = config.get('duckdb', setting, fallback=None)
+    if value:
+      connection_config[setting] = value
+  con = duckdb.connect(config=connection_config)
+  allow_install = config.getboolean('duckdb', 'allow_extension_install', fallback=True)
+  _load_extension(con, 'httpfs', allow_install)
+  elapsed_ms = (time.perf_counter() - start_time) * 1000
+  logging.info(f"DuckDB connection ready in {elapsed_ms:.1f} ms")
+  return con
+
+def shared_duckdb_connection(config) -> duckdb.DuckDBPyConnection:
+  """
+  Get the warm DuckDB connection shared within this process, creating it on first use.
+  The connection must not be used by several threads at once, use its cursor() per thread instead.
+
+  :param config: The loaded ConfigParser object.
+  :return: The shared DuckDB connection.
+  """
+  global _shared_connection
+  with _shared_connection_lock:
+    if _shared_connection is None:
+      _shared_connection = create_duckdb_connection(config)
+    return _shared_connection
+
+def _load_extension(con, extension_name, allow_install: bool = True) -> None:
+  """Load an extension, installing it first only if it is not installed yet."""
+  installed, loaded = con.execute("""
+    SELECT installed, loaded FROM duckdb_extensions() WHERE extension_name = ?
+  """, [extension_name]).fetchone()
+  if loaded:
+    return
+  if not installed:
+    if not allow_install:
+      raise RuntimeError(f"DuckDB extension {extension_name} is not installed and allow_extension_install is disabled")
+    logging.info(f"DuckDB - install extension {extension_name}")
+    con.install_extension(extension_name)
+  con.load_extension(extension_name)
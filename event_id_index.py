@@ -0,0 +1,111 @@
+import os
+import glob
+import uuid
+import logging
+from datetime import datetime, timedelta
+
+class EventIdIndex:
+  """
+  A rolling index of the event ids written to the silver zone, kept on local disk as one
+  parquet file of sorted ids per hourly partition. Serialisation anti-joins every hour
+  against the hours around it to drop the events GHArchive repeats across hourly dumps.
+  """
+  def __init__(self, index_dir, window_hours: int = 24, retention_hours: int = 72):
+    """
+    Initialise the EventIdIndex.
+
+    :param index_dir: Directory holding the hourly id files.
+    :param window_hours: Hours on either side of an hourly partition whose ids it is deduplicated against.
+    :param retention_hours: Id files of the hours older than this many hours before the newest indexed hour are removed.
+    """
+    self.index_dir = index_dir
+    self.window_hours = window_hours
+    self.retention_hours = retention_hours
+    os.makedirs(index_dir, exist_ok=True)
+
+  def hour_path(self, process_date: datetime) -> str:
+    """Path of the id file of an hourly partition."""
+    return os.path.join(self.index_dir, f"event_ids_{process_date.strftime('%Y%m%d_%H')}.parquet")
+
+  def window_files(self, process_date: datetime) -> list:
+    """
+    List the id files of the hours within the window of an hourly partition, the partition itself excluded
+    so that it can be serialised again. Later hours are included too, as backfills may run out of order.
+
+    :param process_date: the process date corresponding to the hourly partition
+    :return: List of the paths of the existing id files.
+    """
+    process_hour = process_date.replace(minute=0, second=0, microsecond=0)
+    window_files = []
+    for offset in range(-self.window_hours, self.window_hours + 1):
+      hour_path = self.hour_path(process_hour + timedelta(hours=offset))
+      if offset != 0 and os.path.exists(hour_path):
+        window_files.append(hour_path)
+    expiry_hour = self._expiry_hour(self._indexed_hours())
+    if expiry_hour is not None and process_hour - timedelta(hours=self.window_hours) < expiry_hour:
+      logging.warning(f"Hours around {process_hour} are older than the {self.retention_hours} hours retention of the "
+                      f"event id index, duplicates with the expired ones are not removed")
+    return window_files
+
+  def record_hour(self, con, query, process_date: datetime) -> None:
+    """
+    Write the ids of an hourly partition, replacing the previous ones, then expire the old id files.
+
+    :param con: DuckDB connection running the query.
+    :param query: SQL query producing the event_id BIGINT column of the ids kept in the partition.
+    :param process_date: the process date corresponding to the hourly partition
+    """
+    hour_path = self.hour_path(process_date)
+    # written aside then renamed, so concurrent serialisations never read a partial file
+    staged_path = f"{hour_path}.{uuid.uuid4().hex}.tmp"
+    try:
+      con.execute(f"COPY ({query}) TO '{staged_path}' (FORMAT PARQUET, COMPRESSION zstd)")
+      os.replace(staged_path, hour_path)
+    finally:
+      if os.path.exists(staged_path):
+        os.remove(staged_path)
+    self.expire(process_date)
+
+  def expire(self, process_date: datetime = None) -> list:
+    """
+    Remove the id files of the hours older than the retention period, counted back from the newest indexed hour
+    rather than from the time the files were written, so re-serialising old hours does not keep them alive.
+
+    :param process_date: Optional hourly partition being serialised, the id files within its window are kept,
+                         so a backfill of old hours still deduplicates them against each other.
+    :return: List of the removed paths.
+    """
+    indexed_hours = self._indexed_hours()
+    expiry_hour = self._expiry_hour(indexed_hours)
+    process_hour = process_date.replace(minute=0, second=0, microsecond=0) if process_date else None
+    removed_paths = []
+    for hour, hour_path in indexed_hours.items():
+      if hour >= expiry_hour:
+        continue
+      if process_hour is not None and abs(hour - process_hour) <= timedelta(hours=self.window_hours):
+        continue
+      try:
+        os.remove(hour_path)
+        removed_paths.append(hour_path)
+      except FileNotFoundError:
+        # expired by a concurrent serialisation
+        continue
+    if removed_paths:
+      logging.info(f"Expired {len(removed_paths)} event id index files")
+    return removed_paths
+
+  def _indexed_hours(self) -> dict:
+    """Map the hourly partitions of the id files in the index to their paths, from the file names."""
+    indexed_hours = {}
+    for hour_path in glob.glob(os.path.join(self.index_dir, 'event_ids_*.parquet')):
+      try:
+        indexed_hours[datetime.strptime(os.path.basename(hour_path), 'event_ids_%Y%m%d_%H.parquet')] = hour_path
+      except ValueError:
+        continue
+    return indexed_hours
+
+  def _expiry_hour(self, indexed_hours: dict):
+    """The first hour kept by the retention period, None when the index is empty."""
+    if not indexed_hours:
+      return None
+    return max(indexed_hours) - timedelta(hours=self.retention_hours)
@@ -0,0 +1,304 @@
+import duckdb
+import logging
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+# shared by all instances, the manifests of a process are opened by one thread at a time
+_CONNECT_LOCK = threading.Lock()
+
+class LakeManifest:
+  """
+  A catalog of the objects written to the data lake, kept in a local DuckDB database file.
+  Readers resolve their file lists from it instead of listing S3, and can skip files
+  whose column min/max statistics cannot match a filter.
+  """
+  def __init__(self, manifest_path, lock_retries: int = 10):
+    """
+    Initialise the LakeManifest.
+
+    :param manifest_path: Path of the DuckDB database file holding the manifest.
+    :param lock_retries: Attempts made to open the database while another process holds its lock.
+    """
+    self.manifest_path = manifest_path
+    self.lock_retries = lock_retries
+    with self._connect() as con:
+      con.execute("""
+        CREATE TABLE IF NOT EXISTS lake_files (
+          path VARCHAR PRIMARY KEY,
+          zone VARCHAR NOT NULL,
+          dataset VARCHAR NOT NULL,
+          partition_date DATE NOT NULL,
+          partition_hour INTEGER,
+          row_count BIGINT,
+          byte_size BIGINT,
+          schema_version INTEGER,
+          written_at TIMESTAMP NOT NULL
+        )
+      """)
+      con.execute("""
+        CREATE TABLE IF NOT EXISTS lake_file_stats (
+          path VARCHAR NOT NULL,
+          column_name VARCHAR NOT NULL,
+          min_value VARCHAR,
+          max_value VARCHAR
+        )
+      """)
+      # the input objects, and the version of each, a derived partition was last built from
+      con.execute("""
+        CREATE TABLE IF NOT EXISTS lake_lineage (
+          zone VARCHAR NOT NULL,
+          dataset VARCHAR NOT NULL,
+          partition_date DATE NOT NULL,
+          input_path VARCHAR NOT NULL,
+          input_written_at TIMESTAMP NOT NULL,
+          built_at TIMESTAMP NOT NULL
+        )
+      """)
+
+  def record_file(self, path, zone, dataset, partition_date: datetime, partition_hour: int = None,
+                  row_count: int = None, byte_size: int = None, column_stats: dict = None,
+                  schema_version: int = None) -> None:
+    """
+    Record a written object, replacing any previous entry for the same path.
+
+    :param path: Full S3 path of the object.
+    :param zone: Data lake zone of the object, e.g. silver.
+    :param dataset: Key prefix of the dataset the object belongs to.
+    :param partition_date: Date of the partition the object belongs to.
+    :param partition_hour: Hour of the partition, None for daily partitions.
+    :param row_count: Number of rows in the object, when known.
+    :param byte_size: Size of the object in bytes.
+    :param column_stats: Dictionary mapping column names to (min, max) tuples.
+    :param schema_version: Version of the schema the object was written with.
+    """
+    self.replace_files([], [dict(path=path, zone=zone, dataset=dataset, partition_date=partition_date,
+                                 partition_hour=partition_hour, row_count=row_count, byte_size=byte_size,
+                                 column_stats=column_stats, schema_version=schema_version)])
+
+  def replace_files(self, removed_paths: list, new_entries: list) -> None:
+    """
+    Remove and record objects in a single transaction, so readers see either the old or the new set.
+
+    :param removed_paths: List of the S3 paths to remove from the manifest.
+    :param new_entries: List of dictionaries with the record_file arguments of the new objects.
+    """
+    written_at = datetime.utcnow()
+    with self._connect() as con:
+      con.begin()
+      try:
+        paths = list(removed_paths) + [entry['path'] for entry in new_entries]
+        if paths:
+          con.execute("DELETE FROM lake_files WHERE path IN (SELECT unnest(?))", [paths])
+          con.execute("DELETE FROM lake_file_stats WHERE path IN (SELECT unnest(?))", [paths])
+        for entry in new_entries:
+          con.execute("INSERT INTO lake_files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+            entry['path'], entry['zone'], entry['dataset'], entry['partition_date'].date(),
+            entry.get('partition_hour'), entry.get('row_count'), entry.get('byte_size'),
+            entry.get('schema_version'), written_at])
+          column_stats = entry.get('column_stats') or {}
+          if column_stats:
+            con.executemany("INSERT INTO lake_file_stats VALUES (?, ?, ?, ?)", [
+              [entry['path'], column_name, str(min_value), str(max_value)]
+              for column_name, (min_value, max_value) in column_stats.items()])
+        con.commit()
+      except Exception:
+        con.rollback()
+        raise
+
+  def list_files(self, zone, dataset, start_date: datetime, end_date: datetime = None, column_filters: dict = None) -> list:
+    """
+    List the objects of a dataset between two partition dates, skipping the ones that cannot match the filters.
+
+    :param zone: Data lake zone of the objects.
+    :param dataset: Key prefix of the dataset.
+    :param start_date: First partition date to list.
+    :param end_date: Last partition date to list (inclusive), defaults to the start date.
+    :param column_filters: Dictionary mapping column names to a value, or to a (low, high) range, the rows must match.
+    :return: Sorted list of the S3 paths.
+    """
+    end_date = end_date or start_date
+    query = """
+      SELECT path FROM lake_files
+      WHERE zone = ? AND dataset = ? AND partition_date BETWEEN ? AND ?
+    """
+    parameters = [zone, dataset, start_date.date(), end_date.date()]
+    for column_name, value in (column_filters or {}).items():
+      low, high = value if isinstance(value, tuple) else (value, value)
+      value_type = self._sql_type(low if low is not None else high)
+      # keep files without statistics for the column, they cannot be ruled out
+      query += f"""
+        AND NOT EXISTS (
+          SELECT 1 FROM lake_file_stats s
+          WHERE s.path = lake_files.path AND s.column_name = ?
+            AND (TRY_CAST(s.max_value AS {value_type}) < ? OR TRY_CAST(s.min_value AS {value_type}) > ?)
+        )
+      """
+      parameters += [column_name, low, high]
+    with self._connect() as con:
+      return sorted(path for (path,) in con.execute(query, parameters).fetchall())
+
+  def hourly_files(self, zone, dataset, start_date: datetime, end_date: datetime = None) -> list:
+    """
+    List the hourly objects of a dataset between two partition hours.
+
+    :param zone: Data lake zone of the objects.
+    :param dataset: Key prefix of the dataset.
+    :param start_date: First partition hour to list.
+    :param end_date: Last partition hour to list (inclusive), defaults to the start hour.
+    :return: Sorted list of the S3 paths.
+    """
+    end_date = end_date or start_date
+    with self._connect() as con:
+      return sorted(path for (path,) in con.execute("""
+        SELECT path FROM lake_files
+        WHERE zone = ? AND dataset = ? AND partition_hour IS NOT NULL
+          AND partition_date + to_hours(partition_hour) BETWEEN ? AND ?
+      """, [zone, dataset, start_date, end_date]).fetchall())
+
+  def daily_files(self, zone, dataset, partition_date: datetime) -> list:
+    """
+    List the objects of a daily partition that are not written per hour, e.g. the compacted files of a silver day.
+
+    :param zone: Data lake zone of the objects.
+    :param dataset: Key prefix of the dataset.
+    :param partition_date: Date of the daily partition.
+    :return: Sorted list of the S3 paths.
+    """
+    with self._connect() as con:
+      return sorted(path for (path,) in con.execute("""
+        SELECT path FROM lake_files
+        WHERE zone = ? AND dataset = ? AND partition_date = ? AND partition_hour IS NULL
+      """, [zone, dataset, partition_date.date()]).fetchall())
+
+  def missing_hours(self, zone, dataset, partition_date: datetime) -> list:
+    """
+    List the hours of a day that have no object in the manifest.
+
+    :param zone: Data lake zone of the objects.
+    :param dataset: Key prefix of the dataset.
+    :param partition_date: Date of the daily partition to check.
+    :return: Sorted list of the missing hours.
+    """
+    with self._connect() as con:
+      present_hours = {hour for (hour,) in con.execute("""
+        SELECT DISTINCT partition_hour FROM lake_files
+        WHERE zone = ? AND dataset = ? AND partition_date = ? AND partition_hour IS NOT NULL
+      """, [zone, dataset, partition_date.date()]).fetchall()}
+      compacted = con.execute("""
+        SELECT count(*) FROM lake_files
+        WHERE zone = ? AND dataset = ? AND partition_date = ? AND partition_hour IS NULL
+      """, [zone, dataset, partition_date.date()]).fetchone()[0]
+    # a compacted day holds all of its hours in daily files
+    if compacted:
+      return []
+    return [hour for hour in range(24) if hour not in present_hours]
+
+  def file_versions(self, zone, dataset, partition_date: datetime) -> list:
+    """
+    List the objects of a daily partition with the time they were written, which identifies their version.
+
+    :param zone: Data lake zone of the objects.
+    :param dataset: Key prefix of the dataset.
+    :param partition_date: Date of the daily partition.
+    :return: Sorted list of (path, written_at) tuples.
+    """
+    with self._connect() as con:
+      return sorted(con.execute("""
+        SELECT path, written_at FROM lake_files
+        WHERE zone = ? AND dataset = ? AND partition_date = ?
+      """, [zone, dataset, partition_date.date()]).fetchall())
+
+  def record_lineage(self, zone, dataset, partition_date: datetime, inputs: list) -> None:
+    """
+    Record the input objects a daily partition was built from, replacing its previous lineage.
+
+    :param zone: Data lake zone of the built partition, e.g. gold.
+    :param dataset: Key prefix of the built dataset.
+    :param partition_date: Date of the built partition.
+    :param inputs: List of the (path, written_at) tuples of the inputs, as file_versions returns them
+                   before the partition is built.
+    """
+    built_at = datetime.utcnow()
+    with self._connect() as con:
+      con.begin()
+      try:
+        con.execute("DELETE FROM lake_lineage WHERE zone = ? AND dataset = ? AND partition_date = ?",
+                    [zone, dataset, partition_date.date()])
+        if inputs:
+          con.executemany("INSERT INTO lake_lineage VALUES (?, ?, ?, ?, ?, ?)", [
+            [zone, dataset, partition_date.date(), input_path, input_written_at, built_at]
+            for input_path, input_written_at in inputs])
+        con.commit()
+      except Exception:
+        con.rollback()
+        raise
+
+  def stale_partitions(self, zone, dataset, input_zone, input_dataset, start_date: datetime, end_date: datetime) -> list:
+    """
+    List the daily partitions whose inputs changed since they were built: an input object was
+    written, rewritten or removed after the build, or the partition was never built at all.
+
+    :param zone: Data lake zone of the built partitions, e.g. gold.
+    :param dataset: Key prefix of the built dataset.
+    :param input_zone: Data lake zone of the inputs, e.g. silver.
+    :param input_dataset: Key prefix of the input dataset.
+    :param start_date: First partition date to check.
+    :param end_date: Last partition date to check (inclusive).
+    :return: Sorted list of the stale partition dates.
+    """
+    with self._connect() as con:
+      stale_dates = con.execute("""
+        WITH inputs AS (
+          SELECT path, partition_date, written_at FROM lake_files
+          WHERE zone = ? AND dataset = ? AND partition_date BETWEEN ? AND ?
+        ), lineage AS (
+          SELECT input_path, partition_date, input_written_at FROM lake_lineage
+          WHERE zone = ? AND dataset = ? AND partition_date BETWEEN ? AND ?
+        )
+        SELECT DISTINCT partition_date FROM (
+          SELECT inputs.partition_date FROM inputs ANTI JOIN lineage
+          ON inputs.partition_date = lineage.partition_date AND inputs.path = lineage.input_path
+             AND inputs.written_at = lineage.input_written_at
+          UNION ALL
+          SELECT lineage.partition_date FROM lineage ANTI JOIN inputs
+          ON inputs.partition_date = lineage.partition_date AND inputs.path = lineage.input_path
+        )
+        ORDER BY partition_date
+      """, [input_zone, input_dataset, start_date.date(), end_date.date(),
+            zone, dataset, start_date.date(), end_date.date()]).fetchall()
+    return [datetime.combine(partition_date, datetime.min.time()) for (partition_date,) in stale_dates]
+
+  def _sql_type(self, value) -> str:
+    """Get the DuckDB type used to compare statistics with a filter value."""
+    if isinstance(value, bool):
+      return "BOOLEAN"
+    if isinstance(value, int):
+      return "BIGINT"
+    if isinstance(value, float):
+      return "DOUBLE"
+    if isinstance(value, datetime):
+      return "TIMESTAMP"
+    return "VARCHAR"
+
+  @contextmanager
+  def _connect(self):
+    """
+    Open the manifest database, retrying while another process holds its lock.
+    Threads of this process open it one at a time, as DuckDB refuses to attach a file being attached concurrently.
+    """
+    with _CONNECT_LOCK:
+      for attempt in range(self.lock_retries):
+        try:
+          con = duckdb.connect(self.manifest_path)
+          break
+        except duckdb.IOException as e:
+          if attempt == self.lock_retries - 1:
+            raise
+          logging.warning(f"Manifest {self.manifest_path} is locked, retrying: {e}")
+          time.sleep(0.1 * (2 ** attempt))
+      try:
+        yield con
+      finally:
+        con.close()
@@ -0,0 +1,281 @@
+import os
+import re
+import time
+import uuid
+import fcntl
+import shutil
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+SIZE_UNITS = {'': 1, 'B': 1, 'K': 1024, 'KB': 1024, 'M': 1024 ** 2, 'MB': 1024 ** 2,
+              'G': 1024 ** 3, 'GB': 1024 ** 3, 'T': 1024 ** 4, 'TB': 1024 ** 4}
+
+class LocalObjectCache:
+  """
+  A read-through cache of lake objects on local disk, keyed by object path and ETag, so that a changed
+  object is never served stale. The cache is capped in size and evicts the least recently used objects.
+  Several workers and processes can share the same directory: objects are written aside then renamed,
+  and eviction runs under a file lock. A job holds the objects it reads, see open_hold, so they are not
+  evicted before its query has run, whatever the number of objects fetched after them.
+  """
+  def __init__(self, cache_dir, max_size_bytes: int, s3_client_factory, eviction_grace_seconds: float = 60):
+    """
+    Initialise the LocalObjectCache.
+
+    :param cache_dir: Directory holding the cached objects.
+    :param max_size_bytes: Size the cached objects are evicted down to.
+    :param s3_client_factory: Callable returning the boto3 S3 client used to fetch the objects.
+    :param eviction_grace_seconds: Objects used more recently than this are never evicted,
+                                   so a path handed to a reader without a hold is not removed before it is opened.
+    """
+    self.cache_dir = cache_dir
+    self.max_size_bytes = max_size_bytes
+    self.eviction_grace_seconds = eviction_grace_seconds
+    self._s3_client_factory = s3_client_factory
+    self._objects_dir = os.path.join(cache_dir, 'objects')
+    self._lock_path = os.path.join(cache_dir, '.lock')
+    self._stats_lock = threading.Lock()
+    self._holds_lock = threading.Lock()
+    self._holds = {}
+    self.hits = 0
+    self.misses = 0
+    self.bytes_fetched = 0
+    os.makedirs(self._objects_dir, exist_ok=True)
+
+  def get(self, s3_path, hold=None) -> str:
+    """
+    Get the local path of a lake object, fetching it from S3 on a miss.
+    Costs a HEAD request on a hit, to check the ETag of the object.
+
+    :param s3_path: Full S3 path of the object, e.g. s3://bucket/key.
+    :param hold: Optional hold, see open_hold, keeping the object from being evicted until it is released.
+    :return: Path of the local copy, which keeps the key of the object as its suffix.
+    """
+    bucket, key = self._split_path(s3_path)
+    s3_client = self._s3_client_factory()
+    etag = s3_client.head_object(Bucket=bucket, Key=key)['ETag']
+    local_path = self._local_path(bucket, key, etag)
+    # an object evicted by another worker since it was cached is fetched again
+    if self._claim(local_path, hold):
+      self._count(hit=True)
+      return local_path
+    staged_path = self._staged_path(local_path)
+    try:
+      s3_client.download_file(bucket, key, staged_path)
+      self._count(hit=False, fetched_bytes=os.path.getsize(staged_path))
+      self._claim(local_path, hold, staged_path)
+    finally:
+      if os.path.exists(staged_path):
+        os.remove(staged_path)
+    self.evict()
+    return local_path
+
+  def open_hold(self) -> str:
+    """
+    Open a hold on the objects got with it, e.g. the files of a job, which are not evicted until it is released.
+    The hold is recorded in the cache directory, so the other processes sharing it honour it too.
+
+    :return: Identifier of the hold, to pass to get and release_hold.
+    """
+    hold = f"{os.getpid()}-{uuid.uuid4().hex}"
+    with self._holds_lock:
+      self._holds[hold] = []
+    return hold
+
+  def release_hold(self, hold) -> None:
+    """ Release a hold, its objects can be evicted again """
+    with self._holds_lock:
+      pin_paths = self._holds.pop(hold, [])
+    for pin_path in pin_paths:
+      try:
+        os.remove(pin_path)
+      except FileNotFoundError:
+        pass
+
+  @contextmanager
+  def holding(self):
+    """ Hold the objects got with the yielded hold until the block ends """
+    hold = self.open_hold()
+    try:
+      yield hold
+    finally:
+      self.release_hold(hold)
+
+  def add(self, s3_path, local_file) -> str:
+    """
+    Add a local copy of an object just written to S3, e.g. a downloaded file after its upload,
+    so that its first read is served from local disk.
+
+    :param s3_path: Full S3 path of the object.
+    :param local_file: Path of the local file holding the same bytes as the object.
+    :return: Path of the cached copy.
+    """
+    bucket, key = self._split_path(s3_path)
+    etag = self._s3_client_factory().head_object(Bucket=bucket, Key=key)['ETag']
+    local_path = self._local_path(bucket, key, etag)
+    staged_path = self._staged_path(local_path)
+    try:
+      shutil.copyfile(local_file, staged_path)
+      os.replace(staged_path, local_path)
+    finally:
+      if os.path.exists(staged_path):
+        os.remove(staged_path)
+    self.evict()
+    return local_path
+
+  def evict(self) -> list:
+    """
+    Remove the least recently used objects until the cache fits in its maximum size.
+
+    :return: List of the removed paths.
+    """
+    with self._exclusive_lock():
+      entries = []
+      pinned_paths = set()
+      for root, _, files in os.walk(self._objects_dir):
+        for filename in files:
+          if filename.endswith('.tmp'):
+            continue
+          path = os.path.join(root, filename)
+          if filename.endswith('.pin'):
+            if self._pin_alive(path):
+              pinned_paths.add(path.rsplit('.', 2)[0])
+            continue
+          try:
+            stat = os.stat(path)
+          except FileNotFoundError:
+            continue
+          entries.append((stat.st_mtime, stat.st_size, path))
+      total_size = sum(size for _, size, _ in entries)
+      grace_time = time.time() - self.eviction_grace_seconds
+      removed_paths = []
+      for used_at, size, path in sorted(entries):
+        if total_size <= self.max_size_bytes or used_at > grace_time:
+          break
+        if path in pinned_paths:
+          continue
+        try:
+          os.remove(path)
+        except FileNotFoundError:
+          pass
+        total_size -= size
+        removed_paths.append(path)
+        self._remove_empty_directories(os.path.dirname(path))
+    if removed_paths:
+      logging.info(f"Evicted {len(removed_paths)} objects from the local object cache")
+    return removed_paths
+
+  def stats(self) -> dict:
+    """Get the hit and miss counts of this instance, and its hit rate."""
+    with self._stats_lock:
+      requests = self.hits + self.misses
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'hit_rate': round(self.hits / requests, 4) if requests else None,
+        'bytes_fetched': self.bytes_fetched,
+      }
+
+  def _count(self, hit: bool, fetched_bytes: int = 0) -> None:
+    with self._stats_lock:
+      if hit:
+        self.hits += 1
+      else:
+        self.misses += 1
+      self.bytes_fetched += fetched_bytes
+
+  def _local_path(self, bucket, key, etag) -> str:
+    """ Local path of a version of an object, ending with the object key so readers still see its layout and extension """
+    version = hashlib.sha256(f"s3://{bucket}/{key}#{etag}".encode()).hexdigest()[:16]
+    return os.path.join(self._objects_dir, version, bucket, key)
+
+  def _staged_path(self, local_path) -> str:
+    # written aside then renamed, so concurrent readers never see a partial object
+    staged_path = f"{local_path}.{uuid.uuid4().hex}.tmp"
+    # created under the lock, so the eviction never removes its directory while it is written
+    with self._exclusive_lock():
+      os.makedirs(os.path.dirname(local_path), exist_ok=True)
+      open(staged_path, 'wb').close()
+    return staged_path
+
+  def _claim(self, local_path, hold, staged_path=None) -> bool:
+    """
+    Mark a cached object as used and record that a hold uses it, as a <object>.<hold>.pin file next to it.
+    Runs under the lock of the eviction, so the object cannot be evicted between the check and the pin.
+    
+    :param staged_path: Optional fetched copy of the object, moved in place first.
+    :return: False when the object is not, or no longer, in the cache.
+    """
+    pin_path = f"{local_path}.{hold}.pin" if hold is not None else None
+    with self._exclusive_lock():
+      if staged_path is not None:
+        os.replace(staged_path, local_path)
+      if not os.path.exists(local_path):
+        return False
+      self._touch(local_path)
+      if pin_path is not None:
+        open(pin_path, 'w').close()
+    if pin_path is not None:
+      with self._holds_lock:
+        self._holds[hold].append(pin_path)
+    return True
+
+  def _pin_alive(self, pin_path) -> bool:
+    """ Check that the process holding a pin is still running, the pins of a crashed process are removed """
+    pid = int(pin_path.rsplit('.', 2)[1].split('-')[0])
+    try:
+      os.kill(pid, 0)
+      return True
+    except ProcessLookupError:
+      try:
+        os.remove(pin_path)
+      except FileNotFoundError:
+        pass
+      return False
+    except PermissionError:
+      return True
+
+  def _remove_empty_directories(self, directory) -> None:
+    """ Remove the directories of an evicted object up to its version directory, once they are empty """
+    while os.path.normpath(directory) != os.path.normpath(self._objects_dir):
+      try:
+        os.rmdir(directory)
+      except OSError:
+        return
+      directory = os.path.dirname(directory)
+
+  def _touch(self, local_path) -> None:
+    """ Mark an object as used, the modification time orders the eviction """
+    try:
+      os.utime(local_path)
+    except FileNotFoundError:
+      pass
+
+  def _split_path(self, s3_path):
+    if not s3_path.startswith('s3://'):
+      raise ValueError(f"Not an S3 path: {s3_path}")
+    bucket, _, key = s3_path[len('s3://'):].partition('/')
+    return bucket, key
+
+  @contextmanager
+  def _exclusive_lock(self):
+    """ Hold the lock of the cache directory, shared with the other processes using it """
+    with open(self._lock_path, 'w') as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def parse_byte_size(value) -> int:
+  """
+  Parse a size such as 10GB or 512MB into bytes.
+
+  :param value: The size, a number of bytes or a number with a B, KB, MB, GB or TB unit.
+  """
+  match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?B?)\s*', str(value).upper())
+  if match is None:
+    raise ValueError(f"Invalid size {value}")
+  return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
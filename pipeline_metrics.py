@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import threading
+from datetime import datetime
+
+class JsonLinesMetricsSink:
+  """
+  A metrics sink appending every record as one JSON line to a local file.
+  Any object with an emit(record) method can be used as a sink instead.
+  """
+  # shared by all instances, so records from concurrent stages never interleave
+  _write_lock = threading.Lock()
+
+  def __init__(self, path):
+    """
+    Initialise the JsonLinesMetricsSink.
+
+    :param path: Path of the JSON-lines file the records are appended to.
+    """
+    self.path = path
+
+  def emit(self, record: dict) -> None:
+    """Append a metrics record to the file."""
+    line = json.dumps(record, default=str) + "\n"
+    with self._write_lock:
+      with open(self.path, 'a') as f:
+        f.write(line)
+
+class StageMetrics:
+  """
+  The measurements of one run of a pipeline stage for a partition: wall time, byte and row
+  counters, the growth of the process peak RSS and the DuckDB profile of every profiled query. The record is emitted
+  to the sink when the stage exits, whether it succeeded or failed.
+  """
+  def __init__(self, stage, partition, sink=None, operator_profiles: bool = True):
+    """
+    Initialise the StageMetrics.
+
+    :param stage: Name of the stage, e.g. serialise.
+    :param partition: The partition processed by the stage.
+    :param sink: Metrics sink the record is emitted to. Nothing is measured when it is None.
+    :param operator_profiles: Include the per-operator timings of the profiled queries in the record.
+    """
+    self.stage = stage
+    self.partition = partition
+    self.sink = sink
+    self.operator_profiles = operator_profiles
+    self.counters = {}
+    self.steps = []
+    self._lock = threading.Lock()
+    self._started_at = None
+    self._start_time = None
+    self._start_peak_rss = 0
+
+  @property
+  def enabled(self) -> bool:
+    return self.sink is not None
+
+  def add(self, counter, value) -> None:
+    """
+    Add a value to a counter of the stage, e.g. bytes_uploaded. Safe to call from several threads.
+    """
+    with self._lock:
+      self.counters[counter] = self.counters.get(counter, 0) + value
+
+  def add_profile(self, step, profile: dict, count_rows_in: bool = True, count_rows_out: bool = True) -> None:
+    """
+    Record the DuckDB JSON profile of a query run by the stage.
+
+    :param step: Name of the step the query belongs to, e.g. aggregate.
+    :param profile: The profile, as written by DuckDB with enable_profiling='json'.
+    :param count_rows_in: Add the rows scanned by the query to the rows_in counter of the stage.
+    :param count_rows_out: Add the rows written by the query to the rows_out counter of the stage.
+    """
+    rows_in = self._rows_scanned(profile)
+    rows_out = self._rows_written(profile)
+    step_record = {
+      'step': step,
+      # DuckDB 1.1 reports the latency of the query as the operator_timing of the root node
+      'latency_seconds': profile.get('latency', profile.get('operator_timing')),
+      'rows_in': rows_in,
+      'rows_out': rows_out,
+      'peak_buffer_memory': profile.get('system_peak_buffer_memory'),
+    }
+    if self.operator_profiles:
+      step_record['operators'] = self._operators(profile)
+    with self._lock:
+      self.steps.append(step_record)
+    if count_rows_in:
+      self.add('rows_in', rows_in)
+    if count_rows_out:
+      self.add('rows_out', rows_out)
+
+  def record(self, error=None) -> dict:
+    """Build the metrics record of the stage."""
+    record = {
+      'stage': self.stage,
+      'partition': self.partition,
+      'started_at': self._started_at,
+      'wall_time_seconds': round(time.perf_counter() - self._start_time, 6),
+      'status': 'failed' if error else 'succeeded',
+      'error': str(error) if error else None,
+    }
+    # the peak RSS of a process is never reset, a stage only reports how much it raised it,
+    # which stages running concurrently in the same process share
+    peak_rss = peak_rss_bytes()
+    record['process_peak_rss_mb'] = round(peak_rss / (1024 * 1024), 1)
+    record['peak_rss_growth_mb'] = round((peak_rss - self._start_peak_rss) / (1024 * 1024), 1)
+    with self._lock:
+      record.update(self.counters)
+      record['steps'] = list(self.steps)
+    return record
+
+  def __enter__(self):
+    self._started_at = datetime.utcnow().isoformat()
+    self._start_time = time.perf_counter()
+    self._start_peak_rss = peak_rss_bytes()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if self.enabled:
+      try:
+        self.sink.emit(self.record(exc_value))
+      except Exception as e:
+        # metrics must never fail the stage they measure
+        logging.error(f"Failed to emit metrics of stage {self.stage} for {self.partition}: {e}")
+    return False
+
+  def _rows_scanned(self, profile: dict) -> int:
+    """Rows produced by the scan operators, the leaves, of a profile."""
+    return sum(node.get('operator_cardinality', 0) for node in self._walk(profile)
+               if 'operator_type' in node and not node.get('children'))
+
+  def _rows_written(self, profile: dict) -> int:
+    """Rows flowing into the COPY operator of a profile, 0 when the query writes no file."""
+    for node in self._walk(profile):
+      if node.get('operator_type') == 'COPY_TO_FILE':
+        return sum(child.get('operator_cardinality', 0) for child in node.get('children', []))
+    return 0
+
+  def _operators(self, profile: dict) -> list:
+    """Flatten the operator tree of a profile, parents first."""
+    return [{
+      'operator': node.get('operator_type'),
+      'timing_seconds': node.get('operator_timing'),
+      'cardinality': node.get('operator_cardinality'),
+    } for node in self._walk(profile) if 'operator_type' in node]
+
+  def _walk(self, node: dict):
+    yield node
+    for child in node.get('children', []):
+      yield from self._walk(child)
+
+class ProgressLogger:
+  """
+  A byte transfer progress callback logging at most once per interval, with the running
+  total and throughput, instead of once per chunk. Safe to call from several threads.
+  """
+  def __init__(self, label, interval_seconds: float = 10, stage_metrics: StageMetrics = None, counter=None):
+    """
+    Initialise the ProgressLogger.
+
+    :param label: Description of the transfer used in the log lines.
+    :param interval_seconds: Minimum number of seconds between two progress log lines.
+    :param stage_metrics: Optional StageMetrics whose counter is incremented with the transferred bytes.
+    :param counter: Name of the counter to increment, e.g. bytes_uploaded.
+    """
+    self.label = label
+    self.interval_seconds = interval_seconds
+    self.stage_metrics = stage_metrics
+    self.counter = counter
+    self.total_bytes = 0
+    self._lock = threading.Lock()
+    self._start_time = time.perf_counter()
+    self._last_log_time = self._start_time
+
+  def __call__(self, bytes_transferred) -> None:
+    now = time.perf_counter()
+    with self._lock:
+      self.total_bytes += bytes_transferred
+      log_progress = now - self._last_log_time >= self.interval_seconds
+      if log_progress:
+        self._last_log_time = now
+        total_bytes = self.total_bytes
+    if log_progress:
+      logging.info(f"{self.label}: transferred {total_bytes} bytes, {self._throughput(total_bytes, now):.2f} MB/s")
+    if self.stage_metrics is not None and self.counter:
+      self.stage_metrics.add(self.counter, bytes_transferred)
+
+  def finish(self) -> None:
+    """Log the total bytes and the average throughput of the transfer."""
+    now = time.perf_counter()
+    logging.info(f"{self.label}: transferred {self.total_bytes} bytes in {now - self._start_time:.1f}s, "
+                 f"{self._throughput(self.total_bytes, now):.2f} MB/s")
+
+  def _throughput(self, total_bytes, now) -> float:
+    elapsed = max(now - self._start_time, 1e-6)
+    return total_bytes / elapsed / (1024 * 1024)
+
+class PipelineMetrics:
+  """
+  Creates the stage metrics and progress loggers of a pipeline component from the [metrics] section of the config file.
+  """
+  def __init__(self, config, sink=None):
+    """
+    Initialise the PipelineMetrics.
+
+    :param config: The loaded ConfigParser object.
+    :param sink: Optional metrics sink overriding the JSON-lines file configured in the [metrics] section.
+    """
+    if sink is None and config.getboolean('metrics', 'enabled', fallback=False):
+      # relative paths are resolved against the directory of this module, like config.ini
+      sink = JsonLinesMetricsSink(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                               config.get('metrics', 'path', fallback='pipeline_metrics.jsonl')))
+    self.sink = sink
+    self.operator_profiles = config.getboolean('metrics', 'operator_profiles', fallback=True)
+    self.progress_interval = config.getfloat('metrics', 'progress_log_interval_seconds', fallback=10)
+
+  def stage(self, stage, partition) -> StageMetrics:
+    """
+    Start measuring a stage, use the returned StageMetrics as a context manager around it.
+
+    :param stage: Name of the stage.
+    :param partition: The partition processed by the stage, e.g. its process date.
+    """
+    if isinstance(partition, datetime):
+      partition = partition.isoformat()
+    return StageMetrics(stage, partition, self.sink, self.operator_profiles)
+
+  def progress_logger(self, label, stage_metrics: StageMetrics = None, counter=None) -> ProgressLogger:
+    """Create a rate limited progress callback for a byte transfer."""
+    return ProgressLogger(label, self.progress_interval, stage_metrics, counter)
+
+def peak_rss_bytes() -> int:
+  """Get the peak resident set size of the process so far, in bytes."""
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # reported in bytes on macOS and in kilobytes on Linux
+  return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
@@ -0,0 +1,205 @@
+import os
+import json
+import threading
+import configparser
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from data_lake_ingester import DataLakeIngester
+from data_lake_transformer import DataLakeTransformer
+from duckdb_connection import create_duckdb_connection
+
+class PipelineScheduler:
+  """
+  A resident scheduler running the ingest, serialise and aggregate stages as soon as their inputs are ready.
+  """
+  STAGES = ['ingest', 'serialise', 'aggregate']
+
+  def __init__(self, dataset_base_path, ingester: DataLakeIngester = None, transformer_factory=None):
+    """
+    Initialise the PipelineScheduler.
+
+    :param dataset_base_path: The key prefix to use for this dataset
+    :param ingester: Optional DataLakeIngester to use, one is created when omitted.
+    :param transformer_factory: Optional callable returning a DataLakeTransformer for a worker thread.
+                                By default every worker gets a transformer on a cursor of one warm connection.
+    """
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    self.dataset_base_path = dataset_base_path
+    self.config = self._load_config()
+    self.ingester = ingester or DataLakeIngester(dataset_base_path)
+    if transformer_factory is None:
+      self.con = create_duckdb_connection(self.config)
+      transformer_factory = lambda: DataLakeTransformer(dataset_base_path, con=self.con.cursor())
+    self._transformer_factory = transformer_factory
+    self._thread_local = threading.local()
+    self.poll_interval = self.config.getfloat('scheduler', 'poll_interval_seconds', fallback=60)
+    self.lookback_hours = self.config.getint('scheduler', 'lookback_hours', fallback=24)
+    self.retry_delay = timedelta(seconds=self.config.getfloat('scheduler', 'retry_delay_seconds', fallback=300))
+    # serialise every ingested hour from its download instead of reading it back from bronze
+    self.ingest_and_serialise = self.config.getboolean('scheduler', 'ingest_and_serialise', fallback=False)
+    # relative paths are resolved against the directory of this module, like config.ini
+    self.state_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   self.config.get('scheduler', 'state_path', fallback='pipeline_state.json'))
+    self.state = self._load_state()
+    self._executors = {
+      stage: ThreadPoolExecutor(max_workers=self.config.getint('scheduler', f'{stage}_concurrency', fallback=2),
+                                thread_name_prefix=f"{stage}-worker")
+      for stage in self.STAGES
+    }
+    self._lock = threading.Lock()
+    self._in_flight = set()
+    self._retry_after = {}
+    self._wake_event = threading.Event()
+    self._stop_event = threading.Event()
+
+  def run_forever(self) -> None:
+    """
+    Schedule stages until stop() is called. Completed stages wake the loop up
+    straight away, the poll interval only bounds how late external changes are noticed.
+    """
+    logging.info(f"Pipeline scheduler started, state is persisted to {self.state_path}")
+    while not self._stop_event.is_set():
+      try:
+        self.run_once()
+      except Exception as e:
+        logging.error(f"Error in pipeline scheduler: {str(e)}")
+      self._wake_event.wait(self.poll_interval)
+      self._wake_event.clear()
+    for executor in self._executors.values():
+      executor.shutdown(wait=True)
+    logging.info("Pipeline scheduler stopped")
+
+  def stop(self) -> None:
+    """Ask the scheduler loop to stop after the running stages complete."""
+    self._stop_event.set()
+    self._wake_event.set()
+
+  def run_once(self, now: datetime = None) -> None:
+    """
+    Submit every stage whose inputs are ready.
+
+    :param now: the current time, defaults to the current UTC time.
+    """
+    now = now or datetime.utcnow()
+    for process_date in self._due_hours(now):
+      hour_key = self._hour_key(process_date)
+      if hour_key in self.state['serialise']:
+        continue
+      if hour_key in self.state['ingest']:
+        self._submit('serialise', hour_key, process_date, now)
+      elif self.ingester.bronze_object_exists(process_date):
+        # the bronze object landed from elsewhere, e.g. a backfill
+        self._mark_done('ingest', hour_key)
+        self._submit('serialise', hour_key, process_date, now)
+      else:
+        self._submit('ingest', hour_key, process_date, now)
+    for process_date in self._complete_days():
+      self._submit('aggregate', self._day_key(process_date), process_date, now)
+
+  def _submit(self, stage, key, process_date: datetime, now: datetime) -> None:
+    """Submit a stage for a partition unless it is already running or waiting to be retried."""
+    with self._lock:
+      if (stage, key) in self._in_flight or self._retry_after.get((stage, key), now) > now:
+        return
+      self._in_flight.add((stage, key))
+    future = self._executors[stage].submit(self._run_stage, stage, process_date)
+    future.add_done_callback(lambda f: self._on_stage_done(stage, key, f))
+
+  def _run_stage(self, stage, process_date: datetime) -> None:
+    """Run a single stage for a partition on a worker thread."""
+    logging.info(f"Running {stage} for {process_date}")
+    if stage == 'ingest' and self.ingest_and_serialise:
+      self.ingester.ingest_and_serialise_hourly(process_date, self._transformer())
+    elif stage == 'ingest':
+      self.ingester.ingest_hourly_gharchive(process_date)
+    elif stage == 'serialise':
+      self._transformer().serialise_raw_data(process_date)
+    else:
+      self._transformer().aggregate_silver_data(process_date)
+
+  def _on_stage_done(self, stage, key, future) -> None:
+    """Record the outcome of a stage and wake the scheduler loop to trigger the next stage."""
+    error = future.exception()
+    if error is not None:
+      logging.error(f"Stage {stage} failed for {key}: {error}")
+      with self._lock:
+        self._retry_after[(stage, key)] = datetime.utcnow() + self.retry_delay
+        self._in_flight.discard((stage, key))
+    else:
+      logging.info(f"Stage {stage} completed for {key}")
+      self._mark_done(stage, key)
+      if stage == 'ingest' and self.ingest_and_serialise:
+        self._mark_done('serialise', key)
+    self._wake_event.set()
+
+  def _mark_done(self, stage, key) -> None:
+    """Add a partition to the completed set of a stage and persist the state."""
+    with self._lock:
+      self._retry_after.pop((stage, key), None)
+      self.state[stage].add(key)
+      self._save_state()
+      # only released once recorded, so the partition is never submitted twice
+      self._in_flight.discard((stage, key))
+
+  def _transformer(self) -> DataLakeTransformer:
+    """Get the transformer of the current worker thread, creating it on first use."""
+    if not hasattr(self._thread_local, 'transformer'):
+      self._thread_local.transformer = self._transformer_factory()
+    return self._thread_local.transformer
+
+  def _due_hours(self, now: datetime) -> list:
+    """List the hourly partitions within the lookback window that should be available at the source."""
+    last_hour = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+    return [last_hour - timedelta(hours=offset) for offset in reversed(range(self.lookback_hours))]
+
+  def _complete_days(self) -> list:
+    """List the days with all 24 hours serialised that are not aggregated yet."""
+    with self._lock:
+      serialised_hours = list(self.state['serialise'])
+      aggregated_days = set(self.state['aggregate'])
+    hours_per_day = {}
+    for hour_key in serialised_hours:
+      day_key = hour_key[:10]
+      hours_per_day[day_key] = hours_per_day.get(day_key, 0) + 1
+    return [datetime.strptime(day_key, "%Y-%m-%d") for day_key, hours in sorted(hours_per_day.items())
+            if hours == 24 and day_key not in aggregated_days]
+
+  def _hour_key(self, process_date: datetime) -> str:
+    return process_date.strftime("%Y-%m-%d-%H")
+
+  def _day_key(self, process_date: datetime) -> str:
+    return process_date.strftime("%Y-%m-%d")
+
+  def _load_state(self) -> dict:
+    """Load the completed partitions of each stage from the state file."""
+    state = {stage: set() for stage in self.STAGES}
+    if os.path.exists(self.state_path):
+      with open(self.state_path) as f:
+        for stage, keys in json.load(f).items():
+          state[stage] = set(keys)
+      logging.info(f"Resuming pipeline state from {self.state_path}")
+    return state
+
+  def _save_state(self) -> None:
+    """
+    Persist the completed partitions of each stage, dropping the ones older than
+    the lookback window plus a day. Must be called while holding the lock.
+    """
+    oldest_day = self._day_key(datetime.utcnow() - timedelta(hours=self.lookback_hours + 24))
+    for stage in self.STAGES:
+      self.state[stage] = {key for key in self.state[stage] if key[:10] >= oldest_day}
+    # write to a temporary file first so a crash never leaves a partial state file
+    tmp_path = f"{self.state_path}.tmp"
+    with open(tmp_path, 'w') as f:
+      json.dump({stage: sorted(keys) for stage, keys in self.state.items()}, f, indent=2)
+    os.replace(tmp_path, self.state_path)
+
+  def _load_config(self):
+    """ Load configuration from the given path """
+    config = configparser.ConfigParser()
+    # the PIPELINE_CONFIG environment variable points every component at another config file
+    config_path = os.environ.get('PIPELINE_CONFIG', os.path.join(os.path.dirname(__file__), 'config.ini'))
+    config.read(config_path)
+    return config
@@ -0,0 +1,88 @@
+import os
+import json
+import logging
+import threading
+
+class SchemaRegistry:
+  """
+  A registry of versioned column/type specs for the datasets read by the pipeline.
+  Each dataset is persisted as a JSON file in the schema directory and cached in memory once loaded.
+  """
+  def __init__(self, schema_dir=None):
+    """
+    Initialise the SchemaRegistry.
+
+    :param schema_dir: Directory holding the schema files. Defaults to the `schemas` directory next to this module.
+    """
+    self.schema_dir = schema_dir or os.path.join(os.path.dirname(__file__), 'schemas')
+    self._cache = {}
+    self._lock = threading.Lock()
+
+  def get_schema(self, name, version=None) -> dict:
+    """
+    Get the column/type spec of a dataset.
+
+    :param name: Name of the dataset, e.g. gharchive_events.
+    :param version: Schema version to return. Defaults to the current version.
+    :return: Dictionary mapping column names to DuckDB types.
+    """
+    spec = self._load(name)
+    version = str(version or spec['current_version'])
+    if version not in spec['versions']:
+      raise KeyError(f"Schema {name} has no version {version}")
+    return dict(spec['versions'][version]['columns'])
+
+  def current_version(self, name) -> int:
+    """Get the current version of a dataset schema."""
+    return int(self._load(name)['current_version'])
+
+  def register_schema(self, name, columns: dict, description='') -> int:
+    """
+    Persist a new version of a dataset schema and make it the current version.
+
+    :param name: Name of the dataset.
+    :param columns: Dictionary mapping column names to DuckDB types.
+    :param description: Optional description of the change.
+    :return: The new schema version.
+    """
+    with self._lock:
+      schema_path = self._schema_path(name)
+      if os.path.exists(schema_path):
+        with open(schema_path) as f:
+          spec = json.load(f)
+      else:
+        spec = {'name': name, 'current_version': 0, 'versions': {}}
+      version = max([int(v) for v in spec['versions']] + [0]) + 1
+      spec['versions'][str(version)] = {'description': description, 'columns': dict(columns)}
+      spec['current_version'] = version
+      # write to a temporary file first so readers never see a partial spec
+      tmp_path = f"{schema_path}.tmp"
+      with open(tmp_path, 'w') as f:
+        json.dump(spec, f, indent=2)
+      os.replace(tmp_path, schema_path)
+      self._cache[name] = spec
+    logging.info(f"Registered version {version} of schema {name}")
+    return version
+
+  def duckdb_columns(self, name, version=None) -> str:
+    """
+    Render a dataset schema as a DuckDB struct literal for the `columns` option of read_json.
+
+    :param name: Name of the dataset.
+    :param version: Schema version to render. Defaults to the current version.
+    :return: The struct literal, e.g. {'id': 'VARCHAR', 'type': 'VARCHAR'}
+    """
+    columns = self.get_schema(name, version)
+    return "{" + ", ".join(f"'{column}': '{column_type}'" for column, column_type in columns.items()) + "}"
+
+  def _load(self, name) -> dict:
+    """Load a dataset schema file, using the cached copy when available."""
+    with self._lock:
+      if name not in self._cache:
+        with open(self._schema_path(name)) as f:
+          self._cache[name] = json.load(f)
+      return self._cache[name]
+
+  def _schema_path(self, name) -> str:
+    """Get the path of the schema file of a dataset."""
+    return os.path.join(self.schema_dir, f"{name}.json")
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+import sys
+import os
+import logging
+import argparse
+from datetime import datetime
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_lake_ingester import DataLakeIngester
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def parse_date_hour(value):
+  return datetime.strptime(value, "%Y-%m-%d-%H")
+
+def main():
+  parser = argparse.ArgumentParser(description="Backfill hourly GHArchive data for a date-hour range")
+  parser.add_argument("start", type=parse_date_hour, help="first hour to ingest, as YYYY-MM-DD-HH")
+  parser.add_argument("end", type=parse_date_hour, help="last hour to ingest (inclusive), as YYYY-MM-DD-HH")
+  parser.add_argument("--max-workers", type=int, default=None, help="number of hours ingested concurrently")
+  parser.add_argument("--force", action="store_true", help="transfer every hour even when its bronze object is unchanged")
+  args = parser.parse_args()
+  try:
+    ingester = DataLakeIngester("gharchive/events")
+    failed_dates = ingester.ingest_gharchive_range(args.start, args.end, args.max_workers, args.force)
+    if failed_dates:
+      logging.error(f"Failed to ingest {len(failed_dates)} hours: {', '.join(str(d) for d in failed_dates)}")
+      sys.exit(1)
+    logging.info(f"Successfully backfilled data from {args.start} to {args.end}")
+  except Exception as e:
+    logging.error(f"Error in ingest_gharchive_range: {str(e)}")
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
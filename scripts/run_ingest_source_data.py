@@ -2,21 +2,30 @@
 import sys
 import os
 import logging
+import argparse
 from datetime import datetime, timedelta
 # Add the parent directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from data_lake_ingester import DataLakeIngester
+from data_lake_transformer import DataLakeTransformer
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 def main():
+  parser = argparse.ArgumentParser(description="Ingest the GHArchive data of the previous hour")
+  parser.add_argument("--force", action="store_true", help="transfer the file even when its bronze object is unchanged")
+  parser.add_argument("--serialise", action="store_true", help="also serialise the hour to silver from the same download")
+  args = parser.parse_args()
   try:
     ingester = DataLakeIngester("gharchive/events")
     now = datetime.utcnow()
     # Calculate the process_date (1 hour before to ensure data availability at source)
     process_date = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
-    ingester.ingest_hourly_gharchive(process_date)
+    if args.serialise:
+      ingester.ingest_and_serialise_hourly(process_date, DataLakeTransformer("gharchive/events"), force=args.force)
+    else:
+      ingester.ingest_hourly_gharchive(process_date, force=args.force)
     logging.info(f"Successfully ingested data for {process_date}")
   except Exception as e:
     logging.error(f"Error in ingest_hourly_gharchive: {str(e)}")
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+import sys
+import os
+import logging
+import argparse
+from datetime import datetime, timedelta
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_lake_transformer import DataLakeTransformer
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def parse_date(value):
+  return datetime.strptime(value, "%Y-%m-%d")
+
+def main():
+  parser = argparse.ArgumentParser(description="Rewrite the silver files of a range of days in the current silver schema layout")
+  parser.add_argument("start", type=parse_date, help="first day to migrate, as YYYY-MM-DD")
+  parser.add_argument("end", type=parse_date, help="last day to migrate (inclusive), as YYYY-MM-DD")
+  args = parser.parse_args()
+  try:
+    transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+    migrated_files = []
+    process_date = args.start
+    while process_date <= args.end:
+      migrated_files += transformer.migrate_silver_data(process_date)
+      process_date += timedelta(days=1)
+    logging.info(f"Successfully migrated {len(migrated_files)} silver files from {args.start} to {args.end}")
+  except Exception as e:
+    logging.error(f"Error in migrate_silver_data: {str(e)}")
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+import sys
+import os
+import signal
+import logging
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline_scheduler import PipelineScheduler
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def main():
+  try:
+    scheduler = PipelineScheduler(dataset_base_path='gharchive/events')
+    # stop gracefully, letting the running stages complete
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: scheduler.stop())
+    scheduler.run_forever()
+  except Exception as e:
+    logging.error(f"Error in pipeline daemon: {str(e)}")
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+import sys
+import os
+import logging
+import argparse
+from datetime import datetime
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_lake_transformer import DataLakeTransformer
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def parse_date(value):
+  return datetime.strptime(value, "%Y-%m-%d")
+
+def main():
+  parser = argparse.ArgumentParser(description="Aggregate a range of daily silver partitions in a single job")
+  parser.add_argument("start", type=parse_date, help="first day to aggregate, as YYYY-MM-DD")
+  parser.add_argument("end", type=parse_date, help="last day to aggregate (inclusive), as YYYY-MM-DD")
+  args = parser.parse_args()
+  try:
+    transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+    aggregated_dates = transformer.aggregate_silver_data_range(args.start, args.end)
+    logging.info(f"Successfully aggregated {len(aggregated_dates)} days of silver data from {args.start} to {args.end}")
+  except Exception as e:
+    logging.error(f"Error in aggregate_silver_data_range: {str(e)}")
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+import sys
+import os
+import logging
+import argparse
+from datetime import datetime
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_lake_transformer import DataLakeTransformer
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def parse_date(value):
+  return datetime.strptime(value, "%Y-%m-%d")
+
+def main():
+  parser = argparse.ArgumentParser(description="Rebuild the gold partitions whose silver data changed since they were aggregated")
+  parser.add_argument("start", type=parse_date, help="first day to check, as YYYY-MM-DD")
+  parser.add_argument("end", type=parse_date, help="last day to check (inclusive), as YYYY-MM-DD")
+  parser.add_argument("--max-workers", type=int, default=None, help="number of days rebuilt concurrently")
+  args = parser.parse_args()
+  try:
+    transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+    failed_dates = transformer.reconcile_gold_data(args.start, args.end, max_workers=args.max_workers)
+    if failed_dates:
+      logging.error(f"Could not rebuild {len(failed_dates)} days: {', '.join(d.strftime('%Y-%m-%d') for d in failed_dates)}")
+      sys.exit(1)
+    logging.info(f"Successfully reconciled gold data from {args.start} to {args.end}")
+  except Exception as e:
+    logging.error(f"Error in reconcile_gold_data: {str(e)}")
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
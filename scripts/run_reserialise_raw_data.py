@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+import sys
+import os
+import logging
+import argparse
+from datetime import datetime
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_lake_transformer import DataLakeTransformer
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def parse_date_hour(value):
+  return datetime.strptime(value, "%Y-%m-%d-%H")
+
+def main():
+  parser = argparse.ArgumentParser(description="Serialise a range of hourly raw partitions in a single job")
+  parser.add_argument("start", type=parse_date_hour, help="first hour to serialise, as YYYY-MM-DD-HH")
+  parser.add_argument("end", type=parse_date_hour, help="last hour to serialise (inclusive), as YYYY-MM-DD-HH")
+  args = parser.parse_args()
+  try:
+    transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+    serialised_dates = transformer.serialise_raw_data_range(args.start, args.end)
+    logging.info(f"Successfully serialised {len(serialised_dates)} hours of raw data from {args.start} to {args.end}")
+  except Exception as e:
+    logging.error(f"Error in serialise_raw_data_range: {str(e)}")
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,28 @@
+import os
+import configparser
+import pytest
+
+LOCAL_STATE_OPTIONS = [
+  ('manifest', 'path', 'lake_manifest.duckdb'),
+  ('cache', 'path', 'object_cache'),
+  ('dedup', 'index_path', 'event_id_index'),
+  ('metrics', 'path', 'pipeline_metrics.jsonl'),
+  ('scheduler', 'state_path', 'pipeline_state.json'),
+]
+
+@pytest.fixture(autouse=True)
+def pipeline_config(tmp_path_factory, monkeypatch):
+  # the components resolve relative local state paths against the repository, keep the tests out of the working tree
+  config_path = os.environ.get('PIPELINE_CONFIG', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.ini'))
+  config = configparser.ConfigParser()
+  config.read(config_path)
+  state_dir = tmp_path_factory.mktemp('local_state')
+  for section, option, name in LOCAL_STATE_OPTIONS:
+    if not config.has_section(section):
+      config.add_section(section)
+    config.set(section, option, str(state_dir / name))
+  test_config_path = state_dir / 'config.ini'
+  with open(test_config_path, 'w') as f:
+    config.write(f)
+  monkeypatch.setenv('PIPELINE_CONFIG', str(test_config_path))
+  return test_config_path
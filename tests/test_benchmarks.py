@@ -0,0 +1,43 @@
+import sys
+import os
+import gzip
+import json
+import duckdb
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from datetime import datetime
+from benchmarks.gharchive_generator import generate_hourly_file
+from benchmarks.run_benchmarks import compare_to_baseline
+from data_lake_transformer import DataLakeTransformer
+
+def test_generate_hourly_file(tmp_path):
+  first_path, second_path = str(tmp_path / "first.json.gz"), str(tmp_path / "second.json.gz")
+  generate_hourly_file(first_path, datetime(2024, 1, 1, 5), 500)
+  generate_hourly_file(second_path, datetime(2024, 1, 1, 5), 500)
+  # the output is reproducible
+  with gzip.open(first_path, 'rt') as f:
+    events = [json.loads(line) for line in f]
+  with gzip.open(second_path, 'rt') as f:
+    assert [json.loads(line) for line in f] == events
+  assert len(events) == 500
+  assert {'id', 'type', 'actor', 'repo', 'payload', 'created_at'} <= set(events[0])
+  assert any(event['payload'].get('commits') for event in events)
+  assert all(event['created_at'].startswith("2024-01-01T05:") for event in events)
+
+def test_generated_file_is_readable(tmp_path):
+  source_path = str(tmp_path / "2024-01-01-5.json.gz")
+  generate_hourly_file(source_path, datetime(2024, 1, 1, 5), 200)
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events', con=duckdb.connect(':memory:'))
+  raw_result = transformer.register_raw_gharchive(source_path)
+  df = transformer.clean_raw_gharchive(raw_result.alias).to_df()
+  assert len(df) == 200
+  assert df['repo_id'].notna().all()
+
+def test_compare_to_baseline():
+  baseline = {'results': {'serialise/1000': {'seconds': 1.0, 'peak_rss_mb': 100}}}
+  report = {'results': {'serialise/1000': {'seconds': 1.2, 'peak_rss_mb': 150},
+                        'aggregate/1000': {'seconds': 9.0, 'peak_rss_mb': 100}}}
+  regressions = compare_to_baseline(report, baseline, tolerance=0.25)
+  assert len(regressions) == 1
+  assert regressions[0].startswith("serialise/1000 peak_rss_mb")
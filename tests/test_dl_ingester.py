@@ -0,0 +1,150 @@
+import sys
+import os
+import io
+import pytest
+from datetime import datetime
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from botocore.exceptions import ClientError
+from data_lake_ingester import DataLakeIngester
+from lake_manifest import LakeManifest
+
+class MockStreamResponse:
+  """A minimal stand-in for a streamed requests response."""
+  def __init__(self, content, status_code=200, headers=None):
+    self.status_code = status_code
+    self.raw = io.BytesIO(content)
+    self.headers = headers or {}
+
+  def raise_for_status(self):
+    raise Exception(f"HTTP {self.status_code}")
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    return False
+
+class MockSession:
+  """Returns the same canned response for every request."""
+  def __init__(self, content, status_code=200):
+    self.content = content
+    self.status_code = status_code
+
+  def get(self, url, stream=False):
+    self.downloads = getattr(self, 'downloads', 0) + 1
+    return MockStreamResponse(self.content, self.status_code)
+
+  def head(self, url, allow_redirects=False):
+    return MockStreamResponse(b"", self.status_code, {'Content-Length': str(len(self.content)), 'ETag': '"v1"'})
+
+class MockS3Client:
+  """Records uploads and reads the file object in chunks like boto3 does."""
+  def __init__(self):
+    self.uploads = {}
+
+  def upload_fileobj(self, data, bucket, key, ExtraArgs=None, Callback=None, Config=None):
+    chunks = []
+    chunk_size = Config.multipart_chunksize if Config else 1024
+    while True:
+      chunk = data.read(chunk_size)
+      if not chunk:
+        break
+      chunks.append(chunk)
+      if Callback:
+        Callback(len(chunk))
+    self.uploads[(bucket, key)] = (b"".join(chunks), Config)
+    self.objects = getattr(self, 'objects', {})
+    self.objects[(bucket, key)] = (len(self.uploads[(bucket, key)][0]), (ExtraArgs or {}).get('Metadata', {}))
+
+  def head_object(self, Bucket, Key):
+    self.heads = getattr(self, 'heads', 0) + 1
+    if (Bucket, Key) not in getattr(self, 'objects', {}):
+      raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+    size, metadata = self.objects[(Bucket, Key)]
+    return {'ContentLength': size, 'Metadata': metadata}
+
+@pytest.fixture
+def dl_ingester():
+  return DataLakeIngester("gharchive/events")
+
+def test_stream_to_s3(dl_ingester, monkeypatch):
+  content = b"x" * (3 * 1024 * 1024 + 17)
+  s3_client = MockS3Client()
+  monkeypatch.setattr(dl_ingester, '_http_session', lambda: MockSession(content))
+  monkeypatch.setattr(dl_ingester, '_s3_client', lambda: s3_client)
+  dl_ingester.stream_to_s3("http://data.gharchive.org/2024-01-01-5.json.gz", "bronze", "gharchive/events/key")
+  uploaded, transfer_config = s3_client.uploads[("bronze", "gharchive/events/key")]
+  assert uploaded == content
+  # the in-memory buffer is bounded by the transfer config
+  assert transfer_config.max_in_memory_upload_chunks >= 1
+  assert transfer_config.max_concurrency <= transfer_config.max_in_memory_upload_chunks
+
+def test_stream_to_s3_http_error(dl_ingester, monkeypatch):
+  monkeypatch.setattr(dl_ingester, '_http_session', lambda: MockSession(b"", 404))
+  monkeypatch.setattr(dl_ingester, '_s3_client', lambda: MockS3Client())
+  with pytest.raises(Exception):
+    dl_ingester.stream_to_s3("http://data.gharchive.org/missing.json.gz", "bronze", "gharchive/events/key")
+
+def test_ingest_gharchive_range(dl_ingester, monkeypatch):
+  attempts = {}
+  def flaky_ingest(process_date, stream=None, force=False):
+    attempts[process_date] = attempts.get(process_date, 0) + 1
+    # the 02:00 hour fails on its first attempt, the 03:00 hour never succeeds
+    if process_date.hour == 3 or (process_date.hour == 2 and attempts[process_date] == 1):
+      raise Exception("temporary failure")
+  monkeypatch.setattr(dl_ingester, 'ingest_hourly_gharchive', flaky_ingest)
+  dl_ingester.config.read_dict({'ingest': {'max_retries': '1', 'retry_backoff_seconds': '0'}})
+  failed = dl_ingester.ingest_gharchive_range(datetime(2024, 1, 1, 0), datetime(2024, 1, 1, 4), max_workers=3)
+  assert len(attempts) == 5
+  assert attempts[datetime(2024, 1, 1, 2)] == 2
+  assert failed == [datetime(2024, 1, 1, 3)]
+
+def test_shared_clients(dl_ingester):
+  assert dl_ingester._s3_client() is dl_ingester._s3_client()
+  assert dl_ingester._http_session() is dl_ingester._http_session()
+
+def test_ingest_skips_unchanged_objects(dl_ingester, monkeypatch):
+  session = MockSession(b"x" * 1000)
+  s3_client = MockS3Client()
+  monkeypatch.setattr(dl_ingester, '_http_session', lambda: session)
+  monkeypatch.setattr(dl_ingester, '_s3_client', lambda: s3_client)
+  monkeypatch.setattr(dl_ingester, 'manifest', None)
+  assert dl_ingester.ingest_hourly_gharchive(datetime(2024, 1, 1, 5), stream=True)
+  # a rerun only costs a HEAD request and an S3 metadata lookup
+  assert not dl_ingester.ingest_hourly_gharchive(datetime(2024, 1, 1, 5), stream=True)
+  assert session.downloads == 1
+  assert dl_ingester.ingest_hourly_gharchive(datetime(2024, 1, 1, 5), stream=True, force=True)
+  assert session.downloads == 2
+
+def test_ingest_records_bronze_objects_with_one_head(dl_ingester, monkeypatch, tmp_path):
+  s3_client = MockS3Client()
+  monkeypatch.setattr(dl_ingester, '_http_session', lambda: MockSession(b"x" * 1000))
+  monkeypatch.setattr(dl_ingester, '_s3_client', lambda: s3_client)
+  monkeypatch.setattr(dl_ingester, 'manifest', LakeManifest(str(tmp_path / "lake_manifest.duckdb")))
+  monkeypatch.setattr(dl_ingester, 'object_cache', None)
+  # the upload is checked and recorded from the same HEAD request
+  assert dl_ingester.ingest_hourly_gharchive(datetime(2024, 1, 1, 5), stream=True)
+  assert s3_client.heads == 2
+  # the metadata check of a rerun also gives the size of the unchanged object
+  assert not dl_ingester.ingest_hourly_gharchive(datetime(2024, 1, 1, 5), stream=True)
+  assert s3_client.heads == 3
+  bronze_files = dl_ingester.manifest.list_files('bronze', 'gharchive/events', datetime(2024, 1, 1))
+  assert len(bronze_files) == 1
+
+def test_ingest_and_serialise_hourly(dl_ingester, monkeypatch):
+  content = b"x" * (2 * 1024 * 1024 + 5)
+  s3_client = MockS3Client()
+  monkeypatch.setattr(dl_ingester, '_http_session', lambda: MockSession(content))
+  monkeypatch.setattr(dl_ingester, '_s3_client', lambda: s3_client)
+  monkeypatch.setattr(dl_ingester, 'manifest', None)
+  class SpoolReadingTransformer:
+    def serialise_raw_data(self, process_date, source_path=None):
+      with open(source_path, 'rb') as f:
+        self.spooled = f.read()
+  transformer = SpoolReadingTransformer()
+  assert dl_ingester.ingest_and_serialise_hourly(datetime(2024, 1, 1, 5), transformer, stream=True)
+  # the silver file is built from the same bytes that were uploaded to bronze
+  uploaded, _ = s3_client.uploads[(dl_ingester._bronze_bucket_name(), "gharchive/events/2024-01-01/05/2024-01-01-5.json.gz")]
+  assert transformer.spooled == uploaded == content
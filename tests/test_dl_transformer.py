@@ -1,12 +1,17 @@
 import sys
 import os
+import shutil
 import pytest
 import duckdb
 import pandas as pd
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # Add the parent directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from data_lake_transformer import DataLakeTransformer
+from event_id_index import EventIdIndex
+from lake_manifest import LakeManifest
 
 @pytest.fixture
 def dl_transformer():
@@ -35,10 +40,10 @@ def mock_s3_bronze_parquet_data(mock_duckdb_connection):
     mock_duckdb_connection.execute("""
         CREATE TABLE mock_bronze_data AS SELECT * FROM (
             VALUES
-            ('PushEvent', 1, 'repo1', 'http://repo1.com', '2023-01-01 10:00:00'),
-            ('PushEvent', 1, 'repo1', 'http://repo1.com', '2023-01-01 11:00:00'),
-            ('IssueEvent', 2, 'repo2', 'http://repo2.com', '2023-01-01 12:00:00'),
-            ('PushEvent', 1, 'repo1', 'http://repo1.com', '2023-01-02 10:00:00')
+            ('PushEvent', 1, 'repo1', 'http://repo1.com', TIMESTAMP '2023-01-01 10:00:00'),
+            ('PushEvent', 1, 'repo1', 'http://repo1.com', TIMESTAMP '2023-01-01 11:00:00'),
+            ('IssueEvent', 2, 'repo2', 'http://repo2.com', TIMESTAMP '2023-01-01 12:00:00'),
+            ('PushEvent', 1, 'repo1', 'http://repo1.com', TIMESTAMP '2023-01-02 10:00:00')
         ) AS t(event_type, repo_id, repo_name, repo_url, event_date)
     """)
     return "mock_bronze_data"
@@ -68,10 +73,13 @@ def test_clean_raw_gharchive(mock_duckdb_connection, sample_raw_data, monkeypatc
   assert df.loc[0, 'repo_id'] == 201
   assert df.loc[0, 'repo_name'] == 'repo1'
   assert df.loc[0, 'repo_url'] == 'https://github.com/user1/repo1'
-  assert df.loc[0, 'event_date'] == '2023-01-01 12:00:00'
-  # Assert that the gharchive_clean table was created in the connection
-  clean_table = mock_duckdb_connection.table("gharchive_clean")
-  assert isinstance(clean_table, duckdb.DuckDBPyRelation)
+  assert df.loc[0, 'event_date'] == pd.Timestamp('2023-01-01 12:00:00')
+  # the silver columns are typed
+  types = dict(zip(result.columns, map(str, result.types)))
+  assert types['event_id'] == 'BIGINT' and types['event_type'] == 'VARCHAR' and types['event_date'] == 'TIMESTAMP'
+  # Assert that the cleaned data is not materialised in the connection
+  tables = mock_duckdb_connection.execute("SELECT table_name FROM duckdb_tables()").fetchall()
+  assert ('gharchive_clean',) not in tables
 
 def test_extract_filename_from_s3_path(dl_transformer):
   # Test case 1: S3 path with extension, keep extension
@@ -110,11 +118,518 @@ def test_aggregate_raw_gharchive(mock_duckdb_connection, mock_s3_bronze_parquet_
   assert df.shape == (3, 6)
   # Assert the aggregated values
   expected_data = [
-      ('PushEvent', 1, 'repo1', 'http://repo1.com', '2023-01-01', 2),
-      ('IssueEvent', 2, 'repo2', 'http://repo2.com', '2023-01-01', 1),
-      ('PushEvent', 1, 'repo1', 'http://repo1.com', '2023-01-02', 1)
+      ('PushEvent', 1, 'repo1', 'http://repo1.com', pd.Timestamp('2023-01-01'), 2),
+      ('IssueEvent', 2, 'repo2', 'http://repo2.com', pd.Timestamp('2023-01-01'), 1),
+      ('PushEvent', 1, 'repo1', 'http://repo1.com', pd.Timestamp('2023-01-02'), 1)
   ]
   for row in expected_data:
       assert row in [tuple(r) for r in df.itertuples(index=False)]
   # Clean up
   transformer.con.close()
+
+def test_serialise_raw_gharchive_to_parquet(mock_duckdb_connection, tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'con', mock_duckdb_connection)
+  source_path = tmp_path / "2023-01-01-12.json"
+  source_path.write_text(
+    '{"id": "1", "type": "PushEvent", "actor": {"id": 101, "login": "user1", "display_login": "User One"}, '
+    '"repo": {"id": 201, "name": "user1/repo1", "url": "https://github.com/user1/repo1"}, '
+    '"payload": {"size": 1}, "created_at": "2023-01-01T12:00:00Z"}\n'
+    '{"id": "not-an-id", "type": "PushEvent", "actor": {"id": 101, "login": "user1", "display_login": "User One"}, '
+    '"repo": {"id": 201, "name": "user1/repo1", "url": "https://github.com/user1/repo1"}, '
+    '"payload": {"size": 1}, "created_at": "2023-01-01T12:00:00Z"}\n')
+  sink_path = tmp_path / "clean_20230101_12.parquet"
+  raw_result = transformer.register_raw_gharchive(str(source_path))
+  transformer.copy_to_parquet(transformer._clean_gharchive_query(raw_result.alias), str(sink_path))
+  df = mock_duckdb_connection.read_parquet(str(sink_path)).to_df()
+  assert list(df.columns) == ['event_id', 'user_id', 'user_name', 'user_display_name', 'event_type', 'repo_id', 'repo_name', 'repo_url', 'event_date']
+  assert len(df) == 2
+  assert df.loc[0, 'repo_name'] == 'user1/repo1'
+  # an id that is not an integer does not fail the hour, the event is kept and counted as rejected
+  assert df['event_id'].isna().sum() == 1
+  assert transformer._log_rejected_rows(str(sink_path), datetime(2023, 1, 1, 12)) == 1
+  # neither the raw nor the cleaned data is materialised as a table
+  assert mock_duckdb_connection.execute("SELECT count(*) FROM duckdb_tables()").fetchone()[0] == 0
+
+def test_register_raw_gharchive_explicit_schema(mock_duckdb_connection, tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'con', mock_duckdb_connection)
+  source_path = tmp_path / "2023-01-01-12.json"
+  # an hour where every id happens to look numeric must still read id as VARCHAR
+  source_path.write_text(
+    '{"id": "2", "type": "PushEvent", "actor": {"id": 101, "login": "user1", "display_login": "User One"}, '
+    '"repo": {"id": 201, "name": "user1/repo1", "url": "https://github.com/user1/repo1"}, '
+    '"payload": {"size": 1}, "public": true, "created_at": "2023-01-01T12:00:00Z"}\n')
+  raw_result = transformer.register_raw_gharchive(str(source_path))
+  # only the registered columns are read, unused fields such as payload are skipped
+  assert raw_result.columns == list(transformer.schema_registry.get_schema('gharchive_events').keys())
+  assert dict(zip(raw_result.columns, map(str, raw_result.types)))['id'] == 'VARCHAR'
+
+def test_merge_hourly_gharchive(mock_duckdb_connection, mock_s3_bronze_parquet_data, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'con', mock_duckdb_connection)
+  # partial aggregates are computed per hour, then merged into daily counts
+  partial_df = transformer.aggregate_hourly_gharchive(mock_s3_bronze_parquet_data).to_df()
+  assert len(partial_df) == 4
+  mock_duckdb_connection.register("mock_partial_data", partial_df)
+  merged = transformer.merge_hourly_gharchive("mock_partial_data")
+  daily = transformer.aggregate_raw_gharchive(mock_s3_bronze_parquet_data)
+  assert merged.columns == daily.columns
+  assert sorted(merged.fetchall()) == sorted(daily.fetchall())
+
+def test_reuse_duckdb_connection(mock_duckdb_connection):
+  first = DataLakeTransformer(dataset_base_path='gharchive/events', con=mock_duckdb_connection)
+  second = DataLakeTransformer(dataset_base_path='gharchive/events', con=mock_duckdb_connection)
+  assert first.con is second.con
+  # a connection passed in is not closed when a transformer is destroyed
+  del first
+  assert second.con.execute("SELECT 42").fetchone()[0] == 42
+
+def test_serialise_raw_data_concurrently_on_cursors(mock_duckdb_connection, tmp_path, monkeypatch):
+  # workers of the pipeline daemon serialise hours at once, on cursors of one connection
+  transformers = []
+  for worker in range(2):
+    transformer = DataLakeTransformer(dataset_base_path='gharchive/events', con=mock_duckdb_connection.cursor())
+    transformer.config.read_dict({'transformer': {'incremental_aggregation': 'false'}})
+    monkeypatch.setattr(transformer, 'event_index', None)
+    monkeypatch.setattr(transformer, 'object_cache', None)
+    monkeypatch.setattr(transformer, '_record_parquet_file', lambda *args, **kwargs: None)
+    monkeypatch.setattr(transformer, '_create_sink_path',
+                        lambda data_type, bucket, base_path, process_date, hourly=False: str(tmp_path / f"clean_{process_date.hour:02d}.parquet"))
+    monkeypatch.setattr(transformer, '_silver_day_prefix', lambda process_date: str(tmp_path))
+    transformers.append(transformer)
+  source_paths = {}
+  for hour in range(10):
+    source_path = tmp_path / f"2023-01-01-{hour}.json"
+    source_path.write_text("".join(
+      f'{{"id": "{hour * 1000 + i}", "type": "PushEvent", "actor": {{"id": 101, "login": "user1", "display_login": "User One"}}, '
+      f'"repo": {{"id": {hour}, "name": "user1/repo{hour}", "url": "u"}}, "created_at": "2023-01-01T{hour:02d}:00:00Z"}}\n'
+      for i in range(1000)))
+    source_paths[hour] = str(source_path)
+  def serialise(worker):
+    for hour in range(worker, 10, 2):
+      transformers[worker].serialise_raw_data(datetime(2023, 1, 1, hour), source_path=source_paths[hour])
+  with ThreadPoolExecutor(max_workers=2) as executor:
+    list(executor.map(serialise, range(2)))
+  # every hour holds its own events only
+  for hour in range(10):
+    assert mock_duckdb_connection.execute(f"""
+      SELECT count(*), min(repo_id), max(repo_id) FROM '{tmp_path}/clean_{hour:02d}.parquet'
+    """).fetchone() == (1000, hour, hour)
+
+def test_register_raw_gharchive_multiple_files(mock_duckdb_connection, tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'con', mock_duckdb_connection)
+  source_files = []
+  for hour in ['05', '06']:
+    hour_dir = tmp_path / "2023-01-01" / hour
+    hour_dir.mkdir(parents=True)
+    source_file = hour_dir / f"2023-01-01-{int(hour)}.json"
+    source_file.write_text(
+      f'{{"id": "{hour}", "type": "PushEvent", "actor": {{"id": 101, "login": "user1", "display_login": "User One"}}, '
+      '"repo": {"id": 201, "name": "user1/repo1", "url": "https://github.com/user1/repo1"}, '
+      '"created_at": "2023-01-01T12:00:00Z"}\n')
+    source_files.append(str(source_file))
+  raw_result = transformer.register_raw_gharchive(source_files, with_filename=True)
+  rows = mock_duckdb_connection.sql(transformer._clean_gharchive_query(raw_result.alias, with_filename=True)) \
+                               .project("event_id, filename").order("event_id").fetchall()
+  assert rows == [(5, source_files[0]), (6, source_files[1])]
+
+def test_compact_parquet_files(mock_duckdb_connection, tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'con', mock_duckdb_connection)
+  transformer.config.read_dict({'parquet': {'compression': 'zstd', 'compression_level': '3', 'row_group_size': '2048'}})
+  source_files = []
+  for hour in range(3):
+    source_file = str(tmp_path / f"clean_20230101_{hour:02d}.parquet")
+    mock_duckdb_connection.execute(f"""
+      COPY (SELECT IF(i % 2 = 0, 'PushEvent', 'IssuesEvent') AS event_type, {3 - hour} AS repo_id FROM range(2048) t(i))
+      TO '{source_file}' (FORMAT PARQUET)
+    """)
+    source_files.append(source_file)
+  compacted_files = transformer.compact_parquet_files(source_files, str(tmp_path / "compacted"))
+  assert len(compacted_files) == 1
+  rows = mock_duckdb_connection.read_parquet(compacted_files[0]).fetchall()
+  assert rows == sorted(rows, key=lambda row: (row[1], row[0]))
+  assert len(rows) == 3 * 2048
+  # small row groups sorted by repo can be pruned through their min/max statistics
+  row_groups = mock_duckdb_connection.execute(f"""
+    SELECT stats_min, stats_max, compression FROM parquet_metadata('{compacted_files[0]}')
+    WHERE path_in_schema = 'repo_id' ORDER BY row_group_id
+  """).fetchall()
+  assert row_groups == [('1', '1', 'ZSTD'), ('2', '2', 'ZSTD'), ('3', '3', 'ZSTD')]
+
+def test_compact_parquet_files_keeps_row_groups_disjoint(mock_duckdb_connection, tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'con', mock_duckdb_connection)
+  transformer.config.read_dict({'parquet': {'compression': 'zstd', 'row_group_size': '10000',
+                                            'compaction_target_file_size': '128KB'}})
+  mock_duckdb_connection.execute("SET threads = 4")
+  source_files = []
+  for hour in range(4):
+    source_file = str(tmp_path / f"clean_20230101_{hour:02d}.parquet")
+    mock_duckdb_connection.execute(f"""
+      COPY (SELECT IF(i % 3 = 0, 'PushEvent', 'IssuesEvent') AS event_type, CAST(hash(i + {hour} * 50000) % 100000 AS BIGINT) AS repo_id
+            FROM range(50000) t(i))
+      TO '{source_file}' (FORMAT PARQUET)
+    """)
+    source_files.append(source_file)
+  compacted_files = transformer.compact_parquet_files(source_files, str(tmp_path / "compacted"))
+  assert len(compacted_files) > 1
+  assert mock_duckdb_connection.read_parquet(compacted_files).count('*').fetchone()[0] == 200000
+  # the row groups, taken file by file, cover increasing repo_id ranges that never overlap
+  row_groups = mock_duckdb_connection.execute(f"""
+    SELECT CAST(stats_min_value AS BIGINT), CAST(stats_max_value AS BIGINT) FROM parquet_metadata({compacted_files})
+    WHERE path_in_schema = 'repo_id' ORDER BY file_name, row_group_id
+  """).fetchall()
+  assert len(row_groups) > len(compacted_files)
+  for (_, previous_max), (next_min, _) in zip(row_groups, row_groups[1:]):
+    assert next_min >= previous_max
+
+def test_compact_parquet_files_replaces_reserialised_hours(mock_duckdb_connection, tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'con', mock_duckdb_connection)
+  base_file = str(tmp_path / "base.parquet")
+  mock_duckdb_connection.execute(f"""
+    COPY (SELECT *, 1 AS repo_id, 'PushEvent' AS event_type
+          FROM (VALUES (1, TIMESTAMP '2023-01-01 10:05:00'), (2, TIMESTAMP '2023-01-01 10:10:00'),
+                       (3, TIMESTAMP '2023-01-01 11:00:00')) AS t(event_id, event_date))
+    TO '{base_file}' (FORMAT PARQUET)
+  """)
+  # the 10:00 hour is serialised again with fewer events, event 2 was dropped by a cleaning change
+  source_file = str(tmp_path / "clean_20230101_10.parquet")
+  mock_duckdb_connection.execute(f"""
+    COPY (SELECT 1 AS event_id, TIMESTAMP '2023-01-01 10:05:00' AS event_date, 1 AS repo_id, 'PushEvent' AS event_type)
+    TO '{source_file}' (FORMAT PARQUET)
+  """)
+  compacted_files = transformer.compact_parquet_files([source_file], str(tmp_path / "compacted"), base_files=[base_file])
+  event_ids = mock_duckdb_connection.execute(f"SELECT event_id FROM read_parquet({compacted_files}) ORDER BY event_id").fetchall()
+  assert event_ids == [(1,), (3,)]
+
+def test_daily_source_files_lists_s3_for_missing_hours(tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'manifest', LakeManifest(str(tmp_path / "lake_manifest.duckdb")))
+  monkeypatch.setattr(transformer, '_compacted_silver_files', lambda process_date: None)
+  silver_bucket = transformer._datalake_bucket_name()['silver']
+  silver_files = [f"s3://{silver_bucket}/gharchive/events/2024-01-01/{hour:02d}/clean_20240101_{hour:02d}.parquet" for hour in range(24)]
+  for hour in range(23):
+    transformer.manifest.record_file(silver_files[hour], 'silver', 'gharchive/events', datetime(2024, 1, 1, hour), hour)
+  # an hour written before the manifest was enabled is only found by listing S3
+  assert transformer._daily_source_files('silver', 'gharchive/events', datetime(2024, 1, 1)) == \
+    transformer._silver_daily_file_path(silver_bucket, 'gharchive/events', datetime(2024, 1, 1))
+  transformer.manifest.record_file(silver_files[23], 'silver', 'gharchive/events', datetime(2024, 1, 1, 23), 23)
+  assert sorted(transformer._daily_source_files('silver', 'gharchive/events', datetime(2024, 1, 1))) == silver_files
+
+def test_manifest_resolves_markers_and_bronze_files(tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  manifest = LakeManifest(str(tmp_path / "lake_manifest.duckdb"))
+  monkeypatch.setattr(transformer, 'manifest', manifest)
+  def list_s3(source_path):
+    raise AssertionError(f"{source_path} was listed")
+  monkeypatch.setattr(transformer, '_resolve_files', list_s3)
+  bronze_paths = [f"s3://bronze/gharchive/events/2024-01-01/{hour:02d}/2024-01-01-{hour}.json.gz" for hour in range(24)]
+  for hour, bronze_path in enumerate(bronze_paths):
+    manifest.record_file(bronze_path, 'bronze', 'gharchive/events', datetime(2024, 1, 1, hour), hour)
+  assert transformer._raw_hourly_source_files('bronze', datetime(2024, 1, 1, 5)) == [bronze_paths[5]]
+  assert transformer._raw_file_list('bronze', 'gharchive/events', datetime(2024, 1, 1, 5), datetime(2024, 1, 1, 7)) == bronze_paths[5:8]
+  # a day with recorded hours is not compacted, a compacted day has daily entries
+  manifest.record_file("s3://silver/gharchive/events/2024-01-01/05/clean_20240101_05.parquet",
+                       'silver', 'gharchive/events', datetime(2024, 1, 1, 5), 5)
+  assert transformer._compacted_silver_files(datetime(2024, 1, 1)) is None
+  compacted_path = "s3://silver/gharchive/events/2024-01-02/compacted/v1/clean_20240102_000.parquet"
+  manifest.record_file(compacted_path, 'silver', 'gharchive/events', datetime(2024, 1, 2))
+  assert transformer._compacted_silver_files(datetime(2024, 1, 2)) == [compacted_path]
+
+def test_compact_silver_data_swaps_versions(mock_duckdb_connection, tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events', con=mock_duckdb_connection)
+  monkeypatch.setattr(transformer, 'manifest', None)
+  monkeypatch.setattr(transformer, '_silver_dataset_prefix', lambda: str(tmp_path))
+  def copy_objects(moves):
+    for staged_path, final_path in moves.items():
+      os.makedirs(os.path.dirname(final_path), exist_ok=True)
+      shutil.copy(staged_path, final_path)
+  monkeypatch.setattr(transformer, '_copy_s3_objects', copy_objects)
+  monkeypatch.setattr(transformer, '_delete_s3_objects', lambda paths: [os.remove(path) for path in paths])
+  day_dir = tmp_path / "2024-01-01"
+  def write_hour(hour, first_id, count, label):
+    os.makedirs(day_dir / f"{hour:02d}", exist_ok=True)
+    mock_duckdb_connection.execute(f"""
+      COPY (SELECT NULLIF(i, {first_id}) AS event_id, 'PushEvent' AS event_type, i % 7 AS repo_id, '{label}' AS label,
+                   TIMESTAMP '2024-01-01' + INTERVAL ({hour}) HOUR AS event_date FROM range({first_id}, {first_id + count}) t(i))
+      TO '{day_dir}/{hour:02d}/clean_20240101_{hour:02d}.parquet' (FORMAT PARQUET)
+    """)
+  def day_rows():
+    source = transformer._sql_source(transformer._daily_source_files('silver', 'gharchive/events', datetime(2024, 1, 1)))
+    return mock_duckdb_connection.execute(f"SELECT count(*), count(DISTINCT event_id), count(*) FILTER (label = 'late') FROM {source}").fetchone()
+  write_hour(0, 0, 100, 'first')
+  write_hour(1, 100, 100, 'first')
+  compacted_files = transformer.compact_silver_data(datetime(2024, 1, 1))
+  # the first event of every hour was rejected with a NULL id
+  assert day_rows() == (200, 198, 0)
+  assert not os.listdir(day_dir / "00") and not os.listdir(day_dir / "01")
+  # a re-serialised and a late hour are not read beside the compacted files, then are folded into them
+  write_hour(1, 100, 100, 'late')
+  write_hour(2, 200, 50, 'late')
+  assert day_rows() == (200, 198, 0)
+  recompacted_files = transformer.compact_silver_data(datetime(2024, 1, 1))
+  assert day_rows() == (250, 247, 150)
+  assert not any(os.path.exists(compacted_file) for compacted_file in compacted_files)
+  # an hour left behind by a compaction that crashed before its delete is not counted twice
+  write_hour(2, 200, 50, 'late')
+  transformer.compact_silver_data(datetime(2024, 1, 1))
+  assert day_rows() == (250, 247, 150)
+  assert not any(os.path.exists(compacted_file) for compacted_file in recompacted_files)
+
+def test_reconcile_gold_data(tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'manifest', LakeManifest(str(tmp_path / "lake_manifest.duckdb")))
+  for day in (1, 2, 3):
+    silver_path = f"s3://silver/gharchive/events/2024-01-0{day}/05/clean_2024010{day}_05.parquet"
+    transformer.manifest.record_file(silver_path, 'silver', 'gharchive/events', datetime(2024, 1, day, 5), 5)
+    transformer._record_gold_lineage(datetime(2024, 1, day), transformer._silver_input_versions(datetime(2024, 1, day)))
+  # an hour of the second day lands late, and the third day is re-serialised
+  transformer.manifest.record_file("s3://silver/gharchive/events/2024-01-02/06/clean_20240102_06.parquet",
+                                   'silver', 'gharchive/events', datetime(2024, 1, 2, 6), 6)
+  transformer.manifest.record_file("s3://silver/gharchive/events/2024-01-03/05/clean_20240103_05.parquet",
+                                   'silver', 'gharchive/events', datetime(2024, 1, 3, 5), 5)
+  rebuilt = []
+  def rebuild(process_date):
+    if process_date.day == 3:
+      raise RuntimeError("aggregation failed")
+    rebuilt.append(process_date)
+    transformer._record_gold_lineage(process_date, transformer._silver_input_versions(process_date))
+  monkeypatch.setattr(transformer, '_rebuild_gold_partition', rebuild)
+  # only the stale days are rebuilt, and the ones that fail are reported
+  assert transformer.reconcile_gold_data(datetime(2024, 1, 1), datetime(2024, 1, 3), max_workers=2) == [datetime(2024, 1, 3)]
+  assert rebuilt == [datetime(2024, 1, 2)]
+  rebuilt.clear()
+  assert transformer.reconcile_gold_data(datetime(2024, 1, 1), datetime(2024, 1, 3)) == [datetime(2024, 1, 3)]
+  assert rebuilt == []
+
+def test_reconcile_gold_data_concurrently(mock_duckdb_connection, tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events', con=mock_duckdb_connection)
+  transformer.config.read_dict({'transformer': {'incremental_aggregation': 'false'}, 'sketches': {'enabled': 'true'},
+                                'rollups': {'user_daily': 'user_id', 'event_type_hourly': 'event_type, event_hour'}})
+  monkeypatch.setattr(transformer, 'manifest', LakeManifest(str(tmp_path / "lake_manifest.duckdb")))
+  monkeypatch.setattr(transformer, 'object_cache', None)
+  monkeypatch.setattr(transformer, '_create_sink_path',
+                      lambda data_type, bucket, base_path, process_date, hourly=False: str(tmp_path / f"{data_type}_{process_date:%Y%m%d}.parquet"))
+  days = range(1, 7)
+  for day in days:
+    silver_path = str(tmp_path / f"clean_2024010{day}_05.parquet")
+    mock_duckdb_connection.execute(f"""
+      COPY (SELECT range AS event_id, range % {day} AS user_id, 'user' AS user_name, 'User' AS user_display_name,
+                   'PushEvent' AS event_type, {day} AS repo_id, 'org/repo' AS repo_name, 'url' AS repo_url,
+                   TIMESTAMP '2024-01-0{day} 05:00:00' AS event_date FROM range({day * 100}))
+      TO '{silver_path}' (FORMAT PARQUET)
+    """)
+    # recorded as a daily file, a day missing hours in the manifest would be listed from S3
+    transformer.manifest.record_file(silver_path, 'silver', 'gharchive/events', datetime(2024, 1, day))
+  assert transformer.reconcile_gold_data(datetime(2024, 1, 1), datetime(2024, 1, 6), max_workers=3) == []
+  # every gold table of a day is built from the rows of that day only
+  for day in days:
+    assert mock_duckdb_connection.execute(f"SELECT repo_id, event_count FROM '{tmp_path}/agg_2024010{day}.parquet'").fetchall() == [(day, day * 100)]
+    assert mock_duckdb_connection.execute(f"SELECT count(*), sum(event_count) FROM '{tmp_path}/user_daily_2024010{day}.parquet'").fetchone() == (day, day * 100)
+    assert mock_duckdb_connection.execute(f"SELECT DISTINCT key FROM '{tmp_path}/sketches_2024010{day}.parquet' WHERE sketch = 'repo_actors'").fetchall() == [(day,)]
+  assert transformer.manifest.stale_partitions('gold', 'gharchive/events', 'silver', 'gharchive/events',
+                                               datetime(2024, 1, 1), datetime(2024, 1, 6)) == []
+
+def test_migrate_silver_data(mock_duckdb_connection, tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'con', mock_duckdb_connection)
+  hour_dir = tmp_path / "2023-01-01" / "05"
+  hour_dir.mkdir(parents=True)
+  # a file of the first silver layout, with string ids and the repo url
+  source_file = str(hour_dir / "clean_20230101_05.parquet")
+  mock_duckdb_connection.execute(f"""
+    COPY (SELECT range::VARCHAR AS event_id, 101 AS user_id, 'user1' AS user_name, 'User One' AS user_display_name,
+                 'PushEvent' AS event_type, 201 AS repo_id, 'user1/repo1' AS repo_name,
+                 'https://api.github.com/repos/user1/repo1' AS repo_url, TIMESTAMP '2023-01-01 05:00:00' AS event_date
+          FROM range(10))
+    TO '{source_file}' (FORMAT PARQUET)
+  """)
+  monkeypatch.setattr(transformer, '_daily_source_files', lambda *args, **kwargs: [source_file])
+  recorded = []
+  monkeypatch.setattr(transformer, '_record_parquet_file', lambda zone, dataset, path, process_date, hourly=False: recorded.append((path, process_date, hourly)))
+  assert transformer.migrate_silver_data(datetime(2023, 1, 1)) == [source_file]
+  migrated = mock_duckdb_connection.sql(f"FROM '{source_file}'")
+  assert dict(zip(migrated.columns, map(str, migrated.types))) == {
+    'event_id': 'BIGINT', 'user_id': 'BIGINT', 'user_name': 'VARCHAR', 'user_display_name': 'VARCHAR',
+    'event_type': 'VARCHAR', 'repo_id': 'BIGINT', 'repo_name': 'VARCHAR', 'repo_url': 'VARCHAR', 'event_date': 'TIMESTAMP'}
+  assert migrated.aggregate("count(*), sum(event_id)").fetchone() == (10, 45)
+  assert recorded == [(source_file, datetime(2023, 1, 1, 5), True)]
+  # files already in the current layout are left as they are
+  assert transformer.migrate_silver_data(datetime(2023, 1, 1)) == []
+
+def test_aggregate_raw_gharchive_is_lazy(mock_duckdb_connection, mock_s3_bronze_parquet_data, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'con', mock_duckdb_connection)
+  result = transformer.aggregate_raw_gharchive(mock_s3_bronze_parquet_data)
+  # nothing is materialised until the relation is consumed
+  tables = [name for (name,) in mock_duckdb_connection.execute("SELECT table_name FROM duckdb_tables()").fetchall()]
+  assert 'gharchive_agg' not in tables
+  assert len(result.fetchall()) == 3
+
+def test_apply_job_resources():
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  transformer.config.read_dict({'duckdb': {'memory_limit': '', 'threads': ''},
+                                'resources': {'memory_limit': '', 'threads': '', 'spill_directory': '',
+                                              'aggregate_memory_limit': '256MB', 'aggregate_threads': '1'}})
+  default_memory_limit = transformer.con.execute("SELECT current_setting('memory_limit')").fetchone()[0]
+  transformer._apply_job_resources('aggregate')
+  assert transformer.con.execute("SELECT current_setting('memory_limit')").fetchone()[0] == '244.1 MiB'
+  assert transformer.con.execute("SELECT current_setting('threads')").fetchone()[0] == 1
+  # the next job does not inherit the aggregate budget
+  transformer._apply_job_resources('serialise')
+  assert transformer.con.execute("SELECT current_setting('memory_limit')").fetchone()[0] == default_memory_limit
+
+def test_aggregate_silver_data_range(mock_duckdb_connection, tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'con', mock_duckdb_connection)
+  silver_files = {}
+  for day in (1, 2):
+    silver_files[day] = str(tmp_path / f"clean_2023010{day}.parquet")
+    mock_duckdb_connection.execute(f"""
+      COPY (SELECT 'PushEvent' AS event_type, range % 3 AS repo_id, 'repo' AS repo_name, 'url' AS repo_url,
+                   TIMESTAMP '2023-01-0{day} 10:00:00' AS event_date FROM range(10 * {day}))
+      TO '{silver_files[day]}' (FORMAT PARQUET)
+    """)
+  monkeypatch.setattr(transformer, '_daily_source_files', lambda zone, dataset, process_date: [silver_files[process_date.day]])
+  monkeypatch.setattr(transformer, '_create_sink_path',
+                      lambda data_type, bucket, base_path, process_date, hourly=False: str(tmp_path / f"agg_{process_date:%Y%m%d}.parquet"))
+  monkeypatch.setattr(transformer, '_record_parquet_file', lambda *args, **kwargs: None)
+  aggregated_dates = transformer.aggregate_silver_data_range(datetime(2023, 1, 1), datetime(2023, 1, 2), incremental=False)
+  assert aggregated_dates == [datetime(2023, 1, 1), datetime(2023, 1, 2)]
+  day_one = mock_duckdb_connection.execute(f"SELECT * FROM '{tmp_path}/agg_20230101.parquet' ORDER BY repo_id")
+  assert [column[0] for column in day_one.description][-1] == 'event_count'
+  assert [row[-1] for row in day_one.fetchall()] == [4, 3, 3]
+  day_two = mock_duckdb_connection.execute(f"SELECT event_count FROM '{tmp_path}/agg_20230102.parquet' ORDER BY repo_id")
+  assert [count for (count,) in day_two.fetchall()] == [7, 7, 6]
+
+def test_write_gharchive_rollups(mock_duckdb_connection, tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'con', mock_duckdb_connection)
+  silver_path = str(tmp_path / "clean_20230101.parquet")
+  mock_duckdb_connection.execute(f"""
+    COPY (SELECT range AS event_id, range % 4 AS user_id, 'user' || (range % 4) AS user_name, 'User' AS user_display_name,
+                 ['PushEvent', 'WatchEvent'][range % 2 + 1] AS event_type, range % 3 AS repo_id, 'org' || (range % 2) || '/repo' || (range % 3) AS repo_name,
+                 'url' AS repo_url, TIMESTAMP '2023-01-01 10:00:00' + INTERVAL (range) MINUTE AS event_date FROM range(120))
+    TO '{silver_path}' (FORMAT PARQUET)
+  """)
+  transformer.config.read_dict({'rollups': {'user_daily': 'user_id, user_name', 'event_type_hourly': 'event_type, event_hour'}})
+  monkeypatch.setattr(transformer, '_create_sink_path',
+                      lambda data_type, bucket, base_path, process_date, hourly=False: str(tmp_path / f"{data_type}.parquet"))
+  monkeypatch.setattr(transformer, '_record_parquet_file', lambda *args, **kwargs: None)
+  rollups = {'agg': ['event_type', 'repo_id', 'repo_name', 'repo_url'], **transformer.gold_rollups()}
+  transformer.write_gharchive_rollups([silver_path], rollups, datetime(2023, 1, 1))
+  # every rollup matches a separate aggregation of the silver data
+  for rollup, dimensions in rollups.items():
+    rollup_rows = mock_duckdb_connection.execute(f"SELECT * FROM '{tmp_path}/{rollup}.parquet' ORDER BY ALL").fetchall()
+    expected_rows = mock_duckdb_connection.execute(f"""
+      SELECT {', '.join(dimensions)}, DATE_TRUNC('day', event_date) AS event_date, count(*) AS event_count
+      FROM (SELECT *, DATE_TRUNC('hour', event_date) AS event_hour FROM '{silver_path}')
+      GROUP BY ALL ORDER BY ALL
+    """).fetchall()
+    assert rollup_rows == expected_rows
+
+def test_gold_rollups_validation(dl_transformer):
+  dl_transformer.config.read_dict({'rollups': {'repo_daily': 'repo_id, unknown_column'}})
+  with pytest.raises(ValueError):
+    dl_transformer.gold_rollups()
+
+def test_estimate_distinct_counts(mock_duckdb_connection, tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'con', mock_duckdb_connection)
+  monkeypatch.setattr(transformer, '_create_sink_path',
+                      lambda data_type, bucket, base_path, process_date, hourly=False: str(tmp_path / f"{data_type}_{process_date.day}.parquet"))
+  monkeypatch.setattr(transformer, '_record_parquet_file', lambda *args, **kwargs: None)
+  monkeypatch.setattr(transformer, '_daily_source_files',
+                      lambda zone, dataset, process_date, **kwargs: [str(tmp_path / f"sketches_{process_date.day}.parquet")])
+  for day in (1, 2):
+    silver_path = str(tmp_path / f"clean_2023010{day}.parquet")
+    # repo 1 gets actors 0-99 on the first day and 50-149 on the second one, repo 2 actors 0-999 and 500-1499,
+    # repo 3 actors 0-299 and 200-1199, so its exact first day merges into the registers of its dense second day
+    mock_duckdb_connection.execute(f"""
+      COPY (SELECT range::VARCHAR AS event_id, user_id, repo_id, TIMESTAMP '2023-01-0{day} 10:00:00' AS event_date
+            FROM range(1), (VALUES (1, 100, 50), (2, 1000, 500), (3, {300 if day == 1 else 1000}, 200)) AS repos(repo_id, actors, shift),
+                 LATERAL (SELECT range + shift * {day - 1} AS user_id FROM range(actors)))
+      TO '{silver_path}' (FORMAT PARQUET)
+    """)
+    transformer.write_distinct_sketches(silver_path, datetime(2023, 1, day))
+  # keys with few values are counted exactly, the estimates of the dense ones are within a few percent
+  daily_counts = dict(transformer.estimate_distinct_counts('repo_actors', datetime(2023, 1, 1), datetime(2023, 1, 1)).fetchall())
+  assert daily_counts[1] == 100 and abs(daily_counts[2] - 1000) <= 40 and daily_counts[3] == 300
+  # merging the days counts the actors of both days once
+  range_counts = dict(transformer.estimate_distinct_counts('repo_actors', datetime(2023, 1, 1), datetime(2023, 1, 2)).fetchall())
+  assert range_counts[1] == 150 and abs(range_counts[2] - 1500) <= 60 and abs(range_counts[3] - 1200) <= 48
+  user_counts = transformer.estimate_distinct_counts('user_repos', datetime(2023, 1, 1), datetime(2023, 1, 2), keys=[60]).fetchall()
+  assert user_counts == [(60, 3)]
+
+def test_distinct_sketches_are_smaller_than_register_rows(mock_duckdb_connection, tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'con', mock_duckdb_connection)
+  # many repos with a few actors and a few repos with many actors
+  silver_path = str(tmp_path / "clean_20230101.parquet")
+  mock_duckdb_connection.execute(f"""
+    COPY (SELECT range::VARCHAR AS event_id, user_id, repo_id, TIMESTAMP '2023-01-01 10:00:00' AS event_date
+          FROM range(1), (SELECT range AS repo_id, CASE WHEN range < 5 THEN 5000 ELSE 20 END AS actors FROM range(500)),
+               LATERAL (SELECT range * 7 + repo_id AS user_id FROM range(actors)))
+    TO '{silver_path}' (FORMAT PARQUET)
+  """)
+  sketch_path = str(tmp_path / "sketches.parquet")
+  transformer.build_distinct_sketches(silver_path).write_parquet(sketch_path)
+  # the sparse layout kept a (sketch, key, register, rank) row for every register a key hashed values into
+  register_rows_path = str(tmp_path / "register_rows.parquet")
+  mock_duckdb_connection.execute(f"""
+    COPY (SELECT 'repo_actors' AS sketch, repo_id AS key, {transformer._hll_register_sql('user_id')} AS register,
+                 max({transformer._hll_rank_sql('user_id')}) AS rank, DATE_TRUNC('day', event_date) AS event_date
+          FROM '{silver_path}' GROUP BY ALL
+          UNION ALL
+          SELECT 'user_repos', user_id, {transformer._hll_register_sql('repo_id')}, max({transformer._hll_rank_sql('repo_id')}),
+                 DATE_TRUNC('day', event_date)
+          FROM '{silver_path}' GROUP BY ALL
+          ORDER BY sketch, key)
+    TO '{register_rows_path}' (FORMAT PARQUET)
+  """)
+  dense_sizes = mock_duckdb_connection.execute(f"SELECT DISTINCT octet_length(registers) FROM '{sketch_path}' WHERE registers IS NOT NULL").fetchall()
+  assert dense_sizes == [(4096,)]
+  assert os.path.getsize(sketch_path) < os.path.getsize(register_rows_path)
+
+def test_export_deduplicated(mock_duckdb_connection, tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'con', mock_duckdb_connection)
+  monkeypatch.setattr(transformer, 'event_index', EventIdIndex(str(tmp_path / "event_id_index")))
+  staged_paths = {}
+  for hour, first_id in ((10, 0), (11, 90)):
+    # the second hour repeats the last 10 events of the first one
+    staged_paths[hour] = str(tmp_path / f"staged_{hour}.parquet")
+    mock_duckdb_connection.execute(f"""
+      COPY (SELECT range::VARCHAR AS event_id, 'PushEvent' AS event_type FROM range({first_id}, {first_id} + 100))
+      TO '{staged_paths[hour]}' (FORMAT PARQUET)
+    """)
+  assert transformer.export_deduplicated(staged_paths[10], str(tmp_path / "clean_10.parquet"), datetime(2023, 1, 1, 10)) == 0
+  assert transformer.export_deduplicated(staged_paths[11], str(tmp_path / "clean_11.parquet"), datetime(2023, 1, 1, 11)) == 10
+  assert mock_duckdb_connection.execute(f"SELECT min(event_id::INT), count(*) FROM '{tmp_path}/clean_11.parquet'").fetchone() == (100, 90)
+  # serialising an hour again does not drop the events it kept the first time
+  assert transformer.export_deduplicated(staged_paths[10], str(tmp_path / "clean_10.parquet"), datetime(2023, 1, 1, 10)) == 0
+
+def test_read_silver_data(mock_duckdb_connection, tmp_path, monkeypatch):
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events')
+  monkeypatch.setattr(transformer, 'con', mock_duckdb_connection)
+  for day in (1, 2):
+    mock_duckdb_connection.execute(f"""
+      COPY (SELECT range::VARCHAR AS event_id, range % 10 AS repo_id, ['PushEvent', 'WatchEvent'][range % 2 + 1] AS event_type,
+                   TIMESTAMP '2023-01-0{day} 10:00:00' AS event_date FROM range(1000))
+      TO '{tmp_path}/clean_2023010{day}.parquet' (FORMAT PARQUET)
+    """)
+  monkeypatch.setattr(transformer, '_daily_source_files',
+                      lambda zone, dataset, process_date, *args: [str(tmp_path / f"clean_2023010{process_date.day}.parquet")])
+  reader = transformer.read_silver_data(datetime(2023, 1, 1), datetime(2023, 1, 2), columns=['repo_id', 'event_type'],
+                                        filters={'repo_id': (2, 3), 'event_type': 'PushEvent'}, batch_size=50)
+  assert reader.schema.names == ['repo_id', 'event_type']
+  # the transformer connection stays usable while the reader is consumed
+  assert mock_duckdb_connection.execute("SELECT 42").fetchone() == (42,)
+  batches = list(reader)
+  assert max(batch.num_rows for batch in batches) <= 50
+  assert sum(batch.num_rows for batch in batches) == 200
+  assert {row['repo_id'] for batch in batches for row in batch.to_pylist()} == {2}
@@ -0,0 +1,40 @@
+import sys
+import os
+import configparser
+import pytest
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import duckdb_connection
+from duckdb_connection import create_duckdb_connection, shared_duckdb_connection
+
+@pytest.fixture
+def duckdb_config(tmp_path):
+  config = configparser.ConfigParser()
+  config.read_dict({'duckdb': {
+    'threads': '2',
+    'memory_limit': '512MB',
+    'temp_directory': str(tmp_path / 'spill'),
+    'enable_object_cache': 'true',
+  }})
+  return config
+
+def test_create_duckdb_connection_settings(duckdb_config, tmp_path):
+  con = create_duckdb_connection(duckdb_config)
+  assert con.execute("SELECT current_setting('threads')").fetchone()[0] == 2
+  assert con.execute("SELECT current_setting('temp_directory')").fetchone()[0] == str(tmp_path / 'spill')
+  assert con.execute("SELECT current_setting('enable_object_cache')").fetchone()[0] is True
+  assert con.execute("SELECT loaded FROM duckdb_extensions() WHERE extension_name = 'httpfs'").fetchone()[0]
+  con.close()
+
+def test_missing_extension_without_install(duckdb_config, tmp_path):
+  duckdb_config.read_dict({'duckdb': {'extension_directory': str(tmp_path / 'empty'),
+                                      'allow_extension_install': 'false'}})
+  with pytest.raises(RuntimeError):
+    create_duckdb_connection(duckdb_config)
+
+def test_shared_duckdb_connection(duckdb_config, monkeypatch):
+  monkeypatch.setattr(duckdb_connection, '_shared_connection', None)
+  con = shared_duckdb_connection(duckdb_config)
+  assert shared_duckdb_connection(duckdb_config) is con
+  con.close()
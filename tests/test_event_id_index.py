@@ -0,0 +1,28 @@
+import sys
+import os
+import duckdb
+from datetime import datetime
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from event_id_index import EventIdIndex
+
+def test_window_files_and_expire(tmp_path, caplog):
+  index = EventIdIndex(str(tmp_path), window_hours=2, retention_hours=4)
+  con = duckdb.connect()
+  for hour in (7, 9, 10, 11, 13):
+    index.record_hour(con, "SELECT range AS event_id FROM range(3)", datetime(2024, 1, 1, hour))
+  # hour 7 is more than 4 hours older than the newest indexed hour, 13
+  assert not os.path.exists(index.hour_path(datetime(2024, 1, 1, 7)))
+  # the hour itself and the hours outside of the window are not deduplicated against
+  assert index.window_files(datetime(2024, 1, 1, 10, 30)) == [index.hour_path(datetime(2024, 1, 1, hour)) for hour in (9, 11)]
+  # re-serialising an hour whose neighbours expired is logged
+  with caplog.at_level('WARNING'):
+    assert index.window_files(datetime(2024, 1, 1, 6)) == []
+  assert "retention" in caplog.text
+  # a backfill of old hours keeps the files within the window of the hour it serialises
+  for hour in (0, 1):
+    index.record_hour(con, "SELECT range AS event_id FROM range(3)", datetime(2023, 12, 1, hour))
+  assert index.window_files(datetime(2023, 12, 1, 1)) == [index.hour_path(datetime(2023, 12, 1, 0))]
+  # once the backfill moved on, they expire
+  assert sorted(index.expire()) == [index.hour_path(datetime(2023, 12, 1, hour)) for hour in (0, 1)]
@@ -0,0 +1,80 @@
+import sys
+import os
+import pytest
+from datetime import datetime
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lake_manifest import LakeManifest
+
+@pytest.fixture
+def manifest(tmp_path):
+  return LakeManifest(str(tmp_path / "lake_manifest.duckdb"))
+
+def hourly_path(hour):
+  return f"s3://silver/gharchive/events/2024-01-01/{hour:02d}/clean_20240101_{hour:02d}.parquet"
+
+def test_record_and_list_files(manifest):
+  for hour in (5, 6):
+    manifest.record_file(hourly_path(hour), 'silver', 'gharchive/events', datetime(2024, 1, 1, hour), hour,
+                         row_count=10, byte_size=100, schema_version=1)
+  manifest.record_file("s3://silver/gharchive/events/2024-01-02/00/clean_20240102_00.parquet",
+                       'silver', 'gharchive/events', datetime(2024, 1, 2), 0)
+  assert manifest.list_files('silver', 'gharchive/events', datetime(2024, 1, 1)) == [hourly_path(5), hourly_path(6)]
+  assert len(manifest.list_files('silver', 'gharchive/events', datetime(2024, 1, 1), datetime(2024, 1, 2))) == 3
+  assert manifest.list_files('gold', 'gharchive/events', datetime(2024, 1, 1)) == []
+  assert manifest.hourly_files('silver', 'gharchive/events', datetime(2024, 1, 1, 6), datetime(2024, 1, 2, 0)) == \
+    [hourly_path(6), "s3://silver/gharchive/events/2024-01-02/00/clean_20240102_00.parquet"]
+  # recording the same path again replaces the entry
+  manifest.record_file(hourly_path(5), 'silver', 'gharchive/events', datetime(2024, 1, 1, 5), 5)
+  assert manifest.list_files('silver', 'gharchive/events', datetime(2024, 1, 1)) == [hourly_path(5), hourly_path(6)]
+
+def test_list_files_column_filters(manifest):
+  manifest.record_file(hourly_path(5), 'silver', 'gharchive/events', datetime(2024, 1, 1, 5), 5,
+                       column_stats={'repo_id': (1, 9), 'event_type': ('ForkEvent', 'PushEvent')})
+  manifest.record_file(hourly_path(6), 'silver', 'gharchive/events', datetime(2024, 1, 1, 6), 6,
+                       column_stats={'repo_id': (10, 99)})
+  manifest.record_file(hourly_path(7), 'silver', 'gharchive/events', datetime(2024, 1, 1, 7), 7)
+  day = datetime(2024, 1, 1)
+  # files without statistics are always kept
+  assert manifest.list_files('silver', 'gharchive/events', day, column_filters={'repo_id': 50}) == [hourly_path(6), hourly_path(7)]
+  assert manifest.list_files('silver', 'gharchive/events', day, column_filters={'repo_id': (5, 12)}) == \
+    [hourly_path(5), hourly_path(6), hourly_path(7)]
+  assert manifest.list_files('silver', 'gharchive/events', day, column_filters={'event_type': 'WatchEvent'}) == \
+    [hourly_path(6), hourly_path(7)]
+
+def test_missing_hours(manifest):
+  for hour in range(24):
+    if hour != 13:
+      manifest.record_file(hourly_path(hour), 'silver', 'gharchive/events', datetime(2024, 1, 1, hour), hour)
+  assert manifest.missing_hours('silver', 'gharchive/events', datetime(2024, 1, 1)) == [13]
+  assert manifest.missing_hours('silver', 'gharchive/events', datetime(2024, 1, 2)) == list(range(24))
+
+def test_replace_files(manifest):
+  for hour in range(24):
+    manifest.record_file(hourly_path(hour), 'silver', 'gharchive/events', datetime(2024, 1, 1, hour), hour)
+  compacted_path = "s3://silver/gharchive/events/2024-01-01/compacted/clean_20240101_000.parquet"
+  manifest.replace_files([hourly_path(hour) for hour in range(24)], [
+    dict(path=compacted_path, zone='silver', dataset='gharchive/events', partition_date=datetime(2024, 1, 1))])
+  assert manifest.list_files('silver', 'gharchive/events', datetime(2024, 1, 1)) == [compacted_path]
+  assert manifest.daily_files('silver', 'gharchive/events', datetime(2024, 1, 1)) == [compacted_path]
+  assert manifest.missing_hours('silver', 'gharchive/events', datetime(2024, 1, 1)) == []
+
+def test_stale_partitions(manifest):
+  day = datetime(2024, 1, 1)
+  for hour in (5, 6):
+    manifest.record_file(hourly_path(hour), 'silver', 'gharchive/events', datetime(2024, 1, 1, hour), hour)
+  stale = lambda: manifest.stale_partitions('gold', 'gharchive/events', 'silver', 'gharchive/events', day, datetime(2024, 1, 31))
+  # a day that was never built is stale
+  assert stale() == [day]
+  manifest.record_lineage('gold', 'gharchive/events', day, manifest.file_versions('silver', 'gharchive/events', day))
+  assert stale() == []
+  # a late hour, a rewritten hour and a removed hour all make the day stale again
+  manifest.record_file(hourly_path(7), 'silver', 'gharchive/events', datetime(2024, 1, 1, 7), 7)
+  assert stale() == [day]
+  manifest.record_lineage('gold', 'gharchive/events', day, manifest.file_versions('silver', 'gharchive/events', day))
+  manifest.record_file(hourly_path(5), 'silver', 'gharchive/events', datetime(2024, 1, 1, 5), 5)
+  assert stale() == [day]
+  manifest.record_lineage('gold', 'gharchive/events', day, manifest.file_versions('silver', 'gharchive/events', day))
+  manifest.replace_files([hourly_path(6)], [])
+  assert stale() == [day]
@@ -0,0 +1,98 @@
+import sys
+import os
+import time
+import pytest
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from object_cache import LocalObjectCache, parse_byte_size
+
+class MockS3Client:
+  """Serves objects from a dictionary, with the ETag of their content."""
+  def __init__(self, objects):
+    self.objects = objects
+    self.downloads = 0
+
+  def head_object(self, Bucket, Key):
+    return {'ETag': f'"{hash(self.objects[(Bucket, Key)])}"'}
+
+  def download_file(self, bucket, key, path):
+    self.downloads += 1
+    with open(path, 'wb') as f:
+      f.write(self.objects[(bucket, key)])
+
+def test_read_through_and_etag(tmp_path):
+  s3_client = MockS3Client({('silver', 'events/2024-01-01/05/clean.parquet'): b"v1"})
+  cache = LocalObjectCache(str(tmp_path), 1024, lambda: s3_client)
+  local_path = cache.get('s3://silver/events/2024-01-01/05/clean.parquet')
+  # the local copy keeps the key of the object, e.g. for partitions read from the filename
+  assert local_path.endswith('/silver/events/2024-01-01/05/clean.parquet')
+  assert cache.get('s3://silver/events/2024-01-01/05/clean.parquet') == local_path
+  assert s3_client.downloads == 1
+  # a new version of the object has another ETag, so it is fetched again
+  s3_client.objects[('silver', 'events/2024-01-01/05/clean.parquet')] = b"v2"
+  with open(cache.get('s3://silver/events/2024-01-01/05/clean.parquet'), 'rb') as f:
+    assert f.read() == b"v2"
+  assert cache.stats() == {'hits': 1, 'misses': 2, 'hit_rate': 0.3333, 'bytes_fetched': 4}
+
+def test_lru_eviction(tmp_path):
+  s3_client = MockS3Client({('bronze', f"key{i}"): b"x" * 100 for i in range(3)})
+  cache = LocalObjectCache(str(tmp_path), 250, lambda: s3_client, eviction_grace_seconds=0)
+  paths = [cache.get(f"s3://bronze/key{i}") for i in range(2)]
+  # key0 is used again, so key1 is the least recently used object
+  old_time = time.time() - 10
+  os.utime(paths[1], (old_time, old_time))
+  cache.get("s3://bronze/key0")
+  cache.get("s3://bronze/key2")
+  assert os.path.exists(paths[0]) and not os.path.exists(paths[1])
+
+def test_held_objects_are_not_evicted(tmp_path):
+  s3_client = MockS3Client({('silver', f"day/{i:02d}/clean.parquet"): b"x" * 100 for i in range(4)})
+  cache = LocalObjectCache(str(tmp_path), 150, lambda: s3_client, eviction_grace_seconds=0)
+  with cache.holding() as hold:
+    # the files of a job outgrow the cache, the ones fetched first are still there when its query runs
+    paths = [cache.get(f"s3://silver/day/{i:02d}/clean.parquet", hold) for i in range(4)]
+    old_time = time.time() - 120
+    for path in paths:
+      os.utime(path, (old_time, old_time))
+    assert cache.evict() == []
+    assert all(os.path.exists(path) for path in paths)
+  # once released they are evicted, with the directories of their versions
+  assert len(cache.evict()) == 3
+  assert len(os.listdir(tmp_path / "objects")) == 1
+
+def test_objects_evicted_while_got_are_fetched_again(tmp_path):
+  s3_client = MockS3Client({('bronze', "key0"): b"x" * 100})
+  cache = LocalObjectCache(str(tmp_path), 1024, lambda: s3_client)
+  path = cache.get("s3://bronze/key0")
+  # another worker sharing the directory evicts the object right after its ETag was checked
+  other_worker = LocalObjectCache(str(tmp_path), 0, lambda: s3_client, eviction_grace_seconds=0)
+  head_object = s3_client.head_object
+  def head_then_evict(Bucket, Key):
+    response = head_object(Bucket, Key)
+    other_worker.evict()
+    return response
+  s3_client.head_object = head_then_evict
+  with cache.holding() as hold:
+    assert cache.get("s3://bronze/key0", hold) == path
+    assert os.path.exists(path) and s3_client.downloads == 2
+    assert other_worker.evict() == []
+
+def test_pins_of_stopped_processes_are_ignored(tmp_path):
+  s3_client = MockS3Client({('bronze', "key0"): b"x" * 100, ('bronze', "key1"): b"x" * 100})
+  cache = LocalObjectCache(str(tmp_path), 150, lambda: s3_client, eviction_grace_seconds=0)
+  path = cache.get("s3://bronze/key0")
+  old_time = time.time() - 120
+  os.utime(path, (old_time, old_time))
+  # a pin left by a crashed process, whose pid is no longer running
+  pid = 2 ** 22 + 1
+  open(f"{path}.{pid}-0123.pin", 'w').close()
+  cache.get("s3://bronze/key1")
+  assert not os.path.exists(path) and not os.path.exists(f"{path}.{pid}-0123.pin")
+
+def test_parse_byte_size():
+  assert parse_byte_size('10GB') == 10 * 1024 ** 3
+  assert parse_byte_size('512 mb') == 512 * 1024 ** 2
+  assert parse_byte_size(2048) == 2048
+  with pytest.raises(ValueError):
+    parse_byte_size('ten')
@@ -0,0 +1,79 @@
+import sys
+import os
+import json
+import pytest
+import duckdb
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline_metrics import JsonLinesMetricsSink, StageMetrics, ProgressLogger
+from data_lake_transformer import DataLakeTransformer
+
+class ListMetricsSink:
+  """Keeps the emitted records in memory."""
+  def __init__(self):
+    self.records = []
+
+  def emit(self, record):
+    self.records.append(record)
+
+def test_json_lines_sink(tmp_path):
+  sink = JsonLinesMetricsSink(str(tmp_path / "metrics.jsonl"))
+  with StageMetrics('ingest', '2024-01-01T05:00:00', sink) as stage_metrics:
+    stage_metrics.add('bytes_uploaded', 10)
+    stage_metrics.add('bytes_uploaded', 5)
+  with pytest.raises(ValueError):
+    with StageMetrics('ingest', '2024-01-01T06:00:00', sink):
+      raise ValueError("download failed")
+  with open(tmp_path / "metrics.jsonl") as f:
+    records = [json.loads(line) for line in f]
+  assert [record['status'] for record in records] == ['succeeded', 'failed']
+  assert records[0]['bytes_uploaded'] == 15
+  assert records[1]['error'] == "download failed"
+  assert records[0]['wall_time_seconds'] >= 0
+  assert records[0]['process_peak_rss_mb'] > 0
+  assert 0 <= records[0]['peak_rss_growth_mb'] <= records[0]['process_peak_rss_mb']
+
+def test_progress_logger_is_rate_limited(caplog):
+  stage_metrics = StageMetrics('ingest', '2024-01-01T05:00:00')
+  progress = ProgressLogger("Upload of key", interval_seconds=3600, stage_metrics=stage_metrics, counter='bytes_uploaded')
+  with caplog.at_level('INFO'):
+    for _ in range(100):
+      progress(1024)
+    progress.finish()
+  assert len(caplog.records) == 1
+  assert "102400 bytes" in caplog.records[0].getMessage()
+  assert stage_metrics.counters['bytes_uploaded'] == 102400
+
+def test_add_profile_keys(tmp_path):
+  # the layout of a DuckDB 1.1 profile, with neither operator names nor a latency key
+  profile = {'operator_timing': 0.5, 'cumulative_rows_scanned': 100, 'children': [
+    {'operator_type': 'COPY_TO_FILE', 'operator_timing': 0.01, 'operator_cardinality': 1, 'children': [
+      {'operator_type': 'HASH_GROUP_BY', 'operator_timing': 0.3, 'operator_cardinality': 7, 'children': [
+        {'operator_type': 'TABLE_SCAN', 'operator_timing': 0.1, 'operator_cardinality': 100, 'children': []}]}]}]}
+  stage_metrics = StageMetrics('aggregate', '2024-01-01', operator_profiles=True)
+  stage_metrics.add_profile('aggregate', profile)
+  step, = stage_metrics.steps
+  assert (step['latency_seconds'], step['rows_in'], step['rows_out']) == (0.5, 100, 7)
+  assert [operator['operator'] for operator in step['operators']] == ['COPY_TO_FILE', 'HASH_GROUP_BY', 'TABLE_SCAN']
+
+def test_transformer_stage_profiles(tmp_path):
+  sink = ListMetricsSink()
+  con = duckdb.connect(':memory:')
+  transformer = DataLakeTransformer(dataset_base_path='gharchive/events', con=con, metrics_sink=sink)
+  con.execute("""
+    CREATE TABLE gharchive_raw AS SELECT
+      range AS id, {'id': range % 7, 'login': 'user', 'display_login': 'User'} AS actor, 'PushEvent' AS type,
+      {'id': range % 3, 'name': 'repo', 'url': 'https://github.com/repo'} AS repo, '2024-01-01 05:00:00' AS created_at
+    FROM range(100)
+  """)
+  sink_path = str(tmp_path / "clean.parquet")
+  with transformer._stage_metrics('serialise', '2024-01-01T05:00:00'):
+    with transformer._profiled('serialise'):
+      transformer.copy_to_parquet(transformer._clean_gharchive_query('gharchive_raw'), sink_path)
+  record = sink.records[0]
+  assert record['stage'] == 'serialise'
+  assert record['rows_in'] == 100
+  assert record['rows_out'] == 100
+  assert record['steps'][0]['step'] == 'serialise'
+  assert 'COPY_TO_FILE' in [operator['operator'] for operator in record['steps'][0]['operators']]
@@ -0,0 +1,97 @@
+import sys
+import os
+import time
+import pytest
+from datetime import datetime, timedelta
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline_scheduler import PipelineScheduler
+
+class MockIngester:
+  def __init__(self, landed_hours=()):
+    self.landed_hours = set(landed_hours)
+    self.ingested = []
+
+  def bronze_object_exists(self, process_date):
+    return process_date in self.landed_hours
+
+  def ingest_hourly_gharchive(self, process_date):
+    self.ingested.append(process_date)
+
+  def ingest_and_serialise_hourly(self, process_date, transformer):
+    self.ingested.append(process_date)
+    transformer.serialise_raw_data(process_date)
+
+class MockTransformer:
+  def __init__(self):
+    self.serialised = []
+    self.aggregated = []
+
+  def serialise_raw_data(self, process_date):
+    self.serialised.append(process_date)
+
+  def aggregate_silver_data(self, process_date):
+    self.aggregated.append(process_date)
+
+def run_until_idle(scheduler, now, passes=5):
+  # every pass submits the stages whose inputs completed in the previous one
+  for _ in range(passes):
+    scheduler.run_once(now)
+    while scheduler._in_flight:
+      time.sleep(0.01)
+
+@pytest.fixture
+def scheduler_factory(tmp_path):
+  def factory(ingester):
+    transformer = MockTransformer()
+    scheduler = PipelineScheduler('gharchive/events', ingester=ingester, transformer_factory=lambda: transformer)
+    scheduler.state_path = str(tmp_path / 'state.json')
+    scheduler.state = {stage: set() for stage in scheduler.STAGES}
+    return scheduler, transformer
+  return factory
+
+def test_stages_are_triggered_by_their_inputs(scheduler_factory):
+  now = datetime.utcnow().replace(minute=5)
+  last_hour = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+  ingester = MockIngester(landed_hours=[last_hour])
+  scheduler, transformer = scheduler_factory(ingester)
+  scheduler.lookback_hours = 3
+  run_until_idle(scheduler, now)
+  # the landed hour is serialised without being ingested again
+  assert last_hour not in ingester.ingested
+  assert len(ingester.ingested) == 2
+  assert sorted(transformer.serialised) == [last_hour - timedelta(hours=h) for h in (2, 1, 0)]
+  assert transformer.aggregated == []
+
+def test_day_is_aggregated_once_complete_and_state_resumes(scheduler_factory):
+  day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+  scheduler, transformer = scheduler_factory(MockIngester())
+  scheduler.state['serialise'] = {(day + timedelta(hours=h)).strftime("%Y-%m-%d-%H") for h in range(23)}
+  scheduler.lookback_hours = 24
+  scheduler._save_state()
+  # 23 hours are not enough to aggregate the day
+  assert scheduler._complete_days() == []
+  now = day + timedelta(days=1, minutes=5)
+  run_until_idle(scheduler, now)
+  assert transformer.aggregated == [day]
+  # a restarted scheduler resumes from the persisted state
+  resumed, resumed_transformer = scheduler_factory(MockIngester())
+  resumed.state_path = scheduler.state_path
+  resumed.state = resumed._load_state()
+  assert scheduler._day_key(day) in resumed.state['aggregate']
+  run_until_idle(resumed, now)
+  assert resumed_transformer.serialised == []
+  assert resumed_transformer.aggregated == []
+
+def test_ingest_and_serialise(scheduler_factory):
+  now = datetime.utcnow().replace(minute=5)
+  ingester = MockIngester()
+  scheduler, transformer = scheduler_factory(ingester)
+  scheduler.lookback_hours = 2
+  scheduler.ingest_and_serialise = True
+  run_until_idle(scheduler, now)
+  # every hour is serialised once, by its ingest stage
+  assert sorted(transformer.serialised) == sorted(ingester.ingested)
+  assert len(transformer.serialised) == 2
+  assert scheduler.state['serialise'] == scheduler.state['ingest']
@@ -0,0 +1,30 @@
+import sys
+import os
+import pytest
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from schema_registry import SchemaRegistry
+
+@pytest.fixture
+def schema_registry(tmp_path):
+  return SchemaRegistry(schema_dir=str(tmp_path))
+
+def test_register_schema_versions(schema_registry, tmp_path):
+  assert schema_registry.register_schema('events', {'id': 'VARCHAR'}) == 1
+  assert schema_registry.register_schema('events', {'id': 'BIGINT', 'type': 'VARCHAR'}) == 2
+  assert schema_registry.current_version('events') == 2
+  assert schema_registry.get_schema('events', 1) == {'id': 'VARCHAR'}
+  assert schema_registry.get_schema('events') == {'id': 'BIGINT', 'type': 'VARCHAR'}
+  # versions are persisted and visible to a new registry
+  assert SchemaRegistry(schema_dir=str(tmp_path)).get_schema('events', 1) == {'id': 'VARCHAR'}
+  with pytest.raises(KeyError):
+    schema_registry.get_schema('events', 3)
+
+def test_duckdb_columns(schema_registry):
+  schema_registry.register_schema('events', {'id': 'VARCHAR', 'repo': 'STRUCT(id BIGINT, name VARCHAR)'})
+  assert schema_registry.duckdb_columns('events') == "{'id': 'VARCHAR', 'repo': 'STRUCT(id BIGINT, name VARCHAR)'}"
+
+def test_gharchive_events_schema():
+  columns = SchemaRegistry().get_schema('gharchive_events')
+  assert set(columns) == {'id', 'type', 'actor', 'repo', 'created_at'}